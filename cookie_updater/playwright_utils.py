@@ -3,7 +3,7 @@ import time
 
 from bot.loader_bot import bot
 from playwright.async_api import async_playwright
-from database.DataBase import async_connect_to_database
+from database.DataBase import async_connect_to_database, close_async_pool
 import logging
 from context_logger import ContextLogger
 from bot.states import set_status, get_status
@@ -295,7 +295,8 @@ async def get_and_store_cookies(page=None, conn=None):
         pass
     finally:
         try:
-            await conn.close()
+            # сбрасываем общий пул: при перезапуске будет создан новый
+            await close_async_pool()
         except:
             pass
         try:
@@ -1,3 +1,6 @@
+import asyncio
+import weakref
+
 import psycopg2
 import asyncpg
 import os
@@ -20,6 +23,18 @@ DATABASE_CONFIG = {
     'port': 5432,
 }
 
+# Настройки общего пула asyncpg (один пул на процесс и event loop)
+POOL_CONFIG = {
+    'min_size': int(os.environ.get('POSTGRES_POOL_MIN_SIZE', 1)),
+    'max_size': int(os.environ.get('POSTGRES_POOL_MAX_SIZE', 10)),
+    # соединения, простаивающие дольше этого времени, закрываются пулом (сек)
+    'max_inactive_connection_lifetime': float(os.environ.get('POSTGRES_POOL_MAX_IDLE', 300)),
+    'command_timeout': float(os.environ.get('POSTGRES_COMMAND_TIMEOUT', 600)),
+}
+
+# event loop -> задача создания пула. Слабые ссылки, чтобы закрытые loop'ы django-q не копились
+_pools = weakref.WeakKeyDictionary()
+
 
 def connect_to_database():
     try:
@@ -30,24 +45,98 @@ def connect_to_database():
         return None
 
 
+async def _create_pool():
+    return await asyncpg.create_pool(
+        user=DATABASE_CONFIG['user'],
+        password=DATABASE_CONFIG['password'],
+        database=DATABASE_CONFIG['dbname'],
+        host=DATABASE_CONFIG['host'],
+        port=DATABASE_CONFIG['port'],
+        **POOL_CONFIG
+    )
+
+
+async def _pool_is_alive(pool) -> bool:
+    """Проверка здоровья пула: не закрыт и отвечает на SELECT 1."""
+    if pool.is_closing():
+        return False
+    try:
+        await pool.fetchval("SELECT 1")
+        return True
+    except Exception as e:
+        logger.warning(f"Пул соединений с БД не отвечает: {e}")
+        return False
+
+
 async def async_connect_to_database():
     """
     Асинхронное подключение к базе данных с использованием пула соединений.
+
+    Пул создаётся лениво один раз на процесс и event loop и переиспользуется всеми вызовами.
+    Закрывать его после использования НЕ нужно — это делает close_async_pool() при остановке.
     """
+    loop = asyncio.get_running_loop()
+
+    task = _pools.get(loop)
+    if task is None:
+        task = loop.create_task(_create_pool())
+        _pools[loop] = task
+
     try:
-        return await asyncpg.create_pool(
-            user=DATABASE_CONFIG['user'],
-            password=DATABASE_CONFIG['password'],
-            database=DATABASE_CONFIG['dbname'],
-            host=DATABASE_CONFIG['host'],
-            port=DATABASE_CONFIG['port']
-        )
+        pool = await asyncio.shield(task)
     except Exception as e:
+        if _pools.get(loop) is task:
+            del _pools[loop]
         logger.error(f"Ошибка подключения к базе данных: {e}")
         return None
 
+    if pool.is_closing():
+        # кто-то закрыл пул — пересоздаём
+        if _pools.get(loop) is task:
+            del _pools[loop]
+        return await async_connect_to_database()
+
+    return pool
+
+
+async def check_database_health() -> bool:
+    """
+    Проверить, что общий пул текущего event loop жив. Битый пул закрывается,
+    следующий async_connect_to_database() создаст новый.
+    """
+    pool = await async_connect_to_database()
+    if not pool:
+        return False
+
+    if await _pool_is_alive(pool):
+        return True
+
+    await close_async_pool()
+    return False
+
+
+async def close_async_pool():
+    """
+    Закрыть общий пул текущего event loop.
+    Вызывать перед остановкой loop: в задачах django-q и при shutdown FastAPI.
+    """
+    loop = asyncio.get_running_loop()
+    task = _pools.pop(loop, None)
+    if task is None:
+        return
+
+    try:
+        pool = await task
+    except Exception:
+        return
+
+    try:
+        await asyncio.wait_for(pool.close(), timeout=10)
+    except Exception as e:
+        logger.warning(f"Пул соединений закрыт принудительно: {e}")
+        pool.terminate()
+
 
 def close_connection(conn):
     if conn:
         conn.close()
-
@@ -0,0 +1,345 @@
+"""
+Бенчмарк индексов под запросы API.
+
+В отдельной схеме bench создаются копии таблиц (только колонки), заполняются синтетикой заданного
+масштаба, и для каждого запроса эндпоинтов снимается EXPLAIN ANALYZE дважды:
+  before — только первичные ключи и уникальные ограничения (то, что объявляли модели изначально);
+  after  — все индексы, которые сейчас есть у таблиц в рабочей схеме (после migrate).
+Рабочие таблицы не трогаются, схема bench удаляется в конце.
+
+Запуск в контейнере с доступом к БД:
+    python -m database.benchmark_indexes --cabinets 10 --cards 2000 --days 365 --output bench.json
+"""
+import argparse
+import asyncio
+import json
+import re
+import statistics
+from datetime import date, datetime, timedelta
+
+from database.DataBase import async_connect_to_database, close_async_pool
+from database.dimensions import DIMENSIONS_QUERY
+from database.fin_daily import FIN_DAILY_SUMS
+
+
+BENCH_SCHEMA = "bench"
+WAREHOUSES = 10
+
+# Таблица -> (сколько строк, выражения для колонок). В выражениях доступны:
+# i — номер строки, k — номер карточки, d — номер дня (для остатков — номер склада),
+# lk — кабинет карточки, nm — её nmid, ts — дата дня d. Колонки без выражения: NULL, если допустим,
+# иначе значение по типу. Строки фактов — по одной на (карточку, день), как в уникальных ключах
+SEED_TABLES = {
+    "myapp_wblk": ("cabinets", {"id": "i + 1", "inn": "7700000000 + i + 1", "name": "'lk ' || (i + 1)"}),
+    "myapp_nmids": ("cards", {
+        "id": "i + 1", "lk_id": "lk", "nmid": "nm", "vendorcode": "'art-' || k", "subjectname": "'предмет ' || k % 50",
+        "color": "(ARRAY['черный', 'белый', 'красный', 'синий'])[1 + k % 4]",
+        "photos": "'[]'", "dimensions": "'{\"height\": 10, \"length\": 20, \"width\": 30}'",
+    }),
+    "myapp_price": ("cards", {"id": "i + 1", "lk_id": "lk", "nmid": "nm", "vendorcode": "' ART-' || k || ' '"}),
+    "myapp_adverts": ("adverts", {"id": "i + 1", "lk_id": "1 + i % {cabinets}", "advert_id": "i"}),
+    "myapp_findata": ("facts", {
+        "id": "i + 1", "lk_id": "lk", "nmid": "nm", "rrd_id": "i::text", "rr_dt": "ts", "sale_dt": "ts",
+        "order_dt": "ts", "ts_name": "(ARRAY['s', 'm', 'l'])[1 + i % 3]",
+        "supplier_oper_name": "(ARRAY['продажа', 'возврат', 'логистика'])[1 + i % 3]",
+        "deduction": "(i % 10)::float", "retail_amount": "(i % 1000)::float",
+    }),
+    "myapp_savedata": ("facts", {
+        "id": "i + 1", "lk_id": "lk", "nmid": "nm", "date_wb": "ts", "size": "'m'", "calcType": "'короба'",
+    }),
+    "myapp_productsstat": ("facts", {"id": "i + 1", "nmid": "nm", "date_wb": "ts"}),
+    "myapp_orders": ("facts", {
+        "id": "i + 1", "lk_id": "lk", "nmid": "nm", "date": "ts", "techsize": "'m'", "warehouse": "'Коледино'",
+    }),
+    "myapp_advstat": ("facts", {
+        "id": "i + 1", "nmid": "nm", "date_wb": "ts", "advert_id": "k % {adverts}", "app_type": "1",
+    }),
+    "myapp_regionsales": ("facts", {
+        "id": "i + 1", "lk_id": "lk", "nmid": "nm", "date_wb": "ts", "sa": "'art-' || k",
+        "cityName": "'Москва'", "regionName": "'Москва'",
+    }),
+    "myapp_stocks": ("stocks", {
+        "id": "i + 1", "lk_id": "lk", "nmid": "nm", "warehousename": "'склад ' || d", "warehouse_id": "d",
+        "supplierarticle": "'art-' || k", "techsize": "'m'",
+    }),
+    "myapp_findaily": (None, {}),  # заполняется из myapp_findata
+}
+
+TYPE_DEFAULTS = {
+    "smallint": "(i % 100)",
+    "integer": "(i % 1000)",
+    "bigint": "(i % 1000)",
+    "real": "((i % 1000) * 1.5)",
+    "double precision": "((i % 1000) * 1.5)",
+    "numeric": "((i % 1000) * 1.5)",
+    "boolean": "false",
+    "character varying": "'x'",
+    "character": "'x'",
+    "text": "'x'",
+    "date": "ts::date",
+    "timestamp with time zone": "ts",
+    "timestamp without time zone": "ts",
+    "jsonb": "'{}'",
+    "json": "'{}'",
+}
+
+# Запросы эндпоинтов (как их строит fastapi_app/main.py) с фильтрами типичного отчета:
+# $1 — кабинеты, $2/$3 — период, $4 — артикулы, $5 — цвета, $6 — ИНН, $7 — артикулы продавца из гугл таблицы
+CARD_JOIN = "JOIN myapp_nmids n ON n.nmid = t.nmid AND n.lk_id = t.lk_id"
+CARD_FILTER = "n.lk_id = ANY($1::int[])"
+ENDPOINT_QUERIES = {
+    "resolve_lks": "SELECT id, inn FROM myapp_wblk WHERE inn = $6",
+    "fin_report": f"""
+        SELECT n.subjectname, n.vendorcode, n.color, t.nmid, t.retail_price, t.retail_amount, t.ppvz_for_pay,
+               t.delivery_rub, t.acceptance, t.rr_dt, t.sale_dt, t.supplier_oper_name, t.penalty, t.lk_id
+        FROM myapp_findata t {CARD_JOIN}
+        WHERE {CARD_FILTER} AND t.rr_dt > $2 AND t.rr_dt < $3
+    """,
+    "fin_report_articles": f"""
+        SELECT t.nmid, t.retail_amount, t.rr_dt, t.lk_id
+        FROM myapp_findata t {CARD_JOIN}
+        WHERE {CARD_FILTER} AND n.nmid = ANY($4::int[]) AND t.rr_dt > $2 AND t.rr_dt < $3
+    """,
+    "fin_report_save": f"""
+        SELECT n.subjectname, n.vendorcode, n.color, t.nmid, t."warehousePrice", t.date_wb, t.size, t.lk_id
+        FROM myapp_savedata t {CARD_JOIN}
+        WHERE {CARD_FILTER} AND t.date_wb > $2 AND t.date_wb < $3
+    """,
+    "fin_report_totals": f"""
+        SELECT lk_id, {", ".join(f"sum({col})" for col in FIN_DAILY_SUMS)}
+        FROM myapp_findaily
+        WHERE lk_id = ANY($1::int[]) AND day >= $2::date AND day <= $3::date
+        GROUP BY lk_id
+    """,
+    "products_stat": """
+        SELECT n.vendorcode, n.color, t.nmid, t.date_wb, t."ordersCount", t."ordersSumRub", n.lk_id
+        FROM myapp_productsstat t JOIN myapp_nmids n ON n.nmid = t.nmid
+        WHERE n.lk_id = ANY($1::int[]) AND t.date_wb >= $2 AND t.date_wb <= $3
+    """,
+    "orders": f"""
+        SELECT n.vendorcode, n.color, t.nmid, t.date, t.techsize, t.warehouse_id, t.ord_count, t.ord_sum, t.lk_id
+        FROM myapp_orders t {CARD_JOIN}
+        WHERE {CARD_FILTER} AND t.date >= $2 AND t.date <= $3
+    """,
+    "orders_colors": f"""
+        SELECT t.nmid, t.date, t.ord_count, t.lk_id
+        FROM myapp_orders t {CARD_JOIN}
+        WHERE {CARD_FILTER} AND n.color = ANY($5::text[]) AND t.date >= $2 AND t.date <= $3
+    """,
+    "quantity": f"""
+        SELECT n.vendorcode, n.color, t.nmid, t.techsize, t.quantity, t.inwaytoclient, t.inwayfromclient,
+               t.warehousename, t.lk_id
+        FROM myapp_stocks t {CARD_JOIN}
+        WHERE {CARD_FILTER} AND n.nmid = ANY($4::int[])
+    """,
+    "adv_conversion": """
+        SELECT n.vendorcode, n.color, t.nmid, t.date_wb, t.views, t.clicks, t.atbs, t.orders, t.sum_cost, n.lk_id
+        FROM myapp_advstat t JOIN myapp_nmids n ON n.nmid = t.nmid
+        WHERE n.lk_id = ANY($1::int[]) AND t.date_wb >= $2 AND t.date_wb <= $3
+    """,
+    "adv_cost": """
+        SELECT n.vendorcode, t.nmid, t.date_wb, t.sum_cost, a.type_adv, n.lk_id
+        FROM myapp_advstat t
+        JOIN myapp_nmids n ON n.nmid = t.nmid
+        LEFT JOIN myapp_adverts a ON a.advert_id = t.advert_id
+        WHERE n.lk_id = ANY($1::int[]) AND n.nmid = ANY($4::int[]) AND t.date_wb >= $2 AND t.date_wb <= $3
+    """,
+    "region_sales": f"""
+        SELECT n.vendorcode, n.color, t.nmid, t.date_wb, t."saleInvoiceCostPrice", t."saleItemInvoiceQty", t.lk_id
+        FROM myapp_regionsales t {CARD_JOIN}
+        WHERE {CARD_FILTER} AND t.date_wb >= $2 AND t.date_wb <= $3
+    """,
+    "aggregate_orders": f"""
+        SELECT date_trunc('week', timezone('Europe/Moscow', t.date)) AS period, t.nmid,
+               sum(t.ord_count), sum(t.ord_sum)
+        FROM myapp_orders t {CARD_JOIN}
+        WHERE {CARD_FILTER} AND t.date >= $2 AND t.date < $3
+        GROUP BY 1, 2 ORDER BY 1, 2
+    """,
+    "dimensions": DIMENSIONS_QUERY,
+    "cost_price": """
+        SELECT count(*)
+        FROM myapp_price p
+        JOIN unnest($7::text[]) AS v(vendorcode) ON LOWER(TRIM(v.vendorcode)) = LOWER(TRIM(p.vendorcode))
+    """,
+}
+
+
+def _query_args(sql: str, values: list) -> tuple:
+    """Параметры, которые реально упоминаются в запросе ($n): (значения, их номера)"""
+    used = sorted({int(n) for n in re.findall(r"\$(\d+)", sql)})
+    return [values[n - 1] for n in used], used
+
+
+def _renumber(sql: str, used: list) -> str:
+    for position, number in enumerate(used, start=1):
+        sql = re.sub(rf"\${number}(?!\d)", f"$__{position}", sql)
+    return sql.replace("$__", "$")
+
+
+async def _copy_tables(conn, source_schema: str) -> dict:
+    """Пустые копии таблиц в BENCH_SCHEMA. :return: {таблица: [(имя индекса, уникальный, определение)]}"""
+    await conn.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE")
+    await conn.execute(f"CREATE SCHEMA {BENCH_SCHEMA}")
+
+    indexes = {}
+    for table in SEED_TABLES:
+        await conn.execute(f"CREATE TABLE {BENCH_SCHEMA}.{table} (LIKE {source_schema}.{table})")
+        rows = await conn.fetch("""
+            SELECT i.indisunique AS is_unique, pg_get_indexdef(i.indexrelid) AS definition
+            FROM pg_index i
+            WHERE i.indrelid = to_regclass($1)
+        """, f"{source_schema}.{table}")
+        indexes[table] = [
+            (row["is_unique"], re.sub(r" ON (ONLY )?\S+ ", f" ON {BENCH_SCHEMA}.{table} ", row["definition"], count=1))
+            for row in rows
+        ]
+    return indexes
+
+
+async def _seed(conn, sizes: dict, start: date) -> None:
+    for table, (size_name, overrides) in SEED_TABLES.items():
+        if size_name is None:
+            continue
+        columns = await conn.fetch("""
+            SELECT column_name, data_type, is_nullable = 'YES' AS nullable
+            FROM information_schema.columns
+            WHERE table_schema = $1 AND table_name = $2
+            ORDER BY ordinal_position
+        """, BENCH_SCHEMA, table)
+
+        names, expressions = [], []
+        for column in columns:
+            name = column["column_name"]
+            if name in overrides:
+                expression = overrides[name]
+                for placeholder, size in sizes.items():
+                    expression = expression.replace(f"{{{placeholder}}}", str(size))
+            elif column["nullable"]:
+                continue
+            else:
+                expression = TYPE_DEFAULTS.get(column["data_type"], "NULL")
+            names.append(f'"{name}"')
+            expressions.append(f"({expression})::{column['data_type']}")
+
+        await conn.execute(f"""
+            INSERT INTO {BENCH_SCHEMA}.{table} ({", ".join(names)})
+            SELECT {", ".join(expressions)}
+            FROM (
+                SELECT i, k, d, 1 + k % {sizes['cabinets']} AS lk, 100000 + k AS nm,
+                       '{start.isoformat()}'::timestamptz + d * interval '1 day' AS ts
+                FROM (
+                    SELECT i, i % {sizes['cards']} AS k, i / {sizes['cards']} AS d
+                    FROM generate_series(0, {sizes[size_name]} - 1) AS i
+                ) g
+            ) g
+        """)
+
+    await conn.execute(f"""
+        INSERT INTO {BENCH_SCHEMA}.myapp_findaily (id, lk_id, day, rows_count, {", ".join(FIN_DAILY_SUMS)})
+        SELECT row_number() OVER (), lk_id, rr_dt::date, count(*),
+               {", ".join(f"coalesce(sum({col}), 0)" for col in FIN_DAILY_SUMS)}
+        FROM {BENCH_SCHEMA}.myapp_findata
+        GROUP BY lk_id, rr_dt::date
+    """)
+
+
+async def _explain(conn, values: list, repeat: int) -> dict:
+    """{запрос: медиана Execution Time, мс}"""
+    timings = {}
+    for name, sql in ENDPOINT_QUERIES.items():
+        args, used = _query_args(sql, values)
+        sql = _renumber(sql, used)
+        runs = []
+        for _ in range(repeat):
+            plan = json.loads(await conn.fetchval(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}", *args))
+            runs.append(plan[0]["Execution Time"])
+        timings[name] = round(statistics.median(runs), 2)
+    return timings
+
+
+async def run_benchmark(cabinets: int, cards: int, days: int, repeat: int = 3, keep: bool = False) -> dict:
+    pool = await async_connect_to_database()
+    if not pool:
+        raise Exception("Ошибка подключения к БД в run_benchmark")
+
+    sizes = {
+        "cabinets": cabinets,
+        "cards": cabinets * cards,
+        "adverts": max(cabinets * cards // 5, 1),
+        "facts": cabinets * cards * days,
+        "stocks": cabinets * cards * WAREHOUSES,
+    }
+    start = date.today() - timedelta(days=days)
+    # типичный запрос: три кабинета, последний месяц, 50 артикулов, два цвета
+    date_to = datetime.combine(date.today(), datetime.min.time())
+    values = [
+        list(range(1, min(cabinets, 3) + 1)),
+        date_to - timedelta(days=30),
+        date_to,
+        [100000 + k * cabinets for k in range(50)],
+        ["черный", "белый"],
+        7700000000 + 1,
+        [f"art-{k}" for k in range(500)],
+    ]
+
+    async with pool.acquire() as conn:
+        source_schema = await conn.fetchval("SELECT current_schema()")
+        try:
+            indexes = await _copy_tables(conn, source_schema)
+            await _seed(conn, sizes, start)
+            for table, table_indexes in indexes.items():
+                for is_unique, definition in table_indexes:
+                    if is_unique:
+                        await conn.execute(definition)
+            await conn.execute(f"SET search_path TO {BENCH_SCHEMA}")
+            await conn.execute("ANALYZE")
+            before = await _explain(conn, values, repeat)
+
+            for table, table_indexes in indexes.items():
+                for is_unique, definition in table_indexes:
+                    if not is_unique:
+                        await conn.execute(definition)
+            await conn.execute("ANALYZE")
+            after = await _explain(conn, values, repeat)
+        finally:
+            await conn.execute("RESET search_path")
+            if not keep:
+                await conn.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE")
+
+    return {
+        "sizes": sizes,
+        "queries": {name: {"before_ms": before[name], "after_ms": after[name]} for name in ENDPOINT_QUERIES},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="EXPLAIN ANALYZE запросов API до и после индексов")
+    parser.add_argument("--cabinets", type=int, default=10)
+    parser.add_argument("--cards", type=int, default=1000, help="карточек на кабинет")
+    parser.add_argument("--days", type=int, default=180, help="дней истории в таблицах фактов")
+    parser.add_argument("--repeat", type=int, default=3, help="прогонов каждого запроса (берётся медиана)")
+    parser.add_argument("--keep", action="store_true", help="не удалять схему bench")
+    parser.add_argument("--output", help="куда сохранить результат в JSON")
+    args = parser.parse_args()
+
+    async def run():
+        try:
+            return await run_benchmark(args.cabinets, args.cards, args.days, args.repeat, args.keep)
+        finally:
+            await close_async_pool()
+
+    report = asyncio.run(run())
+
+    print(f"{'запрос':<22}{'до, мс':>12}{'после, мс':>12}{'ускорение':>12}")
+    for name, timing in report["queries"].items():
+        speedup = timing["before_ms"] / timing["after_ms"] if timing["after_ms"] else 0
+        print(f"{name:<22}{timing['before_ms']:>12}{timing['after_ms']:>12}{speedup:>11.1f}x")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
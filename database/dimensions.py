@@ -0,0 +1,83 @@
+import asyncio
+import hashlib
+import logging
+from typing import Optional
+
+import redis
+
+from context_logger import ContextLogger
+from database.DataBase import async_connect_to_database
+
+logger = ContextLogger(logging.getLogger("database"))
+
+r = redis.Redis(host='redis_cache', port=6379, db=0)
+
+
+# Готовый JSON ответа /dimensions/ и его хэш. Пересобирается после загрузки карточек (get_nmids)
+DIMENSIONS_SNAPSHOT_KEY = "dimensions_snapshot"
+DIMENSIONS_SNAPSHOT_HASH_KEY = "dimensions_snapshot_hash"
+
+# {vendorcode: {inn, img_url, nmid, subjectname, dimensions}} собирается целиком в БД из колонок,
+# которые get_nmids раскладывает из photos и dimensions
+DIMENSIONS_QUERY = """
+    SELECT coalesce(jsonb_object_agg(
+        n.vendorcode,
+        jsonb_build_object(
+            'inn', l.inn,
+            'img_url', coalesce(n.img_url, 'пока пусто'),
+            'nmid', n.nmid,
+            'subjectname', n.subjectname,
+            'dimensions', jsonb_build_object('height', n.height, 'lenght', n.length, 'width', n.width)
+        )
+        ORDER BY n.id
+    ), '{}'::jsonb)::text AS snapshot
+    FROM myapp_nmids n
+    JOIN myapp_wblk l ON l.id = n.lk_id
+"""
+
+
+def card_img_url(photos: list) -> Optional[str]:
+    """Главное фото карточки: первое, у которого big оканчивается на /1.webp"""
+    for photo in photos or []:
+        big = photo.get("big") or ""
+        if big.endswith("/1.webp"):
+            return big
+    return None
+
+
+def get_dimensions_snapshot() -> Optional[bytes]:
+    """Сохранённый снимок или None, если его ещё нет (или редис недоступен)"""
+    try:
+        return r.get(DIMENSIONS_SNAPSHOT_KEY)
+    except redis.RedisError as e:
+        logger.error(f"Не удалось прочитать снимок /dimensions/: {e}")
+        return None
+
+
+async def refresh_dimensions_snapshot() -> bytes:
+    """
+    Пересобрать снимок /dimensions/. В редис пишется, только если содержимое изменилось.
+    :return: актуальный снимок
+    """
+    conn = await async_connect_to_database()
+    if not conn:
+        raise Exception("Ошибка подключения к БД в refresh_dimensions_snapshot")
+
+    snapshot = (await conn.fetchval(DIMENSIONS_QUERY)).encode()
+    digest = hashlib.sha1(snapshot).hexdigest()
+
+    # редис синхронный, а вызывают и из API — не держим event loop
+    await asyncio.to_thread(_store_dimensions_snapshot, snapshot, digest)
+    return snapshot
+
+
+def _store_dimensions_snapshot(snapshot: bytes, digest: str) -> None:
+    try:
+        if r.get(DIMENSIONS_SNAPSHOT_HASH_KEY) != digest.encode() or not r.exists(DIMENSIONS_SNAPSHOT_KEY):
+            with r.pipeline() as pipe:
+                pipe.set(DIMENSIONS_SNAPSHOT_KEY, snapshot)
+                pipe.set(DIMENSIONS_SNAPSHOT_HASH_KEY, digest)
+                pipe.execute()
+            logger.info("Снимок /dimensions/ обновлён")
+    except redis.RedisError as e:
+        logger.error(f"Не удалось сохранить снимок /dimensions/: {e}")
@@ -0,0 +1,71 @@
+import logging
+from datetime import date
+from typing import Iterable
+
+from context_logger import ContextLogger
+
+logger = ContextLogger(logging.getLogger("database"))
+
+
+# Суммы, которые ведутся в myapp_findaily; имена совпадают с колонками myapp_findata
+FIN_DAILY_SUMS = ["retail_amount", "ppvz_for_pay", "delivery_rub", "storage_fee", "deduction", "acceptance", "penalty"]
+
+# День строки — дата rr_dt по МСК. get_fin_report пишет rr_dt датой, asyncpg кладёт её как полночь по времени
+# контейнера (Europe/Moscow), т.е. 21:00 UTC предыдущего дня, а часовой пояс сессии БД — UTC. Поэтому и день,
+# и границы периода считаются явно в Europe/Moscow, а не через rr_dt::date.
+# Пересчитываются дни целиком, поэтому повторная загрузка тех же строк (upsert по rrd_id) ничего не удваивает
+FIN_DAILY_TIMEZONE = "Europe/Moscow"
+
+FIN_DAILY_REFRESH_QUERY = f"""
+    INSERT INTO myapp_findaily (lk_id, day, rows_count, {", ".join(FIN_DAILY_SUMS)})
+    SELECT lk_id, (rr_dt AT TIME ZONE '{FIN_DAILY_TIMEZONE}')::date AS day, count(*),
+           {", ".join(f"coalesce(sum({col}), 0)" for col in FIN_DAILY_SUMS)}
+    FROM myapp_findata
+    WHERE lk_id = $1
+      AND rr_dt >= $2::date::timestamp AT TIME ZONE '{FIN_DAILY_TIMEZONE}'
+      AND rr_dt < ($3::date + 1)::timestamp AT TIME ZONE '{FIN_DAILY_TIMEZONE}'
+    GROUP BY lk_id, day
+    ON CONFLICT (lk_id, day) DO UPDATE SET
+        rows_count = EXCLUDED.rows_count,
+        {", ".join(f"{col} = EXCLUDED.{col}" for col in FIN_DAILY_SUMS)}
+"""
+
+# Первый и последний день в myapp_findata кабинета и в его сводке
+FIN_DAILY_BOUNDS_QUERY = f"""
+    SELECT (f.date_from AT TIME ZONE '{FIN_DAILY_TIMEZONE}')::date AS date_from,
+           (f.date_to AT TIME ZONE '{FIN_DAILY_TIMEZONE}')::date AS date_to,
+           d.day_from, d.day_to
+    FROM (SELECT min(rr_dt) AS date_from, max(rr_dt) AS date_to FROM myapp_findata WHERE lk_id = $1) f,
+         (SELECT min(day) AS day_from, max(day) AS day_to FROM myapp_findaily WHERE lk_id = $1) d
+"""
+
+
+async def refresh_fin_daily(conn, lk_id: int, date_from: date, date_to: date) -> None:
+    """
+    Пересчитать myapp_findaily кабинета за дни [date_from, date_to] (включительно).
+    :param conn: пул или соединение asyncpg
+    """
+    await conn.execute(FIN_DAILY_REFRESH_QUERY, lk_id, date_from, date_to)
+
+
+async def refresh_fin_daily_for_rows(conn, lk_id: int, days: Iterable[date]) -> None:
+    """Пересчитать дни, в которые попали загруженные строки (days — их rr_dt)"""
+    days = list(days)
+    if days:
+        await refresh_fin_daily(conn, lk_id, min(days), max(days))
+
+
+async def backfill_fin_daily(conn, lk_id: int) -> None:
+    """
+    Собрать сводку кабинета заново по всей истории, если её нет или её границы не совпадают с myapp_findata:
+    первый запуск после появления таблицы или сводка, собранная до перехода на дни по МСК (там всё сдвинуто
+    на день назад). Дешёвая проверка по индексу, вызывается перед каждой загрузкой.
+    """
+    bounds = await conn.fetchrow(FIN_DAILY_BOUNDS_QUERY, lk_id)
+    if not bounds["date_from"]:
+        return
+    if (bounds["day_from"], bounds["day_to"]) == (bounds["date_from"], bounds["date_to"]):
+        return
+    await conn.execute("DELETE FROM myapp_findaily WHERE lk_id = $1", lk_id)
+    await refresh_fin_daily(conn, lk_id, bounds["date_from"], bounds["date_to"])
+    logger.info(f"Сводка myapp_findaily пересобрана для кабинета {lk_id}")
@@ -1,7 +1,10 @@
+import uuid
 from datetime import datetime
 
+import asyncpg
+
 from database.DataBase import async_connect_to_database
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Iterable, Sequence
 
 import logging
 from context_logger import ContextLogger
@@ -64,8 +67,6 @@ async def get_data_from_db(
         return all_fields
     except Exception as e:
         logger.error(f"Ошибка получения данных из {table_name}. Запрос {request}. Error: {e}")
-    finally:
-        await conn.close()
 
 
 async def add_set_data_from_db(
@@ -82,7 +83,6 @@ async def add_set_data_from_db(
     :param conflict_fields: Список полей, по которым проверяем конфликт (например, ["nmid", "lk_id"]). Если не передан, используется ["id"]
     :return: None
     """
-    need_close = False
     if not data:
         logger.warning("Нет данных для вставки/обновления.")
         return
@@ -92,7 +92,6 @@ async def add_set_data_from_db(
         conflict_fields = ["id"]
 
     if not conn:
-        need_close = True
         conn = await async_connect_to_database()
         if not conn:
             logger.warning("Ошибка подключения к БД в add_set_data_from_db")
@@ -132,6 +131,155 @@ async def add_set_data_from_db(
 
     except Exception as e:
         logger.exception(f"Ошибка при UPSERT в {table_name}: {e}")
-    finally:
-        if need_close:
-            await conn.close()
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+# Колонки, которые меняются при каждой загрузке и не входят в хэш строки
+ROW_HASH_EXCLUDE = ("updated_at", "added_db")
+
+
+async def bulk_upsert_to_db(
+    conn,
+    table_name: str,
+    columns: List[str],
+    records: Iterable[Sequence[Any]],
+    conflict_fields: List[str],
+    touch_updated_at: bool = True,
+    update_fields: Optional[List[str]] = None,
+    hash_column: Optional[str] = None,
+) -> int | Dict[str, int]:
+    """
+    Массовый UPSERT: записи потоком уходят через COPY во временную staging-таблицу,
+    затем сливаются в целевую одним INSERT ... SELECT ... ON CONFLICT DO UPDATE.
+
+    С hash_column в эту колонку пишется md5 обновляемых полей (кроме ROW_HASH_EXCLUDE), и строка при конфликте
+    обновляется, только если хэш изменился: неизменные строки не переписываются (ни WAL, ни мёртвых версий,
+    updated_at тоже не трогается).
+
+    Поведение как у add_set_data_from_db: updated_at = now() (если touch_updated_at и колонки нет в columns),
+    is_active = True для myapp_nmids, tag_ids и is_active при конфликте не перезаписываются.
+    Дубликаты по conflict_fields внутри одной пачки схлопываются — побеждает последняя запись.
+
+    :param conn: пул или соединение asyncpg. Если None — берётся общий пул
+    :param table_name: Название таблицы
+    :param columns: Названия столбцов в порядке значений в записи
+    :param records: Итерируемое кортежей/списков значений (можно генератор)
+    :param conflict_fields: Поля уникального ограничения, например ["nmid", "lk_id"]
+    :param touch_updated_at: Проставлять ли updated_at
+    :param update_fields: Какие поля обновлять при конфликте. По умолчанию все, кроме conflict_fields
+    :param hash_column: Колонка с хэшем строки, например "row_hash"
+    :return: Количество вставленных/обновлённых строк,
+        с hash_column — {"inserted": ..., "updated": ..., "unchanged": ...}
+    """
+    columns = list(columns)
+    extra_columns, extra_values = [], ()
+
+    if touch_updated_at and "updated_at" not in columns:
+        extra_columns.append("updated_at")
+        extra_values += (datetime.now(),)
+
+    if table_name == "myapp_nmids" and "is_active" not in columns:
+        extra_columns.append("is_active")
+        extra_values += (True,)
+
+    if extra_columns:
+        records = (tuple(record) + extra_values for record in records)
+        columns += extra_columns
+
+    columns_str = ", ".join(_quote(col) for col in columns)
+    conflict_str = ", ".join(_quote(col) for col in conflict_fields)
+
+    update_columns = [
+        col for col in columns
+        if col not in conflict_fields and col not in ("tag_ids", "is_active")
+        and (update_fields is None or col in update_fields or col in extra_columns)
+    ]
+    insert_str, select_str, where_str = columns_str, columns_str, ""
+    if hash_column:
+        hashed = [col for col in update_columns if col not in extra_columns and col not in ROW_HASH_EXCLUDE]
+        insert_str += f", {_quote(hash_column)}"
+        select_str += f", md5(ROW({', '.join(_quote(col) for col in hashed)})::text)"
+        update_columns.append(hash_column)
+        where_str = f" WHERE {table_name}.{_quote(hash_column)} IS DISTINCT FROM EXCLUDED.{_quote(hash_column)}"
+
+    if update_columns:
+        on_conflict = "DO UPDATE SET " + ", ".join(
+            f"{_quote(col)} = EXCLUDED.{_quote(col)}" for col in update_columns
+        ) + where_str
+    else:
+        on_conflict = "DO NOTHING"
+
+    merge_query = f"""
+        INSERT INTO {table_name} ({insert_str})
+        SELECT DISTINCT ON ({conflict_str}) {select_str}
+        FROM {{staging}}
+        ORDER BY {conflict_str}, ctid DESC
+        ON CONFLICT ({conflict_str}) {on_conflict}
+    """
+
+    try:
+        if hash_column:
+            # xmax = 0 у только что вставленной строки; пропущенные по хэшу строки RETURNING не возвращает
+            row = await bulk_merge_to_db(conn, table_name, columns, records, f"""
+                WITH merged AS ({merge_query} RETURNING (xmax = 0) AS inserted)
+                SELECT
+                    count(*) FILTER (WHERE inserted) AS inserted,
+                    count(*) FILTER (WHERE NOT inserted) AS updated,
+                    (SELECT count(*) FROM (SELECT DISTINCT {conflict_str} FROM {{staging}}) s) - count(*) AS unchanged
+                FROM merged
+            """, fetch=True)
+            return dict(row)
+        return await bulk_merge_to_db(conn, table_name, columns, records, merge_query)
+    except Exception as e:
+        logger.exception(f"Ошибка при массовом UPSERT в {table_name}: {e}")
+        raise
+
+
+async def bulk_merge_to_db(
+    conn,
+    table_name: str,
+    columns: List[str],
+    records: Iterable[Sequence[Any]],
+    merge_query: str,
+    fetch: bool = False,
+) -> int | asyncpg.Record:
+    """
+    Залить записи бинарным COPY во временную staging-таблицу с колонками columns из table_name
+    и выполнить merge_query (INSERT ... SELECT / UPDATE ... FROM) в той же транзакции.
+
+    :param conn: пул или соединение asyncpg. Если None — берётся общий пул
+    :param table_name: Таблица, по которой создаётся staging (колонки columns должны в ней быть)
+    :param columns: Названия столбцов в порядке значений в записи
+    :param records: Итерируемое кортежей/списков значений (можно генератор)
+    :param merge_query: SQL слияния, вместо {staging} подставляется имя staging-таблицы
+    :param fetch: merge_query возвращает строку (например, счётчики) — вернуть её
+    :return: Количество строк, затронутых merge_query, или строка результата при fetch
+    """
+    if conn is None:
+        conn = await async_connect_to_database()
+        if not conn:
+            raise Exception("Ошибка подключения к БД в bulk_merge_to_db")
+
+    staging = f"tmp_{table_name}_{uuid.uuid4().hex[:8]}"
+    columns_str = ", ".join(_quote(col) for col in columns)
+
+    async def run(connection):
+        async with connection.transaction():
+            # CREATE TABLE AS не копирует NOT NULL — в staging можно лить только часть колонок
+            await connection.execute(f"""
+                CREATE TEMP TABLE {staging} ON COMMIT DROP AS
+                SELECT {columns_str} FROM {table_name} WITH NO DATA
+            """)
+            await connection.copy_records_to_table(staging, records=records, columns=columns)
+            if fetch:
+                return await connection.fetchrow(merge_query.replace("{staging}", staging))
+            status = await connection.execute(merge_query.replace("{staging}", staging))
+        return int(status.split()[-1])
+
+    if isinstance(conn, asyncpg.Pool):
+        async with conn.acquire() as connection:
+            return await run(connection)
+    return await run(conn)
@@ -0,0 +1,219 @@
+import logging
+from datetime import date
+from typing import Dict, List, Optional
+
+from context_logger import ContextLogger
+from database.DataBase import async_connect_to_database
+
+logger = ContextLogger(logging.getLogger("database"))
+
+
+# Растущие таблицы фактов -> колонка, по которой они секционируются помесячно (по ней же фильтрует API).
+# Уникальные ограничения секционированной таблицы обязаны содержать эту колонку — все ограничения,
+# на которые опираются ON CONFLICT загрузки, её уже содержат (у FinData — unique_together rrd_id + rr_dt).
+# После перевода таблицы менять в модели уникальность без этой колонки нельзя: миграция упадёт.
+PARTITIONED_TABLES: Dict[str, str] = {
+    "myapp_findata": "rr_dt",
+    "myapp_advstat": "date_wb",
+    "myapp_productsstat": "date_wb",
+    "myapp_orders": "date",
+    "myapp_regionsales": "date_wb",
+    "myapp_savedata": "date_wb",
+    "myapp_celerylog": "timestamp",
+}
+
+# Сколько месяцев вперёд держать готовые секции
+PARTITIONS_AHEAD = 3
+
+# Таблица -> сколько месяцев истории оставлять подключенными. Более старые секции отключаются
+# и переносятся в схему PARTITION_ARCHIVE_SCHEMA (данные не удаляются). Нет в словаре — хранить всё
+PARTITION_RETENTION_MONTHS: Dict[str, int] = {
+    "myapp_celerylog": 3,
+}
+PARTITION_ARCHIVE_SCHEMA = "archive"
+
+
+def month_start(value: date, shift: int = 0) -> date:
+    """Первое число месяца value, сдвинутого на shift месяцев"""
+    index = value.year * 12 + value.month - 1 + shift
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_p{month:%Y%m}"
+
+
+async def is_partitioned(conn, table: str) -> bool:
+    return bool(await conn.fetchval(
+        "SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass($1)", table
+    ))
+
+
+async def create_month_partition(conn, table: str, month: date) -> bool:
+    """Создать секцию месяца, если её нет. :return: True, если секция создана"""
+    name = partition_name(table, month)
+    if await conn.fetchval("SELECT to_regclass($1) IS NOT NULL", name):
+        return False
+    await conn.execute(f"""
+        CREATE TABLE {name} PARTITION OF {table}
+        FOR VALUES FROM ('{month.isoformat()}') TO ('{month_start(month, 1).isoformat()}')
+    """)
+    return True
+
+
+async def _table_definitions(conn, table: str, key: str) -> List[str]:
+    """
+    SQL, которым на секционированной таблице восстанавливаются ограничения и индексы исходной.
+    Первичный ключ id становится уникальным (id, key): PRIMARY KEY запретил бы NULL в key,
+    а у части таблиц (date_wb) он допускается — такие строки попадают в секцию DEFAULT.
+    """
+    constraints = await conn.fetch("""
+        SELECT conname, contype, conindid, pg_get_constraintdef(oid) AS definition,
+               ARRAY(SELECT attname FROM pg_attribute
+                     WHERE attrelid = conrelid AND attnum = ANY(conkey)) AS columns
+        FROM pg_constraint
+        WHERE conrelid = $1::regclass AND contype IN ('p', 'u', 'f', 'c')
+    """, table)
+    definitions, constraint_indexes = [], set()
+    for row in constraints:
+        constraint_indexes.add(row["conindid"])
+        if row["contype"] == "p":
+            definitions.append(f'ALTER TABLE {table} ADD CONSTRAINT "{row["conname"]}" UNIQUE (id, "{key}")')
+        elif row["contype"] == "u" and key not in row["columns"]:
+            raise Exception(f"Ограничение {row['conname']} таблицы {table} не содержит {key}")
+        else:
+            definitions.append(f'ALTER TABLE {table} ADD CONSTRAINT "{row["conname"]}" {row["definition"]}')
+
+    indexes = await conn.fetch("""
+        SELECT indexrelid, pg_get_indexdef(indexrelid) AS definition
+        FROM pg_index WHERE indrelid = $1::regclass
+    """, table)
+    definitions += [row["definition"] for row in indexes if row["indexrelid"] not in constraint_indexes]
+    return definitions
+
+
+async def convert_to_partitioned(table: str, key: str) -> None:
+    """
+    Перевести таблицу Django в секционированную по месяцам key (один раз, под эксклюзивной блокировкой):
+    копия структуры PARTITION BY RANGE (key), секции на всю историю и PARTITIONS_AHEAD вперёд,
+    секция DEFAULT, перенос строк, те же ограничения и индексы. Всё в одной транзакции.
+    """
+    pool = await async_connect_to_database()
+    if not pool:
+        raise Exception("Ошибка подключения к БД в convert_to_partitioned")
+
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            if await is_partitioned(conn, table):
+                return
+            await conn.execute(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE")
+
+            definitions = await _table_definitions(conn, table, key)
+            first = await conn.fetchval(f'SELECT min("{key}")::date FROM {table}')
+
+            legacy = f"{table}_legacy"
+            await conn.execute(f"ALTER TABLE {table} RENAME TO {legacy}")
+            await conn.execute(f"""
+                CREATE TABLE {table} (
+                    LIKE {legacy} INCLUDING DEFAULTS INCLUDING IDENTITY INCLUDING STORAGE INCLUDING COMMENTS
+                ) PARTITION BY RANGE ("{key}")
+            """)
+            await conn.execute(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT")
+
+            month, last = month_start(first or date.today()), month_start(date.today(), PARTITIONS_AHEAD)
+            while month <= last:
+                await create_month_partition(conn, table, month)
+                month = month_start(month, 1)
+
+            await conn.execute(f"INSERT INTO {table} SELECT * FROM {legacy}")
+            # serial: последовательность общая, но принадлежит старой таблице и удалилась бы вместе с ней.
+            # identity: у новой таблицы своя, её надо продвинуть за max(id)
+            sequence = await conn.fetchval("SELECT pg_get_serial_sequence($1, 'id')", legacy)
+            if sequence and not await conn.fetchval(
+                    "SELECT attidentity <> '' FROM pg_attribute WHERE attrelid = $1::regclass AND attname = 'id'",
+                    legacy,
+            ):
+                await conn.execute(f"ALTER SEQUENCE {sequence} OWNED BY {table}.id")
+            await conn.execute(f"""
+                SELECT setval(pg_get_serial_sequence('{table}', 'id'), coalesce(max(id), 0) + 1, false)
+                FROM {table}
+            """)
+            await conn.execute(f"DROP TABLE {legacy}")
+
+            for definition in definitions:
+                await conn.execute(definition)
+
+    logger.info(f"Таблица {table} секционирована по {key}")
+
+
+async def archive_old_partitions(conn, table: str, keep_months: int) -> List[str]:
+    """
+    Отключить секции старше keep_months месяцев и перенести их в схему PARTITION_ARCHIVE_SCHEMA.
+    :return: имена отключённых секций
+    """
+    boundary = month_start(date.today(), -keep_months)
+    partitions = await conn.fetch("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = $1::regclass AND c.relname LIKE $2
+    """, table, f"{table}_p%")
+
+    archived = []
+    for row in partitions:
+        name = row["relname"]
+        try:
+            month = date(int(name[-6:-2]), int(name[-2:]), 1)
+        except ValueError:
+            continue
+        if month >= boundary:
+            continue
+        await conn.execute(f"CREATE SCHEMA IF NOT EXISTS {PARTITION_ARCHIVE_SCHEMA}")
+        await conn.execute(f"ALTER TABLE {table} DETACH PARTITION {name}")
+        await conn.execute(f"ALTER TABLE {name} SET SCHEMA {PARTITION_ARCHIVE_SCHEMA}")
+        archived.append(name)
+    return archived
+
+
+async def maintain_partitions(archive: bool = True) -> Dict[str, dict]:
+    """
+    Обслуживание секций (по расписанию, раз в сутки-неделю): создать секции на PARTITIONS_AHEAD месяцев вперёд
+    и, если archive, отключить старые по PARTITION_RETENTION_MONTHS. Несекционированные таблицы пропускаются —
+    их переводит partition_tables.
+    :return: {таблица: {"created": [...], "archived": [...]}}
+    """
+    pool = await async_connect_to_database()
+    if not pool:
+        raise Exception("Ошибка подключения к БД в maintain_partitions")
+
+    result = {}
+    async with pool.acquire() as conn:
+        for table in PARTITIONED_TABLES:
+            if not await is_partitioned(conn, table):
+                logger.warning(f"Таблица {table} не секционирована, пропускаем")
+                continue
+
+            created = []
+            for shift in range(PARTITIONS_AHEAD + 1):
+                month = month_start(date.today(), shift)
+                if await create_month_partition(conn, table, month):
+                    created.append(partition_name(table, month))
+
+            archived = []
+            keep_months: Optional[int] = PARTITION_RETENTION_MONTHS.get(table)
+            if archive and keep_months:
+                archived = await archive_old_partitions(conn, table, keep_months)
+
+            result[table] = {"created": created, "archived": archived}
+            if created or archived:
+                logger.info(f"Секции {table}: созданы {created}, отключены {archived}")
+    return result
+
+
+async def partition_tables() -> None:
+    """Перевести в секционированные все таблицы PARTITIONED_TABLES, которые ещё не переведены"""
+    for table, key in PARTITIONED_TABLES.items():
+        try:
+            await convert_to_partitioned(table, key)
+        except Exception:
+            logger.exception(f"Не удалось секционировать {table}")
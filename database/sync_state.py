@@ -0,0 +1,67 @@
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+from context_logger import ContextLogger
+
+logger = ContextLogger(logging.getLogger("database"))
+
+
+# Набор данных -> (перекрытие, окно первой загрузки).
+# Следующая загрузка начинается с watermark - перекрытие: WB дописывает и правит строки задним числом.
+# Перекрытие переопределяется переменной окружения SYNC_OVERLAP_<НАБОР>_HOURS
+SYNC_DATASETS: Dict[str, Tuple[timedelta, timedelta]] = {
+    "stocks": (timedelta(hours=1), timedelta(days=250)),  # lastChangeDate
+    "supplies": (timedelta(hours=1), timedelta(days=7)),  # lastChangeDate
+    "fin_report": (timedelta(days=7), timedelta(days=14)),  # rr_dt, строки недели приходят с отчетом
+    "region_sales": (timedelta(days=1), timedelta(days=15)),  # день
+    "orders_lk": (timedelta(days=2), timedelta(days=61)),  # день
+    "advs_stat": (timedelta(days=3), timedelta(days=30)),  # день
+}
+
+
+def sync_overlap(dataset: str) -> timedelta:
+    hours = os.environ.get(f"SYNC_OVERLAP_{dataset.upper()}_HOURS")
+    return timedelta(hours=float(hours)) if hours else SYNC_DATASETS[dataset][0]
+
+
+def _naive(value: Optional[datetime]) -> Optional[datetime]:
+    """timestamptz из asyncpg -> naive в локальном времени, как datetime.now() и даты WB в парсерах"""
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone().replace(tzinfo=None)
+    return value
+
+
+async def get_sync_state(conn, lk_id: int, dataset: str) -> Tuple[Optional[datetime], Optional[str]]:
+    """(watermark, cursor) кабинета по набору или (None, None), если набор ещё не загружался"""
+    row = await conn.fetchrow(
+        "SELECT watermark, cursor FROM myapp_syncstate WHERE lk_id = $1 AND dataset = $2", lk_id, dataset
+    )
+    if not row:
+        return None, None
+    return _naive(row["watermark"]), row["cursor"]
+
+
+async def sync_since(conn, lk_id: int, dataset: str) -> datetime:
+    """С какого момента грузить: watermark минус перекрытие или окно первой загрузки"""
+    watermark, _ = await get_sync_state(conn, lk_id, dataset)
+    first_run = datetime.now() - SYNC_DATASETS[dataset][1]
+    if watermark is None:
+        return first_run
+    return max(watermark - sync_overlap(dataset), first_run)
+
+
+async def set_sync_state(conn, lk_id: int, dataset: str, watermark: datetime, cursor: Optional[str] = None) -> None:
+    """
+    Запомнить, докуда набор загружен (вызывать только после успешной загрузки).
+    watermark не откатывается назад: повторная загрузка старого периода его не уменьшит.
+    """
+    await conn.execute("""
+        INSERT INTO myapp_syncstate (lk_id, dataset, watermark, cursor, updated_at)
+        VALUES ($1, $2, $3, $4, now())
+        ON CONFLICT (lk_id, dataset) DO UPDATE SET
+            watermark = GREATEST(myapp_syncstate.watermark, EXCLUDED.watermark),
+            cursor = coalesce(EXCLUDED.cursor, myapp_syncstate.cursor),
+            updated_at = EXCLUDED.updated_at
+    """, lk_id, dataset, watermark, cursor)
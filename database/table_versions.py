@@ -0,0 +1,51 @@
+import logging
+from functools import wraps
+from typing import List
+
+import redis
+
+from context_logger import ContextLogger
+
+logger = ContextLogger(logging.getLogger("database"))
+
+# таймауты: API ждёт редис в потоке пула, зависший редис не должен занимать потоки надолго
+r = redis.Redis(host='redis_cache', port=6379, db=0, socket_connect_timeout=2, socket_timeout=2)
+
+
+# Версия таблицы растёт при каждой загрузке данных в неё.
+# Кэш ответов API входит в ключ с версиями прочитанных таблиц, поэтому после загрузки старые записи
+# просто перестают находиться и истекают по TTL
+TABLE_VERSION_KEY = "table_version:{}"
+
+
+def bump_table_versions(*tables: str) -> None:
+    """Отметить, что данные таблиц изменились"""
+    try:
+        with r.pipeline(transaction=False) as pipe:
+            for table in tables:
+                pipe.incr(TABLE_VERSION_KEY.format(table))
+            pipe.execute()
+    except redis.RedisError as e:
+        logger.error(f"Не удалось обновить версии таблиц {tables}: {e}")
+
+
+def get_table_versions(tables) -> List[int]:
+    """Текущие версии таблиц (0 — таблица ещё не загружалась)"""
+    values = r.mget([TABLE_VERSION_KEY.format(table) for table in tables])
+    return [int(value) if value else 0 for value in values]
+
+
+def invalidates(*tables: str):
+    """
+    Декоратор для async-функций загрузки: после выполнения (в том числе с ошибкой —
+    часть данных могла успеть записаться) поднимает версии таблиц.
+    """
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                bump_table_versions(*tables)
+        return wrapper
+    return decorator
@@ -0,0 +1,147 @@
+import asyncpg
+
+from database.DataBase import async_connect_to_database
+from database.table_versions import invalidates
+from typing import Dict, Iterable, Optional
+
+import logging
+from context_logger import ContextLogger
+
+logger = ContextLogger(logging.getLogger("database"))
+
+
+# название склада в нижнем регистре -> id в myapp_warehouse (на процесс, алиасы не меняются)
+_alias_cache: Dict[str, int] = {}
+
+# (таблица, колонка с названием склада) — откуда собирать склады и где проставлять warehouse_id
+WAREHOUSE_SOURCES = [
+    ("myapp_stocks", "warehousename"),
+    ("myapp_orders", "warehouse"),
+    ("myapp_savedata", "warehouse"),
+    ("myapp_supplies", "warehouseName"),
+]
+
+
+def warehouse_alias(name: str) -> str:
+    """Название склада из отчета -> ключ в myapp_warehousealias"""
+    return name.strip().lower()
+
+
+def warehouse_key(name: str) -> str:
+    """
+    Название склада из любого отчета WB -> ключ склада в myapp_warehouse.
+    "СЦ Коледино WB", "Виртуальный Коледино" и "Коледино" дают один ключ.
+    """
+    key = (
+        name.replace("Виртуальный ", "")
+        .replace("СЦ ", "")
+        .replace(" WB", "")
+        .replace(", Молодежненское", " (Молодежненское)")
+        .replace(" Сталелитейная", "")
+    )
+    return key.strip().lower()
+
+
+async def resolve_warehouse_ids(
+        conn,
+        names: Iterable[Optional[str]],
+        office_ids: Optional[Dict[str, int]] = None,
+) -> Dict[str, int]:
+    """
+    Найти или завести склады для названий из отчета.
+    :param conn: пул или соединение asyncpg. Если None — берётся общий пул
+    :param names: Названия складов как в отчете (None и пустые пропускаются)
+    :param office_ids: {название: officeId}, если отчет их знает (платное хранение)
+    :return: {название: warehouse_id}
+    """
+    office_ids = office_ids or {}
+    names = {name for name in names if name}
+
+    unknown = [
+        name for name in names
+        if warehouse_alias(name) not in _alias_cache or name in office_ids
+    ]
+    if unknown:
+        if conn is None:
+            conn = await async_connect_to_database()
+            if not conn:
+                raise Exception("Ошибка подключения к БД в resolve_warehouse_ids")
+
+        aliases = [warehouse_alias(name) for name in unknown]
+        keys = [warehouse_key(name) for name in unknown]
+        titles = [name.strip() for name in unknown]
+        offices = [office_ids.get(name) for name in unknown]
+
+        async def run(connection):
+            async with connection.transaction():
+                await connection.execute("""
+                    INSERT INTO myapp_warehouse (key, name, office_id)
+                    SELECT DISTINCT ON (key) key, name, office_id
+                    FROM unnest($1::text[], $2::text[], $3::int[]) AS t(key, name, office_id)
+                    WHERE key <> ''
+                    ORDER BY key, office_id NULLS LAST
+                    ON CONFLICT (key) DO UPDATE SET office_id = EXCLUDED.office_id
+                    WHERE myapp_warehouse.office_id IS NULL AND EXCLUDED.office_id IS NOT NULL
+                """, keys, titles, offices)
+                await connection.execute("""
+                    INSERT INTO myapp_warehousealias (alias, warehouse_id)
+                    SELECT t.alias, w.id
+                    FROM unnest($1::text[], $2::text[]) AS t(alias, key)
+                    JOIN myapp_warehouse w ON w.key = t.key
+                    ON CONFLICT (alias) DO NOTHING
+                """, aliases, keys)
+                return await connection.fetch(
+                    "SELECT alias, warehouse_id FROM myapp_warehousealias WHERE alias = ANY($1::text[])",
+                    aliases,
+                )
+
+        if isinstance(conn, asyncpg.Pool):
+            async with conn.acquire() as connection:
+                rows = await run(connection)
+        else:
+            rows = await run(conn)
+
+        _alias_cache.update({row["alias"]: row["warehouse_id"] for row in rows})
+
+    return {
+        name: _alias_cache[warehouse_alias(name)]
+        for name in names
+        if warehouse_alias(name) in _alias_cache
+    }
+
+
+@invalidates("myapp_stocks", "myapp_orders", "myapp_savedata", "myapp_warehousealias")
+async def sync_warehouse_registry() -> None:
+    """
+    Завести в справочник склады из всех таблиц WAREHOUSE_SOURCES
+    и проставить warehouse_id строкам, у которых его ещё нет.
+    """
+    conn = await async_connect_to_database()
+    if not conn:
+        logger.error("Ошибка подключения к БД в sync_warehouse_registry")
+        return
+
+    try:
+        names = set()
+        for table_name, column in WAREHOUSE_SOURCES:
+            rows = await conn.fetch(f'SELECT DISTINCT "{column}" AS name FROM {table_name}')
+            names.update(row["name"] for row in rows)
+
+        office_rows = await conn.fetch("SELECT DISTINCT ON (warehouse) warehouse, \"officeId\" FROM myapp_savedata")
+        office_ids = {row["warehouse"]: row["officeId"] for row in office_rows if row["warehouse"]}
+
+        ids = await resolve_warehouse_ids(conn, names, office_ids)
+        logger.info(f"Складов в справочнике: {len(set(ids.values()))}, названий: {len(ids)}")
+
+        for table_name, column in WAREHOUSE_SOURCES:
+            status = await conn.execute(f"""
+                UPDATE {table_name} AS t
+                SET warehouse_id = a.warehouse_id
+                FROM myapp_warehousealias a
+                WHERE a.alias = lower(btrim(t."{column}"))
+                    AND t.warehouse_id IS DISTINCT FROM a.warehouse_id
+            """)
+            logger.info(f"warehouse_id в {table_name}: {status}")
+    except Exception as e:
+        logger.error(f"Ошибка синхронизации справочника складов: {e}")
+        raise
@@ -0,0 +1,101 @@
+import asyncio
+import hashlib
+import json
+import logging
+import zlib
+from functools import wraps
+
+import orjson
+import redis
+from fastapi import Response
+from pydantic import TypeAdapter
+
+from context_logger import ContextLogger
+from database.table_versions import r, get_table_versions
+from .responses import dump_json
+from .streaming import stream_format
+
+logger = ContextLogger(logging.getLogger("fastapi_app"))
+
+
+CACHE_TTL = 6 * 60 * 60  # данные грузятся несколько раз в день, дольше держать незачем
+CACHE_KEY = "api_cache:{}:{}"
+
+# Поля-фильтры, порядок элементов в которых на ответ не влияет. В остальных списках
+# (group_by у /aggregate/) порядок задает порядок ответа, их не сортируем
+UNORDERED_FIELDS = ("inn", "articles", "colors", "sizes", "warhouses", "supplier_oper_name")
+
+
+def _canonical(payload) -> str:
+    """Тело запроса в виде, не зависящем от порядка полей и элементов списков-фильтров"""
+    if payload is None:
+        return ""
+    data = payload.model_dump(mode="json")
+    for field in UNORDERED_FIELDS:
+        if isinstance(data.get(field), list):
+            data[field] = sorted(data[field], key=str)
+    return json.dumps(data, sort_keys=True, ensure_ascii=False)
+
+
+def response_cache_key(endpoint: str, payload, params: dict, tables) -> str:
+    """Ключ кэша; читает версии таблиц из редиса — вызывать вне event loop (asyncio.to_thread)"""
+    versions = get_table_versions(tables)
+    params = json.dumps(params, sort_keys=True, default=str)
+    digest = hashlib.sha1(f"{_canonical(payload)}|{params}|{versions}".encode()).hexdigest()
+    return CACHE_KEY.format(endpoint, digest)
+
+
+def cached_response(*tables: str, model=None, ttl: int = CACHE_TTL):
+    """
+    Кэшировать ответ эндпоинта в redis_cache.
+    Ключ — имя эндпоинта, тело запроса и версии tables (их поднимают функции загрузки через
+    database.table_versions.invalidates). Ответ хранится как сжатый JSON — из редиса ничего не исполняется.
+    Задачи выгрузки в Google вызывают эндпоинты напрямую и ждут те же объекты (даты, datetime), что и без кэша:
+    для этого JSON разбирается моделью ответа model и выгружается обратно в python-объекты.
+    Без model ответ должен состоять только из типов JSON.
+    Потоковые ответы (format=ndjson|csv) не кэшируются.
+    Клиент redis синхронный, поэтому все обращения к нему идут через asyncio.to_thread и не держат event loop.
+    """
+    adapter = TypeAdapter(model) if model is not None else None
+
+    def decode(cached: bytes):
+        raw = zlib.decompress(cached)
+        if adapter is None:
+            return orjson.loads(raw)
+        return adapter.dump_python(adapter.validate_json(raw))
+
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            if stream_format(kwargs.get("format"), kwargs.get("accept")):
+                return await func(*args, **kwargs)
+
+            key = None
+            try:
+                # остальные параметры запроса (limit, cursor) тоже часть ключа
+                params = {
+                    name: value for name, value in kwargs.items()
+                    if name not in ("payload", "token", "format", "accept")
+                }
+                key = await asyncio.to_thread(
+                    response_cache_key, func.__name__, kwargs.get("payload"), params, tables
+                )
+                cached = await asyncio.to_thread(r.get, key)
+                if cached is not None:
+                    return decode(cached)
+            except redis.RedisError as e:
+                logger.warning(f"Кэш {func.__name__} недоступен: {e}")
+            except (zlib.error, ValueError) as e:
+                # запись не разбирается моделью ответа (старый формат, чужие данные) — считаем, что её нет
+                logger.warning(f"Некорректная запись кэша {func.__name__}: {e}")
+
+            result = await func(*args, **kwargs)
+
+            if key is not None and not isinstance(result, Response):
+                try:
+                    await asyncio.to_thread(r.set, key, zlib.compress(dump_json(result)), ex=ttl)
+                except redis.RedisError as e:
+                    logger.warning(f"Не удалось сохранить кэш {func.__name__}: {e}")
+            return result
+        return wrapper
+    return decorator
@@ -1,7 +1,12 @@
 import databases
 from loader import POSTGRES_DB, POSTGRES_USER, POSTGRES_PASSWORD
+from database.DataBase import POOL_CONFIG
 
 DATABASE_URL = f"postgresql+asyncpg://{POSTGRES_USER}:{POSTGRES_PASSWORD}@db:5432/{POSTGRES_DB}"
 
-# асинхронное подключение
-database = databases.Database(DATABASE_URL)
+# асинхронное подключение (размер пула общий с database.DataBase)
+database = databases.Database(
+    DATABASE_URL,
+    min_size=POOL_CONFIG['min_size'],
+    max_size=POOL_CONFIG['max_size'],
+)
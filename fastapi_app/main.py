@@ -1,56 +1,118 @@
-import json
-from typing import Optional, List
+from typing import Annotated, Dict, Literal, Optional, List
 from zoneinfo import ZoneInfo
 
-from fastapi import FastAPI, HTTPException
-from sqlalchemy import MetaData, Table, select, create_engine, func, cast, String, text
+from fastapi import FastAPI, HTTPException, Header, Query, Response
+from sqlalchemy import select, func, text, any_, and_, literal, literal_column
+from sqlalchemy.dialects.postgresql import ARRAY
 from .database import database
+from .tables import (metadata, products_table, orders_table, nmids_table, wblk_table, stocks_table, advstat_table,
+                     advs_table, findata_table, findaily_table, savedata_table, sales_reg_table,
+                     warehouse_alias_table)
+from database.DataBase import close_async_pool
+from database.dimensions import get_dimensions_snapshot, refresh_dimensions_snapshot
+from database.fin_daily import FIN_DAILY_SUMS
 from pydantic import BaseModel, Field, RootModel
-from loader import POSTGRES_DB, POSTGRES_USER, POSTGRES_PASSWORD
 from context_logger import ContextLogger
+import asyncio
+import json
 import logging
 from dateutil.parser import parse as parse_date
-from datetime import timedelta, datetime, date as date_dt
+from datetime import timedelta, datetime, time, date as date_dt
 from fastapi import Depends
 from .auth import verify_token
+from .streaming import stream_format, stream_response
+from .cache import cached_response
+from .responses import fast_route
+from .pagination import (Page, PageLimit, PageCursor, fetch_page, paginate, split_page, decode_cursor,
+                         encode_cursor, nullable_date_key)
 
 
 logger = ContextLogger(logging.getLogger("fastapi_app"))
 
 app = FastAPI(root_path="/api")
 
-# SQLAlchemy только для описания схемы (reflect)
-sync_engine = create_engine(
-    f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@db:5432/{POSTGRES_DB}"
-)  # sync для рефлекта
-metadata = MetaData()
-metadata.reflect(bind=sync_engine)
+# цвет карточки (в исходном регистре) раскладывается get_nmids в отдельную колонку
+color_expr = nmids_table.c.color.label("color")
+# цвета в фильтрах сравниваются без учета регистра
+color_key = func.lower(nmids_table.c.color, type_=nmids_table.c.color.type)
+
+
+def any_of(column, values):
+    """column = ANY($n): список уходит одним параметром-массивом, а не литералами IN (...)"""
+    return column == any_(literal(list(values), ARRAY(column.type)))
+
+
+def card_filters(lk_ids, payload):
+    """Условия на myapp_nmids для присоединённой таблицы: кабинеты, артикулы и цвета из запроса"""
+    conditions = [any_of(nmids_table.c.lk_id, lk_ids)]
+    if payload.articles:
+        conditions.append(any_of(nmids_table.c.nmid, payload.articles))
+    if payload.colors:
+        conditions.append(any_of(color_key, [c.strip().lower() for c in payload.colors]))
+    return conditions
+
+
+def card_join(table):
+    """Условие присоединения карточки: по nmid и, если в таблице есть lk_id, по кабинету"""
+    if "lk_id" in table.c:
+        return and_(nmids_table.c.nmid == table.c.nmid, nmids_table.c.lk_id == table.c.lk_id)
+    return nmids_table.c.nmid == table.c.nmid
+
+
+# ИНН в запросе: один, список или "all" (все кабинеты). Для списка и "all" ответ — словарь {ИНН: результат}
+InnParam = int | list[int] | Literal["all"]
 
 
-products_table = metadata.tables.get("myapp_productsstat")
-orders_table = metadata.tables.get("myapp_orders")
-nmids_table = metadata.tables.get("myapp_nmids")
-wblk_table = metadata.tables.get("myapp_wblk")
-stocks_table = metadata.tables.get("myapp_stocks")
-advstat_table = metadata.tables.get("myapp_advstat")
-advs_table = metadata.tables.get("myapp_adverts")
-findata_table = metadata.tables.get("myapp_findata")
-savedata_table = metadata.tables.get("myapp_savedata")
-sales_reg_table = metadata.tables.get("myapp_regionsales")
+async def resolve_lks(inn: InnParam) -> dict:
+    """ИНН из запроса -> {lk_id: ИНН}"""
+    query = select(wblk_table.c.id, wblk_table.c.inn)
+    if isinstance(inn, int):
+        row = await database.fetch_one(query.where(wblk_table.c.inn == inn))
+        lks = {row["id"]: row["inn"]} if row else {}
+    else:
+        if inn != "all":
+            query = query.where(any_of(wblk_table.c.inn, inn))
+        rows = await database.fetch_all(query.order_by(wblk_table.c.id))
+        lks = {row["id"]: row["inn"] for row in rows}
 
-if None in [products_table, orders_table, nmids_table, wblk_table, stocks_table, advstat_table, findata_table, savedata_table,
-            sales_reg_table]:
-    logger.error("Одна из таблиц (ProductsStat, nmids, WbLk, Stocks) не найдена.")
-    raise RuntimeError()
+    if not lks:
+        raise HTTPException(status_code=404, detail="WbLk не найден")
+    return lks
 
 
-color_expr = cast(
-        func.jsonb_path_query_first(
-            nmids_table.c.characteristics,
-            '$[*] ? (@.id == 14177449).value[0]'
-        ),
-        String
-    ).label("color")
+def is_batch(payload) -> bool:
+    return not isinstance(payload.inn, int)
+
+
+def by_inn(payload, lks: dict, items):
+    """
+    Разложить результат по ИНН.
+    :param items: пары (lk_id, строка ответа)
+    :return: список строк для одного ИНН или {ИНН: [строки]} для пакетного запроса
+    """
+    if not is_batch(payload):
+        return [item for _, item in items]
+
+    result = {inn: [] for inn in lks.values()}
+    for lk_id, item in items:
+        result[lks[lk_id]].append(item)
+    return result
+
+
+def with_inn(item: dict, lks: dict, lk_id: int) -> dict:
+    """Строка потокового ответа с ИНН кабинета (для пакетного запроса)"""
+    item["inn"] = lks[lk_id]
+    return item
+
+
+def report_model(item):
+    """response_model отчета: список строк, {ИНН: список} или их страница (?limit=)"""
+    return List[item] | Dict[int, List[item]] | Page[List[item] | Dict[int, List[item]]]
+
+
+def stream_fields(payload, model) -> List[str]:
+    fields = list(model.model_fields)
+    return ["inn", *fields] if is_batch(payload) else fields
 
 
 # Подключаем/отключаем БД при старте/остановке приложения
@@ -58,13 +120,23 @@ color_expr = cast(
 async def startup():
     await database.connect()
 
+    # схема описана в tables.py вручную — проверяем, что таблицы на месте, один раз при старте API
+    rows = await database.fetch_all(
+        text("SELECT table_name FROM information_schema.tables WHERE table_schema = current_schema()")
+    )
+    missing = set(metadata.tables) - {row["table_name"] for row in rows}
+    if missing:
+        logger.error(f"Таблицы не найдены: {', '.join(sorted(missing))}")
+        raise RuntimeError()
+
 @app.on_event("shutdown")
 async def shutdown():
     await database.disconnect()
+    await close_async_pool()
 
 
 class FinReportRequest(BaseModel):
-    inn: int = Field(..., description="ИНН клиента, обязательное поле")
+    inn: InnParam = Field(..., description="ИНН клиента, список ИНН или \"all\", обязательное поле")
     date_from: str | None = Field(None, description="Дата начала выборки в формате YYYY-MM-DD, необязательное поле")
     date_to: str | None = Field(None, description="Дата окончания выборки в формате YYYY-MM-DD, необязательное поле")
     articles: list[int] | None = Field(None,
@@ -93,79 +165,91 @@ class FinReportResponse(BaseModel):
 class FinReportResponseWithDeduction(BaseModel):
     data: List[FinReportResponse]
     deduction: float = Field(..., description="Удержание")
-
-@app.post(
-    "/fin_report/",
-    response_model=FinReportResponseWithDeduction,
-    summary="Получить фин. отчет",
-    description="Возвращает фин отчет по NMID. "
-                "Можно фильтровать по дате, артикулам и цветам, размерам и обоснованием для оплаты"
-)
+    totals: Dict[str, float] = Field(
+        default_factory=dict,
+        description="Суммы фин. отчета кабинета за период (retail_amount, ppvz_for_pay, ..., penalty). "
+                    "Как и удержание, без фильтров по артикулам, цветам, размерам и основанию"
+    )
+    next_cursor: Optional[str] = Field(None, description="Курсор следующей страницы (при ?limit=)")
+
+
+FinReportModel = (FinReportResponseWithDeduction | Dict[int, FinReportResponseWithDeduction]
+                  | Page[Dict[int, FinReportResponseWithDeduction]])
+
+
+# Потоковый ответ: ?format=ndjson|csv или Accept: application/x-ndjson|text/csv
+StreamFormat = Annotated[str | None, Query(description="ndjson или csv — отдать строки потоком, без сборки всего ответа")]
+AcceptHeader = Annotated[str | None, Header()]
+
+
+def fin_row(i) -> dict:
+    """Строка фин. отчета (myapp_findata + карточка) -> FinReportResponse"""
+    return {
+        "subjectname": i["subjectname"],
+        "vendorcode": i["vendorcode"],
+        "nmid": i["nmid"],
+        "retail_price": i["retail_price"],
+        "retail_amount": i["retail_amount"],
+        "ppvz_for_pay": i["ppvz_for_pay"],
+        "delivery_rub": i["delivery_rub"],
+        "acceptance": i["acceptance"],
+        "date_wb": i["rr_dt"].date(),  # приводим к единому имени
+        "sale_dt": i["sale_dt"].date(),
+        "color": i["color"].strip('"') if i.get("color") else 'Цвет не указан',
+        "supplier_oper_name": i["supplier_oper_name"],
+        "warehousePrice": 0,
+        "penalty": i["penalty"] if i.get("penalty") else 0
+    }
+
+
+def fin_save_row(i) -> dict:
+    """Строка платного хранения (myapp_savedata + карточка) -> FinReportResponse"""
+    return {
+        "subjectname": i["subjectname"],
+        "vendorcode": i["vendorcode"],
+        "nmid": i["nmid"],
+        "date_wb": i["date_wb"].date(),
+        "sale_dt": None,
+        "warehousePrice": i["warehousePrice"],
+        "retail_price": 0,
+        "retail_amount": 0,
+        "ppvz_for_pay": 0,
+        "delivery_rub": 0,
+        "acceptance": 0,
+        "color": i["color"].strip('"') if i.get("color") else 'Цвет не указан',
+        "supplier_oper_name": "хранение",
+        "penalty": None,
+    }
+
+
+@fast_route(app.post(
+        "/fin_report/",
+        response_model=FinReportModel,
+        summary="Получить фин. отчет",
+        description="Возвращает фин отчет по NMID. "
+                    "Можно фильтровать по дате, артикулам и цветам, размерам и обоснованием для оплаты. "
+                    "При format=ndjson|csv строки отдаются потоком, удержание — в заголовке X-Deduction"
+    ))
+@cached_response("myapp_findata", "myapp_findaily", "myapp_savedata", "myapp_nmids", "myapp_wblk",
+                 model=FinReportModel)
 async def fin_report_endpoint(
         payload: FinReportRequest,
-        token: str = Depends(verify_token)
+        token: str = Depends(verify_token),
+        format: StreamFormat = None,
+        accept: AcceptHeader = None,
+        limit: PageLimit = None,
+        cursor: PageCursor = None,
 ):
+    fmt = stream_format(format, accept)
 
     try:
         # Парсим даты
         date_from = (parse_date(payload.date_from) - timedelta(days=1)).date() if payload.date_from else None
         date_to = (parse_date(payload.date_to) + timedelta(days=1)).date() if payload.date_to else None
 
-        # Получаем lk
-        query_lk = select(wblk_table).where(wblk_table.c.inn == payload.inn)
-        lk_row = await database.fetch_one(query_lk)
-        if not lk_row:
-            raise HTTPException(status_code=404, detail="WbLk не найден")
-
-        lk_id = lk_row["id"]
-
-        # Получаем список nmid по lk
-        query_nmids = select(
-            nmids_table.c.nmid,
-            nmids_table.c.characteristics
-        ).where(nmids_table.c.lk_id == lk_id)
-
-        if payload.articles:
-            query_nmids = query_nmids.where(nmids_table.c.nmid.in_(payload.articles))
-
-        nmids_rows = await database.fetch_all(query_nmids)
-
-        nmids_list = []
-
-        for row in nmids_rows:
-            nmid = row["nmid"]
-            if payload.colors:
-                characteristics = row["characteristics"]  # JSONField из Django
-                if characteristics is None:
-                    continue
-
-                try:
-                    parsed = (
-                        characteristics
-                        if isinstance(characteristics, list)
-                        else json.loads(characteristics)
-                    )
-                except Exception:
-                    continue
-
-                color_entry = next(
-                    (item for item in parsed if item.get("id") == 14177449), None
-                )
-                if not color_entry:
-                    continue
-
-                value = color_entry.get("value")
-                if not value or not isinstance(value, list):
-                    continue
-
-                color_value = value[0].lower()  # берём первое значение
-                if color_value in [c.lower() for c in payload.colors]:
-                    nmids_list.append(nmid)
-            else:
-                nmids_list.append(nmid)
-
-        if not nmids_list:
-            return []
+        # Получаем кабинеты
+        lks = await resolve_lks(payload.inn)
+        lk_ids = list(lks)
 
         # Фильтруем ProductsStat
         query_stats = (select(
@@ -182,10 +266,11 @@ async def fin_report_endpoint(
             findata_table.c.supplier_oper_name,
             findata_table.c.ts_name, # размер
             findata_table.c.penalty, # штрафы
+            findata_table.c.lk_id,
             color_expr
         )
-        .join(nmids_table, nmids_table.c.nmid == findata_table.c.nmid)
-       .where(findata_table.c.nmid.in_(nmids_list)))
+        .join(nmids_table, card_join(findata_table))
+        .where(*card_filters(lk_ids, payload)))
 
         query_save = (select(
             nmids_table.c.subjectname,
@@ -194,10 +279,11 @@ async def fin_report_endpoint(
             savedata_table.c.warehousePrice,
             savedata_table.c.date_wb,
             savedata_table.c.size,
+            savedata_table.c.lk_id,
             color_expr
         )
-        .join(nmids_table, nmids_table.c.nmid == savedata_table.c.nmid)
-        .where(savedata_table.c.nmid.in_(nmids_list)))
+        .join(nmids_table, card_join(savedata_table))
+        .where(*card_filters(lk_ids, payload)))
 
         if date_from:
             query_stats = query_stats.where(findata_table.c.rr_dt > date_from)
@@ -206,82 +292,98 @@ async def fin_report_endpoint(
             query_stats = query_stats.where(findata_table.c.rr_dt < date_to)
             query_save = query_save.where(savedata_table.c.date_wb < date_to)
         if payload.supplier_oper_name:
+            # get_fin_report сохраняет основание в нижнем регистре — сравниваем колонку без lower()
             supplier_oper_name = [i.lower() for i in payload.supplier_oper_name]
-            query_stats = query_stats.where(func.lower(findata_table.c.supplier_oper_name).in_(supplier_oper_name))
+            query_stats = query_stats.where(any_of(findata_table.c.supplier_oper_name, supplier_oper_name))
         if payload.sizes:
             sizes = [i.lower() for i in payload.sizes]
-            query_stats = query_stats.where(findata_table.c.ts_name.in_(sizes))
-            query_save = query_save.where(savedata_table.c.size.in_(sizes))
+            query_stats = query_stats.where(any_of(findata_table.c.ts_name, sizes))
+            query_save = query_save.where(any_of(savedata_table.c.size, sizes))
 
-        stats_rows = await database.fetch_all(query_stats)
-        art_per_day = [dict(row._mapping) for row in stats_rows]
+        # Удержание и итоги по кабинетам — из дневной сводки myapp_findaily, которую ведёт get_fin_report:
+        # по строке на (кабинет, день) вместо суммирования всех строк myapp_findata
+        query_totals = (
+            select(
+                findaily_table.c.lk_id,
+                *(func.coalesce(func.sum(findaily_table.c[col]), 0).label(col) for col in FIN_DAILY_SUMS),
+            )
+            .where(any_of(findaily_table.c.lk_id, lk_ids))
+            .group_by(findaily_table.c.lk_id)
+        )
 
-        save_rows = await database.fetch_all(query_save)
-        art_per_day_saves = [dict(row._mapping) for row in save_rows]
+        if payload.date_from:
+            query_totals = query_totals.where(findaily_table.c.day >= parse_date(payload.date_from).date())
+        if payload.date_to:
+            query_totals = query_totals.where(findaily_table.c.day <= parse_date(payload.date_to).date())
+
+        totals = {inn: {col: 0 for col in FIN_DAILY_SUMS} for inn in lks.values()}
+        for row in await database.fetch_all(query_totals):
+            for col in FIN_DAILY_SUMS:
+                totals[lks[row["lk_id"]]][col] += row[col]
+        deductions = {inn: value["deduction"] for inn, value in totals.items()}
+
+        if fmt:
+            async def rows():
+                async for row in database.iterate(query_stats):
+                    yield with_inn(fin_row(row._mapping), lks, row["lk_id"])
+                async for row in database.iterate(query_save):
+                    yield with_inn(fin_save_row(row._mapping), lks, row["lk_id"])
+
+            deduction_header = json.dumps(deductions) if is_batch(payload) else str(deductions[payload.inn])
+            return stream_response(
+                fmt, rows(), stream_fields(payload, FinReportResponse), headers={"X-Deduction": deduction_header}
+            )
 
-        # Отдельный запрос для deduction с сортировкой по дате
-        query_deduction = select(
-            findata_table.c.deduction,
-            findata_table.c.rr_dt
-        ).order_by(findata_table.c.rr_dt)
+        next_cursor = None
+        if limit:
+            # страницы идут сначала по строкам фин. отчета, затем по хранению; курсор помнит, где остановились
+            fin_keys = [findata_table.c.rr_dt, findata_table.c.rrd_id]
+            save_keys = [nullable_date_key(savedata_table.c.date_wb), savedata_table.c.id]
+            part, after = decode_cursor(cursor, [fin_keys, save_keys])
+
+            stats_rows, save_rows = [], []
+            if part == 0:
+                rows = await database.fetch_all(paginate(query_stats, fin_keys, limit, after))
+                stats_rows, last = split_page(rows, fin_keys, limit)
+                if last:
+                    next_cursor = encode_cursor(0, last)
+                after = None
+
+            rest = limit - len(stats_rows)
+            if not next_cursor and rest:
+                rows = await database.fetch_all(paginate(query_save, save_keys, rest, after))
+                save_rows, last = split_page(rows, save_keys, rest)
+                if last:
+                    next_cursor = encode_cursor(1, last)
+            elif not next_cursor:
+                next_cursor = encode_cursor(1, None)
+        else:
+            stats_rows = await database.fetch_all(query_stats)
+            save_rows = await database.fetch_all(query_save)
+
+        result = by_inn(
+            payload,
+            lks,
+            [(row["lk_id"], fin_row(row._mapping)) for row in stats_rows]
+            + [(row["lk_id"], fin_save_row(row._mapping)) for row in save_rows],
+        )
 
-        if date_from:
-            query_deduction = query_deduction.where(findata_table.c.rr_dt > date_from)
-        if date_to:
-            query_deduction = query_deduction.where(findata_table.c.rr_dt < date_to)
-
-        deduction_rows = await database.fetch_all(query_deduction)
-        deductions = sum(row.deduction for row in deduction_rows) if deduction_rows else 0
-
-        def merge_data(arr1, arr2):
-            response = []
-
-            # первый массив (финансовые данные)
-            for i in arr1:
-                response.append({
-                    "subjectname": i["subjectname"],
-                    "vendorcode": i["vendorcode"],
-                    "nmid": i["nmid"],
-                    "retail_price": i["retail_price"],
-                    "retail_amount": i["retail_amount"],
-                    "ppvz_for_pay": i["ppvz_for_pay"],
-                    "delivery_rub": i["delivery_rub"],
-                    "acceptance": i["acceptance"],
-                    "date_wb": datetime.fromisoformat(str(i["rr_dt"])).date(),  # приводим к единому имени
-                    "sale_dt": datetime.fromisoformat(str(i["sale_dt"])).date(),
-                    "color": i["color"].strip('"') if i.get("color") else 'Цвет не указан',
-                    "supplier_oper_name": i["supplier_oper_name"],
-                    "warehousePrice": 0,
-                    "penalty": i["penalty"] if i.get("penalty") else 0
-                })
-
-            # второй массив (цены склада)
-            for i in arr2:
-                response.append({
-                    "subjectname": i["subjectname"],
-                    "vendorcode": i["vendorcode"],
-                    "nmid": i["nmid"],
-                    "date_wb": datetime.fromisoformat(str(i["date_wb"])).date(),
-                    "warehousePrice": i["warehousePrice"],
-                    "retail_price": 0,
-                    "retail_amount": 0,
-                    "ppvz_for_pay": 0,
-                    "delivery_rub": 0,
-                    "acceptance": 0,
-                    "color": i["color"].strip('"') if i.get("color") else 'Цвет не указан',
-                    "supplier_oper_name": "хранение",
-                })
-
-            return response
-
-        result = merge_data(art_per_day, art_per_day_saves)
-
-        return {
-            "data": result,
-            "deduction": deductions
+        if not is_batch(payload):
+            return {
+                "data": result,
+                "deduction": deductions[payload.inn],
+                "totals": totals[payload.inn],
+                "next_cursor": next_cursor,
+            }
+        result = {
+            inn: {"data": data, "deduction": deductions[inn], "totals": totals[inn]}
+            for inn, data in result.items()
         }
+        return {"data": result, "next_cursor": next_cursor} if limit else result
 
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.exception("Ошибка в fin_report_endpoint")
         raise HTTPException(status_code=500, detail="Internal server error")
@@ -289,7 +391,7 @@ async def fin_report_endpoint(
 
 # Pydantic-модель для входящего POST
 class ProductsStatRequest(BaseModel):
-    inn: int = Field(..., description="ИНН клиента, обязательное поле")
+    inn: InnParam = Field(..., description="ИНН клиента, список ИНН или \"all\", обязательное поле")
     date_from: str | None = Field(None, description="Дата начала выборки в формате YYYY-MM-DD, необязательное поле")
     date_to: str | None = Field(None, description="Дата окончания выборки в формате YYYY-MM-DD, необязательное поле")
     articles: list[int] | None = Field(None,
@@ -306,78 +408,69 @@ class ProductStatResponse(BaseModel):
     ordersCount: int = Field(..., description="Количество заказов")
 
 
-@app.post(
-    "/products_stat/",
-    response_model=List[ProductStatResponse],
-    summary="Получить информацию о заказах",
-    description="Возвращает суммарную информацию о заказах по NMID: количество и сумма в рублях. "
-                "Можно фильтровать по дате, артикулам и цветам."
-)
+class OrderResponse(BaseModel):
+    vendorcode: Optional[str] = Field(None, description="Артикул продавца")
+    nmid: int = Field(..., description="Артикул WB")
+    date: datetime = Field(..., description="Дата и время заказа (МСК)")
+    date_wb: date_dt = Field(..., description="Дата заказа (МСК)")
+    color: Optional[str] = Field(None, description="Цвет товара")
+    ord_sum: Optional[float] = Field(None, description="Сумма заказов")
+    ord_count: Optional[int] = Field(None, description="Количество заказов")
+
+
+def product_stat_row(row) -> dict:
+    """Строка myapp_productsstat + карточка -> ProductStatResponse"""
+    return {
+        "vendorcode": row["vendorcode"],
+        "nmid": row["nmid"],
+        "date_wb": row["date_wb"].date() if isinstance(row["date_wb"], datetime) else row["date_wb"],
+        "color": row["color"].strip('"') if row["color"] else 'Цвет не указан',
+        "ordersSumRub": row["ordersSumRub"],
+        "ordersCount": row["ordersCount"],
+    }
+
+
+def order_row(row) -> dict:
+    """Строка myapp_orders + карточка -> OrderResponse, дата заказа переводится в МСК"""
+    # конвертация UTC → MSK
+    dt_msk = row["date"].astimezone(ZoneInfo("Europe/Moscow"))
+    return {
+        "vendorcode": row["vendorcode"],
+        "nmid": row["nmid"],
+        "date": dt_msk,
+        "date_wb": dt_msk.date(),
+        "color": row["color"].strip('"') if row["color"] else 'Цвет не указан',
+        "ord_sum": row["ord_sum"],
+        "ord_count": row["ord_count"],
+    }
+
+
+@fast_route(app.post(
+        "/products_stat/",
+        response_model=report_model(ProductStatResponse),
+        summary="Получить информацию о заказах",
+        description="Возвращает суммарную информацию о заказах по NMID: количество и сумма в рублях. "
+                    "Можно фильтровать по дате, артикулам и цветам."
+    ))
+@cached_response("myapp_productsstat", "myapp_nmids", "myapp_wblk", model=report_model(ProductStatResponse))
 async def products_stat_endpoint(
         payload: ProductsStatRequest,
-        token: str = Depends(verify_token)
+        token: str = Depends(verify_token),
+        format: StreamFormat = None,
+        accept: AcceptHeader = None,
+        limit: PageLimit = None,
+        cursor: PageCursor = None,
 ):
+    fmt = stream_format(format, accept)
 
     try:
         # Парсим даты
         date_from = parse_date(payload.date_from).date() if payload.date_from else None
         date_to = parse_date(payload.date_to).date() if payload.date_to else None
 
-        # Получаем lk
-        query_lk = select(wblk_table).where(wblk_table.c.inn == payload.inn)
-        lk_row = await database.fetch_one(query_lk)
-        if not lk_row:
-            raise HTTPException(status_code=404, detail="WbLk не найден")
-
-        lk_id = lk_row["id"]
-
-        # Получаем список nmid по lk
-        query_nmids = select(
-            nmids_table.c.nmid,
-            nmids_table.c.characteristics
-        ).where(nmids_table.c.lk_id == lk_id)
-
-        if payload.articles:
-            query_nmids = query_nmids.where(nmids_table.c.nmid.in_(payload.articles))
-
-        nmids_rows = await database.fetch_all(query_nmids)
-
-        nmids_list = []
-
-        for row in nmids_rows:
-            nmid = row["nmid"]
-            if payload.colors:
-                characteristics = row["characteristics"]  # JSONField из Django
-                if characteristics is None:
-                    continue
-
-                try:
-                    parsed = (
-                        characteristics
-                        if isinstance(characteristics, list)
-                        else json.loads(characteristics)
-                    )
-                except Exception:
-                    continue
-
-                color_entry = next(
-                    (item for item in parsed if item.get("id") == 14177449), None
-                )
-                if not color_entry:
-                    continue
-
-                value = color_entry.get("value")
-                if not value or not isinstance(value, list):
-                    continue
-
-                color_value = value[0].lower()  # берём первое значение
-                if color_value in [c.lower() for c in payload.colors]:
-                    nmids_list.append(nmid)
-            else:
-                nmids_list.append(nmid)
-
-        if not nmids_list:
-            return []
+        # Получаем кабинеты
+        lks = await resolve_lks(payload.inn)
+        lk_ids = list(lks)
 
         # Фильтруем ProductsStat
         query_stats = (select(
@@ -386,103 +479,65 @@ async def products_stat_endpoint(
             products_table.c.date_wb,
             products_table.c.ordersSumRub,
             products_table.c.ordersCount,
+            nmids_table.c.lk_id,
             color_expr
         )
-       .join(nmids_table, nmids_table.c.nmid == products_table.c.nmid)
-       .where(products_table.c.nmid.in_(nmids_list)))
+       .join(nmids_table, card_join(products_table))
+       .where(*card_filters(lk_ids, payload)))
 
         if date_from:
             query_stats = query_stats.where(products_table.c.date_wb >= date_from)
         if date_to:
             query_stats = query_stats.where(products_table.c.date_wb <= date_to)
 
-        stats_rows = await database.fetch_all(query_stats)
-        all_data = []
-        for row in stats_rows:
-            r = dict(row._mapping)
-            if isinstance(r["date_wb"], datetime):
-                r["date_wb"] = datetime.fromisoformat(str(r["date_wb"])).date()
-            r["color"] = r["color"].strip('"') if r["color"] else 'Цвет не указан'
-            all_data.append(r)
+        if fmt:
+            async def rows():
+                async for row in database.iterate(query_stats):
+                    yield with_inn(product_stat_row(row._mapping), lks, row["lk_id"])
 
-        return all_data
+            return stream_response(fmt, rows(), stream_fields(payload, ProductStatResponse))
 
+        if limit:
+            keys = [nullable_date_key(products_table.c.date_wb), products_table.c.id, nmids_table.c.id]
+            stats_rows, next_cursor = await fetch_page(query_stats, keys, limit, cursor)
+            data = by_inn(payload, lks, [(row["lk_id"], product_stat_row(row._mapping)) for row in stats_rows])
+            return {"data": data, "next_cursor": next_cursor}
+
+        stats_rows = await database.fetch_all(query_stats)
+        return by_inn(payload, lks, [(row["lk_id"], product_stat_row(row._mapping)) for row in stats_rows])
+
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post(
-    "/orders/",
-    response_model=List[ProductStatResponse],
-    summary="Получить информацию о заказах",
-    description="Возвращает суммарную информацию о заказах по NMID: количество и сумма в рублях. "
-                "Можно фильтровать по дате, артикулам и цветам."
-)
+@fast_route(app.post(
+        "/orders/",
+        response_model=report_model(OrderResponse),
+        summary="Получить информацию о заказах",
+        description="Возвращает суммарную информацию о заказах по NMID: количество и сумма в рублях. "
+                    "Можно фильтровать по дате, артикулам и цветам."
+    ))
+@cached_response("myapp_orders", "myapp_nmids", "myapp_wblk", model=report_model(OrderResponse))
 async def orders_endpoint(
         payload: ProductsStatRequest,
-        token: str = Depends(verify_token)
+        token: str = Depends(verify_token),
+        format: StreamFormat = None,
+        accept: AcceptHeader = None,
+        limit: PageLimit = None,
+        cursor: PageCursor = None,
 ):
+    fmt = stream_format(format, accept)
 
     try:
         # Парсим даты
         date_from = parse_date(payload.date_from).date() if payload.date_from else None
         date_to = parse_date(payload.date_to).date() if payload.date_to else None
 
-        # Получаем lk
-        query_lk = select(wblk_table).where(wblk_table.c.inn == payload.inn)
-        lk_row = await database.fetch_one(query_lk)
-        if not lk_row:
-            raise HTTPException(status_code=404, detail="WbLk не найден")
-
-        lk_id = lk_row["id"]
-
-        # Получаем список nmid по lk
-        query_nmids = select(
-            nmids_table.c.nmid,
-            nmids_table.c.characteristics
-        ).where(nmids_table.c.lk_id == lk_id)
-
-        if payload.articles:
-            query_nmids = query_nmids.where(nmids_table.c.nmid.in_(payload.articles))
-
-        nmids_rows = await database.fetch_all(query_nmids)
-
-        nmids_list = []
-
-        for row in nmids_rows:
-            nmid = row["nmid"]
-            if payload.colors:
-                characteristics = row["characteristics"]  # JSONField из Django
-                if characteristics is None:
-                    continue
-
-                try:
-                    parsed = (
-                        characteristics
-                        if isinstance(characteristics, list)
-                        else json.loads(characteristics)
-                    )
-                except Exception:
-                    continue
-
-                color_entry = next(
-                    (item for item in parsed if item.get("id") == 14177449), None
-                )
-                if not color_entry:
-                    continue
-
-                value = color_entry.get("value")
-                if not value or not isinstance(value, list):
-                    continue
-
-                color_value = value[0].lower()  # берём первое значение
-                if color_value in [c.lower() for c in payload.colors]:
-                    nmids_list.append(nmid)
-            else:
-                nmids_list.append(nmid)
-
-        if not nmids_list:
-            return []
+        # Получаем кабинеты
+        lks = await resolve_lks(payload.inn)
+        lk_ids = list(lks)
 
         # Фильтруем ProductsStat
         query_stats = (select(
@@ -491,39 +546,42 @@ async def orders_endpoint(
             orders_table.c.date,
             orders_table.c.ord_sum,
             orders_table.c.ord_count,
+            orders_table.c.lk_id,
             color_expr
         )
-       .join(nmids_table, nmids_table.c.nmid == orders_table.c.nmid)
-       .where(orders_table.c.nmid.in_(nmids_list)))
+       .join(nmids_table, card_join(orders_table))
+       .where(*card_filters(lk_ids, payload)))
 
         if date_from:
             query_stats = query_stats.where(orders_table.c.date >= date_from)
         if date_to:
             query_stats = query_stats.where(orders_table.c.date <= date_to)
 
-        stats_rows = await database.fetch_all(query_stats)
-        all_data = []
-        for row in stats_rows:
-            r = dict(row._mapping)
-            if isinstance(r["date"], datetime):
-                # конвертация UTC → MSK
-                dt_utc = r["date"]
-                dt_msk = dt_utc.astimezone(ZoneInfo("Europe/Moscow"))
-                r["date"] = dt_msk
-                r["date_wb"] = dt_msk.date()
+        if fmt:
+            async def rows():
+                async for row in database.iterate(query_stats):
+                    yield with_inn(order_row(row._mapping), lks, row["lk_id"])
 
-            r["color"] = r["color"].strip('"') if r["color"] else 'Цвет не указан'
-            all_data.append(r)
+            return stream_response(fmt, rows(), stream_fields(payload, OrderResponse))
 
-        return all_data
+        if limit:
+            keys = [orders_table.c.date, orders_table.c.id]
+            stats_rows, next_cursor = await fetch_page(query_stats, keys, limit, cursor)
+            data = by_inn(payload, lks, [(row["lk_id"], order_row(row._mapping)) for row in stats_rows])
+            return {"data": data, "next_cursor": next_cursor}
 
+        stats_rows = await database.fetch_all(query_stats)
+        return by_inn(payload, lks, [(row["lk_id"], order_row(row._mapping)) for row in stats_rows])
+
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 # Pydantic-модель для входящего POST
 class ProductsQuantRequest(BaseModel):
-    inn: int
+    inn: InnParam
     articles: list[int] | None = None
     colors: list[str] | None = None
     sizes: list[int] | None = None
@@ -541,23 +599,23 @@ class ProductQuantResponse(BaseModel):
     color: str = Field(..., description="Цвет")
 
 
-@app.post(
-    "/quantity/",
-    response_model=List[ProductQuantResponse],
-    summary="Получить остатки для артикулов"
-)
+@fast_route(app.post(
+        "/quantity/",
+        response_model=report_model(ProductQuantResponse),
+        summary="Получить остатки для артикулов"
+    ))
+@cached_response("myapp_stocks", "myapp_nmids", "myapp_wblk", "myapp_warehousealias",
+                 model=report_model(ProductQuantResponse))
 async def products_quantity_endpoint(
         payload: ProductsQuantRequest,
-        token: str = Depends(verify_token)
+        token: str = Depends(verify_token),
+        limit: PageLimit = None,
+        cursor: PageCursor = None,
 ):
     try:
-        # Получаем lk
-        query_lk = select(wblk_table).where(wblk_table.c.inn == payload.inn)
-        lk_row = await database.fetch_one(query_lk)
-        if not lk_row:
-            raise HTTPException(status_code=404, detail="WbLk не найден")
-
-        lk_id = lk_row["id"]
+        # Получаем кабинеты
+        lks = await resolve_lks(payload.inn)
+        lk_ids = list(lks)
 
         query_stocks = (select(
             nmids_table.c.vendorcode,
@@ -567,35 +625,37 @@ async def products_quantity_endpoint(
             stocks_table.c.inwayfromclient,
             stocks_table.c.quantity,
             stocks_table.c.warehousename,
+            stocks_table.c.lk_id,
             color_expr,
-            ).join(nmids_table, stocks_table.c.nmid == nmids_table.c.nmid)
-            .where(nmids_table.c.lk_id == lk_id)
+            ).join(nmids_table, card_join(stocks_table))
+            .where(*card_filters(lk_ids, payload))
         )
 
-        if payload.articles:
-            query_stocks = query_stocks.where(stocks_table.c.nmid.in_(payload.articles))
-
         if payload.sizes:
-            query_stocks = query_stocks.where(stocks_table.c.techsize.in_(payload.sizes))
+            # techsize — строка, размеры в запросе приходят числами
+            query_stocks = query_stocks.where(any_of(stocks_table.c.techsize, [str(s) for s in payload.sizes]))
 
         if payload.warhouses:
-            lower_warehouses = [w.lower() for w in payload.warhouses]
+            # склад по справочнику: любое написание названия -> warehouse_id, фильтр по индексу
+            lower_warehouses = [w.strip().lower() for w in payload.warhouses]
             query_stocks = query_stocks.where(
-                func.lower(stocks_table.c.warehousename).in_(lower_warehouses)
+                stocks_table.c.warehouse_id.in_(
+                    select(warehouse_alias_table.c.warehouse_id)
+                    .where(any_of(warehouse_alias_table.c.alias, lower_warehouses))
+                )
             )
 
-        stock_rows = await database.fetch_all(query_stocks)
+        next_cursor = None
+        if limit:
+            stock_rows, next_cursor = await fetch_page(query_stocks, [stocks_table.c.id], limit, cursor)
+        else:
+            stock_rows = await database.fetch_all(query_stocks)
         row_data = [dict(row._mapping) for row in stock_rows]
 
-        colors_lower = [c.lower() for c in payload.colors] if payload.colors else []
-
         all_data = []
         for i in row_data:
             color = i["color"].strip('"').lower() if i.get("color") else 'Цвет не указан'
-            if colors_lower and color not in colors_lower:
-                continue
-
-            all_data.append(dict(
+            all_data.append((i["lk_id"], dict(
                 vendorcode=i["vendorcode"],
                 nmid=i["nmid"],
                 inwaytoclient=i["inwaytoclient"],
@@ -604,15 +664,20 @@ async def products_quantity_endpoint(
                 size=i["techsize"],
                 warehouse=i["warehousename"],
                 color=color
-            ))
+            )))
 
-        return all_data
+        if limit:
+            return {"data": by_inn(payload, lks, all_data), "next_cursor": next_cursor}
+        return by_inn(payload, lks, all_data)
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/warehouses/", summary="Получить список уникальных складов")
+@cached_response("myapp_stocks")
 async def get_unique_warehouses(
         token: str = Depends(verify_token)
 ):
@@ -627,6 +692,7 @@ async def get_unique_warehouses(
 
 
 @app.get("/supplier_oper_name/", summary="Получить список уникальных оснований для оплаты")
+@cached_response("myapp_findata")
 async def get_supplier_oper_name(
         token: str = Depends(verify_token)
 ):
@@ -640,53 +706,53 @@ async def get_supplier_oper_name(
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.get("/dimensions/", summary="Получить данные о товарах")
+@fast_route(app.get("/dimensions/", summary="Получить данные о товарах"))
+@cached_response("myapp_nmids", "myapp_wblk")
 async def get_dimensions(
-        token: str = Depends(verify_token)
+        token: str = Depends(verify_token),
+        limit: PageLimit = None,
+        cursor: PageCursor = None,
 ):
     try:
+        if not limit:
+            # готовый JSON, который пересобирает get_nmids после загрузки карточек
+            snapshot = await asyncio.to_thread(get_dimensions_snapshot) or await refresh_dimensions_snapshot()
+            return Response(content=snapshot, media_type="application/json")
+
         query_data = (
             select(
                 nmids_table.c.vendorcode,
                 nmids_table.c.nmid,
                 nmids_table.c.subjectname,
-                nmids_table.c.title,
-                nmids_table.c.dimensions,
+                nmids_table.c.img_url,
+                nmids_table.c.height,
+                nmids_table.c.length,
+                nmids_table.c.width,
                 wblk_table.c.inn,
-                # достаём первый элемент photos, где big оканчивается на /1.webp
-                func.coalesce(
-                    text("""
-                        (
-                            SELECT p->>'big'
-                            FROM jsonb_array_elements(photos) AS p
-                            WHERE p->>'big' LIKE '%/1.webp'
-                            LIMIT 1
-                        )
-                        """),
-                    text("'пока пусто'")
-                ).label("img_url")
             )
             .select_from(
                 nmids_table.join(wblk_table, nmids_table.c.lk_id == wblk_table.c.id)
             )
         )
-        rows = await database.fetch_all(query_data)
+        rows, next_cursor = await fetch_page(query_data, [nmids_table.c.id], limit, cursor)
 
         response = {
             row["vendorcode"] : {
                 "inn": row["inn"],
-                "img_url": row["img_url"],
+                "img_url": row["img_url"] or 'пока пусто',
                 "nmid": row["nmid"],
                 "subjectname": row["subjectname"],
                 "dimensions" : {
-                    "height": row["dimensions"]["height"],
-                    "lenght": row["dimensions"]["length"],
-                    "width": row["dimensions"]["width"],
+                    "height": row["height"],
+                    "lenght": row["length"],
+                    "width": row["width"],
                 }
             }
             for row in rows
         }
-        return response
+        return {"data": response, "next_cursor": next_cursor}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -699,27 +765,26 @@ class AdvCostResponse(BaseModel):
     date_wb: date_dt = Field(..., description="Дата отчёта (YYYY-MM-DD)")
 
 
-@app.post(
-    "/adv_cost/",
-    response_model=List[AdvCostResponse],
-    summary="Получить затраты на рекламу поартикульно"
-)
+@fast_route(app.post(
+        "/adv_cost/",
+        response_model=report_model(AdvCostResponse),
+        summary="Получить затраты на рекламу поартикульно"
+    ))
+@cached_response("myapp_advstat", "myapp_nmids", "myapp_wblk", model=report_model(AdvCostResponse))
 async def get_adv_cost(
         payload: ProductsStatRequest,
-        token: str = Depends(verify_token)
+        token: str = Depends(verify_token),
+        limit: PageLimit = None,
+        cursor: PageCursor = None,
 ):
     try:
         # Парсим даты
         date_from = parse_date(payload.date_from).date() if payload.date_from else None
         date_to = parse_date(payload.date_to).date() if payload.date_to else None
 
-        # Получаем lk
-        query_lk = select(wblk_table).where(wblk_table.c.inn == payload.inn)
-        lk_row = await database.fetch_one(query_lk)
-        if not lk_row:
-            raise HTTPException(status_code=404, detail="WbLk не найден")
-
-        lk_id = lk_row["id"]
+        # Получаем кабинеты
+        lks = await resolve_lks(payload.inn)
+        lk_ids = list(lks)
 
         # Получаем список nmid по lk
         query_nmids = (
@@ -728,40 +793,42 @@ async def get_adv_cost(
                 advstat_table.c.nmid,
                 advstat_table.c.sum_cost,
                 advstat_table.c.date_wb,
+                nmids_table.c.lk_id,
                 color_expr,
-            ).join(nmids_table, advstat_table.c.nmid == nmids_table.c.nmid)
-            .where(nmids_table.c.lk_id == lk_id)
+            ).join(nmids_table, card_join(advstat_table))
+            .where(*card_filters(lk_ids, payload))
         )
 
-        if payload.articles:
-            query_nmids = query_nmids.where(advstat_table.c.nmid.in_(payload.articles))
-
         if date_from:
             query_nmids = query_nmids.where(advstat_table.c.date_wb >= date_from)
 
         if date_to:
             query_nmids = query_nmids.where(advstat_table.c.date_wb <= date_to)
 
-        colors_lower = [c.lower() for c in payload.colors] if payload.colors else []
-
-        nmids_rows = await database.fetch_all(query_nmids)
+        next_cursor = None
+        if limit:
+            keys = [nullable_date_key(advstat_table.c.date_wb), advstat_table.c.id, nmids_table.c.id]
+            nmids_rows, next_cursor = await fetch_page(query_nmids, keys, limit, cursor)
+        else:
+            nmids_rows = await database.fetch_all(query_nmids)
         result = []
         for row in nmids_rows:
             color = row["color"].strip('"').lower() if row["color"] else 'Цвет не указан'
-            if colors_lower and color not in colors_lower:
-                continue
-
-            result.append(dict(
+            result.append((row["lk_id"], dict(
                 vendorcode=row["vendorcode"],
                 nmid=row["nmid"],
                 cost=row["sum_cost"] or 0,
                 color=color,
-                date_wb=datetime.fromisoformat(str(row["date_wb"])).date()
-            ))
+                date_wb=row["date_wb"].date()
+            )))
 
 
-        return result
+        if limit:
+            return {"data": by_inn(payload, lks, result), "next_cursor": next_cursor}
+        return by_inn(payload, lks, result)
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -778,27 +845,46 @@ class AdvConversionResponse(BaseModel):
     color: Optional[str] = Field(None, description="Цвет товара")
 
 
-@app.post(
-    "/adv_conversion/",
-    response_model=List[AdvConversionResponse],
-    summary="Получить данные по конверсии"
-)
+def adv_conversion_row(row) -> dict:
+    """Строка myapp_advstat + тип РК + карточка -> AdvConversionResponse"""
+    return dict(
+        vendorcode=row["vendorcode"],
+        nmid=row["nmid"],
+        type_adv=row["type_adv"] or 0,
+        clicks=row["clicks"] or 0,
+        views=row["views"] or 0,
+        atbs=row["atbs"] or 0,
+        orders=row["orders"] or 0,
+        date_wb=row["date_wb"].date(),
+        color=row["color"].strip('"').lower() if row["color"] else 'Цвет не указан',
+    )
+
+
+@fast_route(app.post(
+        "/adv_conversion/",
+        response_model=report_model(AdvConversionResponse),
+        summary="Получить данные по конверсии"
+    ))
+@cached_response("myapp_advstat", "myapp_adverts", "myapp_nmids", "myapp_wblk",
+                 model=report_model(AdvConversionResponse))
 async def get_adv_conversion(
         payload: ProductsStatRequest,
-        token: str = Depends(verify_token)
+        token: str = Depends(verify_token),
+        format: StreamFormat = None,
+        accept: AcceptHeader = None,
+        limit: PageLimit = None,
+        cursor: PageCursor = None,
 ):
+    fmt = stream_format(format, accept)
+
     try:
         # Парсим даты
         date_from = parse_date(payload.date_from).date() if payload.date_from else None
         date_to = parse_date(payload.date_to).date() if payload.date_to else None
 
-        # Получаем lk
-        query_lk = select(wblk_table).where(wblk_table.c.inn == payload.inn)
-        lk_row = await database.fetch_one(query_lk)
-        if not lk_row:
-            raise HTTPException(status_code=404, detail="WbLk не найден")
-
-        lk_id = lk_row["id"]
+        # Получаем кабинеты
+        lks = await resolve_lks(payload.inn)
+        lk_ids = list(lks)
 
         # Получаем список nmid по lk
         query_nmids = (
@@ -810,47 +896,40 @@ async def get_adv_conversion(
                 advstat_table.c.views,
                 advstat_table.c.atbs,
                 advstat_table.c.orders,
-                nmids_table.c.characteristics,
                 advstat_table.c.date_wb,
                 advstat_table.c.advert_id,
+                nmids_table.c.lk_id,
                 color_expr,
             )
-            .join(nmids_table, advstat_table.c.nmid == nmids_table.c.nmid)
+            .join(nmids_table, card_join(advstat_table))
             .join(advs_table, advstat_table.c.advert_id == advs_table.c.advert_id, isouter=True)
-            .where(nmids_table.c.lk_id == lk_id)
+            .where(*card_filters(lk_ids, payload))
         )
 
-        if payload.articles:
-            query_nmids = query_nmids.where(advstat_table.c.nmid.in_(payload.articles))
-
         if date_from:
             query_nmids = query_nmids.where(advstat_table.c.date_wb >= date_from)
 
         if date_to:
             query_nmids = query_nmids.where(advstat_table.c.date_wb <= date_to)
 
-        colors_lower = [c.lower() for c in payload.colors] if payload.colors else []
+        if fmt:
+            async def rows():
+                async for row in database.iterate(query_nmids):
+                    yield with_inn(adv_conversion_row(row), lks, row["lk_id"])
 
-        nmids_rows = await database.fetch_all(query_nmids)
-        result = []
-        for row in nmids_rows:
-            color = row["color"].strip('"').lower() if row["color"] else 'Цвет не указан'
-            if colors_lower and color not in colors_lower:
-                continue
+            return stream_response(fmt, rows(), stream_fields(payload, AdvConversionResponse))
 
-            result.append(dict(
-                vendorcode=row["vendorcode"],
-                nmid=row["nmid"],
-                type_adv = row["type_adv"] or 0,
-                clicks=row["clicks"] or 0,
-                views=row["views"] or 0,
-                atbs=row["atbs"] or 0,
-                orders=row["orders"] or 0,
-                date_wb=datetime.fromisoformat(str(row["date_wb"])).date(),
-                color=color,
-            ))
-        return result
+        if limit:
+            keys = [nullable_date_key(advstat_table.c.date_wb), advstat_table.c.id, nmids_table.c.id]
+            nmids_rows, next_cursor = await fetch_page(query_nmids, keys, limit, cursor)
+            data = by_inn(payload, lks, [(row["lk_id"], adv_conversion_row(row)) for row in nmids_rows])
+            return {"data": data, "next_cursor": next_cursor}
+
+        nmids_rows = await database.fetch_all(query_nmids)
+        return by_inn(payload, lks, [(row["lk_id"], adv_conversion_row(row)) for row in nmids_rows])
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -863,29 +942,26 @@ class ProductSaleResponse(BaseModel):
     color: Optional[str] = Field(None, description="Цвет товара")
     date_wb: date_dt = Field(..., description="Дата отчёта (YYYY-MM-DD)")
 
-@app.post(
-    "/region_sales/",
-    response_model=List[ProductSaleResponse],
-    summary="Получить данные по продажам по регионам"
-)
+@fast_route(app.post(
+        "/region_sales/",
+        response_model=report_model(ProductSaleResponse),
+        summary="Получить данные по продажам по регионам"
+    ))
+@cached_response("myapp_regionsales", "myapp_nmids", "myapp_wblk", model=report_model(ProductSaleResponse))
 async def get_adv_reg_sales(
         payload: ProductsStatRequest,
-        token: str = Depends(verify_token)
+        token: str = Depends(verify_token),
+        limit: PageLimit = None,
+        cursor: PageCursor = None,
 ):
     try:
         # Парсим даты
         date_from = (parse_date(payload.date_from) - timedelta(days=1)).date() if payload.date_from else None
         date_to = parse_date(payload.date_to).date() if payload.date_to else None
 
-        # Получаем lk
-        query_lk = select(wblk_table).where(wblk_table.c.inn == payload.inn)
-        lk_row = await database.fetch_one(query_lk)
-        if not lk_row:
-            raise HTTPException(status_code=404, detail="WbLk не найден")
-
-        lk_id = lk_row["id"]
-
-        colors_lower = [c.lower() for c in payload.colors] if payload.colors else []
+        # Получаем кабинеты
+        lks = await resolve_lks(payload.inn)
+        lk_ids = list(lks)
 
         # Фильтруем ProductsStat
         query_stats = (select(
@@ -894,26 +970,28 @@ async def get_adv_reg_sales(
             sales_reg_table.c.date_wb,
             sales_reg_table.c.saleInvoiceCostPrice,
             sales_reg_table.c.saleItemInvoiceQty,
+            sales_reg_table.c.lk_id,
             color_expr
-            ).join(nmids_table, sales_reg_table.c.nmid == nmids_table.c.nmid)
-            .where(nmids_table.c.lk_id == lk_id)
+            ).join(nmids_table, card_join(sales_reg_table))
+            .where(*card_filters(lk_ids, payload))
        )
 
-        if payload.articles:
-            query_stats = query_stats.where(query_stats.c.nmid.in_(payload.articles))
         if date_from:
             query_stats = query_stats.where(sales_reg_table.c.date_wb >= date_from)
         if date_to:
             query_stats = query_stats.where(sales_reg_table.c.date_wb <= date_to)
 
-        stats_rows = await database.fetch_all(query_stats)
+        next_cursor = None
+        if limit:
+            keys = [sales_reg_table.c.date_wb, sales_reg_table.c.id]
+            stats_rows, next_cursor = await fetch_page(query_stats, keys, limit, cursor)
+        else:
+            stats_rows = await database.fetch_all(query_stats)
         art_per_day = [dict(row._mapping) for row in stats_rows]
 
         all_data = []
         for i in art_per_day:
             color = i["color"].strip('"').lower() if i.get("color") else 'Цвет не указан'
-            if colors_lower and color not in colors_lower:
-                continue
             vendorcode = i["vendorcode"]
             nmid = i["nmid"]
             rub = i["saleInvoiceCostPrice"]
@@ -924,17 +1002,175 @@ async def get_adv_reg_sales(
             dt_msk = dt_utc.astimezone(ZoneInfo("Europe/Moscow"))
             i["date_wb"] = dt_msk.date()
 
-            all_data.append(dict(
+            all_data.append((i["lk_id"], dict(
                 vendorcode=vendorcode,
                 nmid=nmid,
                 rub=rub,
                 sht=sht,
                 color=color,
                 date_wb=i["date_wb"],
-            ))
+            )))
+
+
+        if limit:
+            return {"data": by_inn(payload, lks, all_data), "next_cursor": next_cursor}
+        return by_inn(payload, lks, all_data)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# источник -> (таблица, колонка даты, {мера: колонка, по которой считается SUM})
+AGGREGATE_SOURCES = {
+    "orders": (orders_table, orders_table.c.date, {
+        "ord_sum": orders_table.c.ord_sum,
+        "ord_count": orders_table.c.ord_count,
+    }),
+    "products_stat": (products_table, products_table.c.date_wb, {
+        "ordersSumRub": products_table.c.ordersSumRub,
+        "ordersCount": products_table.c.ordersCount,
+    }),
+    "adv_cost": (advstat_table, advstat_table.c.date_wb, {
+        "cost": advstat_table.c.sum_cost,
+        "clicks": advstat_table.c.clicks,
+        "views": advstat_table.c.views,
+        "atbs": advstat_table.c.atbs,
+        "orders": advstat_table.c.orders,
+    }),
+    "region_sales": (sales_reg_table, sales_reg_table.c.date_wb, {
+        "rub": sales_reg_table.c.saleInvoiceCostPrice,
+        "sht": sales_reg_table.c.saleItemInvoiceQty,
+    }),
+    "fin_report": (findata_table, findata_table.c.rr_dt, {
+        "retail_amount": findata_table.c.retail_amount,
+        "ppvz_for_pay": findata_table.c.ppvz_for_pay,
+        "delivery_rub": findata_table.c.delivery_rub,
+        "acceptance": findata_table.c.acceptance,
+        "penalty": findata_table.c.penalty,
+        "deduction": findata_table.c.deduction,
+    }),
+}
+
+# Источники, строки которых не обязаны иметь карточку: удержания, хранение и штрафы фин. отчета идут без nmid
+# или по удалённым карточкам. Кабинет берётся из lk_id источника, карточка присоединяется LEFT JOIN —
+# иначе суммы расходятся с итогами /fin_report/
+AGGREGATE_OUTER_SOURCES = {"fin_report"}
+
+# измерение группировки -> колонка карточки (nmid берётся из таблицы источника)
+AGGREGATE_DIMENSIONS = {
+    "color": nmids_table.c.color,
+    "subject": nmids_table.c.subjectname,
+    "vendorcode": nmids_table.c.vendorcode,
+}
+
+
+class AggregateRequest(BaseModel):
+    inn: InnParam = Field(..., description="ИНН клиента, список ИНН или \"all\", обязательное поле")
+    source: Literal["orders", "products_stat", "adv_cost", "region_sales", "fin_report"] = Field(
+        ..., description="Какие данные сворачивать"
+    )
+    group_by: list[Literal["nmid", "color", "subject", "vendorcode"]] = Field(
+        default_factory=list, description="Измерения группировки, необязательное поле"
+    )
+    period: Literal["day", "week", "month"] | None = Field(
+        "day", description="Интервал времени (по МСК); null — за весь период одной строкой"
+    )
+    date_from: str | None = Field(None, description="Дата начала выборки в формате YYYY-MM-DD, необязательное поле")
+    date_to: str | None = Field(None, description="Дата окончания выборки в формате YYYY-MM-DD, необязательное поле")
+    articles: list[int] | None = Field(None,
+                                       description="Список артикулов, по которым фильтровать, необязательное поле")
+    colors: list[str] | None = Field(None, description="Список цветов для фильтрации, необязательное поле")
+
+
+class AggregateResponse(BaseModel):
+    period: Optional[date_dt] = Field(None, description="Начало интервала (день, понедельник недели, 1 число месяца)")
+    nmid: Optional[int] = Field(None, description="Артикул WB")
+    color: Optional[str] = Field(None, description="Цвет товара")
+    subject: Optional[str] = Field(None, description="Предмет")
+    vendorcode: Optional[str] = Field(None, description="Артикул продавца")
+    measures: dict[str, float] = Field(..., description="Суммы мер источника")
+
+
+@fast_route(app.post(
+        "/aggregate/",
+        response_model=List[AggregateResponse] | Dict[int, List[AggregateResponse]],
+        summary="Свернуть заказы, рекламу, фин. отчет или продажи по регионам",
+        description="Один GROUP BY в БД по интервалу времени и выбранным измерениям (артикул, цвет, предмет, "
+                    "артикул продавца) вместо выгрузки всех строк. Фильтры — как у остальных отчетов."
+    ))
+@cached_response("myapp_orders", "myapp_productsstat", "myapp_advstat", "myapp_regionsales", "myapp_findata",
+                 "myapp_nmids", "myapp_wblk",
+                 model=List[AggregateResponse] | Dict[int, List[AggregateResponse]])
+async def aggregate_endpoint(
+        payload: AggregateRequest,
+        token: str = Depends(verify_token)
+):
+    try:
+        date_from = parse_date(payload.date_from).date() if payload.date_from else None
+        date_to = parse_date(payload.date_to).date() if payload.date_to else None
 
+        lks = await resolve_lks(payload.inn)
+        lk_ids = list(lks)
+
+        table, date_column, measures = AGGREGATE_SOURCES[payload.source]
+
+        groups = []
+        if is_batch(payload):
+            # пакетный запрос сворачивается отдельно по каждому кабинету
+            lk_column = table.c.lk_id if payload.source in AGGREGATE_OUTER_SOURCES else nmids_table.c.lk_id
+            groups.append(lk_column.label("lk_id"))
+        if payload.period:
+            # period и часовой пояс — константы из Literal, в SQL идут литералами,
+            # чтобы выражение в SELECT и GROUP BY совпадало текстуально
+            msk_date = func.timezone(literal_column("'Europe/Moscow'"), date_column)
+            groups.append(
+                func.date_trunc(literal_column(f"'{payload.period}'"), msk_date).label("period")
+            )
+        for dimension in dict.fromkeys(payload.group_by):
+            column = table.c.nmid if dimension == "nmid" else AGGREGATE_DIMENSIONS[dimension]
+            groups.append(column.label(dimension))
 
-        return all_data
+        query = select(
+            *groups,
+            *(func.coalesce(func.sum(column), 0).label(name) for name, column in measures.items()),
+        )
+        if payload.source in AGGREGATE_OUTER_SOURCES:
+            query = query.select_from(table.outerjoin(nmids_table, card_join(table))).where(
+                any_of(table.c.lk_id, lk_ids)
+            )
+            if payload.articles:
+                query = query.where(any_of(table.c.nmid, payload.articles))
+            if payload.colors:
+                query = query.where(any_of(color_key, [c.strip().lower() for c in payload.colors]))
+        else:
+            query = query.select_from(table.join(nmids_table, card_join(table))).where(
+                *card_filters(lk_ids, payload)
+            )
 
+        # границы дней по МСК, как и интервалы группировки; сравнение с колонкой как есть — по индексу
+        msk = ZoneInfo("Europe/Moscow")
+        if date_from:
+            query = query.where(date_column >= datetime.combine(date_from, time(), msk))
+        if date_to:
+            query = query.where(date_column < datetime.combine(date_to + timedelta(days=1), time(), msk))
+        if groups:
+            query = query.group_by(*groups).order_by(*groups)
+
+        rows = await database.fetch_all(query)
+
+        result = []
+        for row in rows:
+            r = dict(row._mapping)
+            item = {dimension: r.get(dimension) for dimension in ("nmid", "color", "subject", "vendorcode")}
+            item["period"] = r["period"].date() if r.get("period") else None
+            item["measures"] = {name: float(r[name]) for name in measures}
+            result.append((r.get("lk_id"), item))
+        return by_inn(payload, lks, result)
+
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        logger.exception("Ошибка в aggregate_endpoint")
+        raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,93 @@
+import base64
+import json
+from datetime import datetime, timezone
+from typing import Annotated, Generic, List, Optional, Tuple, TypeVar
+
+from fastapi import HTTPException, Query
+from pydantic import BaseModel, Field
+from sqlalchemy import DateTime, func, literal, tuple_
+
+from .database import database
+
+
+PAGE_MAX_LIMIT = 10000
+
+# ?limit=N включает постраничный ответ {"data": ..., "next_cursor": ...};
+# следующая страница — тот же запрос с ?cursor=<next_cursor>
+PageLimit = Annotated[int | None, Query(ge=1, le=PAGE_MAX_LIMIT, description="Размер страницы, необязательное поле")]
+PageCursor = Annotated[str | None, Query(description="next_cursor предыдущей страницы")]
+
+T = TypeVar("T")
+
+# Подставляется вместо NULL в ключ сортировки по nullable-дате: кортеж с NULL сравнивается в NULL,
+# и такие строки не попадали бы ни на одну страницу после первой
+NULL_DATE_KEY = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+class Page(BaseModel, Generic[T]):
+    data: T
+    next_cursor: Optional[str] = Field(None, description="Курсор следующей страницы; null — страница последняя")
+
+
+def nullable_date_key(column):
+    """Ключ keyset по nullable-колонке даты: строки без даты идут первыми"""
+    return func.coalesce(column, literal(NULL_DATE_KEY, column.type), type_=column.type)
+
+
+def encode_cursor(part: int, values: list) -> str:
+    """
+    Курсор — ключ сортировки последней отданной строки.
+    :param part: номер запроса, если ответ собирается из нескольких (фин. отчет: продажи, затем хранение)
+    """
+    raw = json.dumps({"p": part, "k": values}, default=lambda v: v.isoformat(), separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str | None, keys_by_part: List[list]) -> Tuple[int, Optional[list]]:
+    """Курсор из запроса -> (номер запроса, значения ключей сортировки) или (0, None) для первой страницы"""
+    if not cursor:
+        return 0, None
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        part, raw_values = int(data["p"]), data["k"]
+        keys = keys_by_part[part]
+        if raw_values is None:
+            # начало следующего запроса
+            return part, None
+        if len(raw_values) != len(keys):
+            raise ValueError(cursor)
+        values = [
+            datetime.fromisoformat(value) if isinstance(key.type, DateTime) else value
+            for key, value in zip(keys, raw_values)
+        ]
+    except (ValueError, KeyError, IndexError, TypeError):
+        raise HTTPException(status_code=400, detail="Некорректный cursor")
+    return part, values
+
+
+def paginate(query, keys: list, limit: int, after: Optional[list] = None):
+    """
+    Keyset-страница: ORDER BY keys, строки строго после after, limit + 1 строка — чтобы понять, есть ли следующая.
+    keys должны однозначно упорядочивать строки (последний ключ — id) и не быть NULL
+    (nullable-даты — через nullable_date_key).
+    """
+    query = query.add_columns(*(key.label(f"_page_{i}") for i, key in enumerate(keys)))
+    if after is not None:
+        query = query.where(tuple_(*keys) > tuple_(*(literal(value, key.type) for key, value in zip(keys, after))))
+    return query.order_by(*keys).limit(limit + 1)
+
+
+def split_page(rows: list, keys: list, limit: int) -> Tuple[list, Optional[list]]:
+    """Строки страницы и ключ последней из них, если за ней есть ещё строки"""
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, [rows[-1][f"_page_{i}"] for i in range(len(keys))]
+
+
+async def fetch_page(query, keys: list, limit: int, cursor: str | None) -> Tuple[list, Optional[str]]:
+    """Страница одного запроса: (строки, next_cursor)"""
+    _, after = decode_cursor(cursor, [keys])
+    rows = await database.fetch_all(paginate(query, keys, limit, after))
+    rows, last = split_page(rows, keys, limit)
+    return rows, encode_cursor(0, last) if last else None
@@ -0,0 +1,45 @@
+from decimal import Decimal
+from functools import wraps
+
+import orjson
+from fastapi import Response
+
+
+def _default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"{type(value).__name__} не сериализуется в JSON")
+
+
+def dump_json(content) -> bytes:
+    return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+class FastJSONResponse(Response):
+    """JSON через orjson: date/datetime и ключи-числа ({ИНН: ...}) сериализуются без промежуточных объектов"""
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return dump_json(content)
+
+
+def fast_route(route):
+    """
+    Зарегистрировать эндпоинт так, чтобы ответ сериализовался orjson сразу из строк БД,
+    без проверки каждой строки моделью response_model (она остаётся для OpenAPI).
+    Строки собираются функциями *_row в main.py ровно по полям моделей.
+    Имя в модуле остаётся за исходной функцией: задачи выгрузки в Google вызывают её напрямую
+    и получают python-объекты.
+    :param route: app.post(...) / app.get(...)
+    """
+    def decorator(func):
+        @wraps(func)
+        async def endpoint(*args, **kwargs):
+            result = await func(*args, **kwargs)
+            if isinstance(result, Response):
+                return result
+            return FastJSONResponse(result)
+
+        route(endpoint)
+        return func
+    return decorator
@@ -0,0 +1,98 @@
+import csv
+import io
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from typing import AsyncIterator, List, Optional
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+
+STREAM_CHUNK_ROWS = 1000  # сколько строк собирать в один кусок ответа
+
+# format= -> Content-Type. Без format= потоковый вариант выбирается по заголовку Accept
+STREAM_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+def stream_format(format: Optional[str], accept: Optional[str]) -> Optional[str]:
+    """
+    Какой потоковый формат запросил клиент.
+    :return: ключ STREAM_MEDIA_TYPES или None — обычный JSON через response_model
+    """
+    if format:
+        format = format.lower()
+        if format == "json":
+            return None
+        if format not in STREAM_MEDIA_TYPES:
+            raise HTTPException(status_code=400, detail=f"Неизвестный формат {format}")
+        return format
+
+    if accept:
+        for name, media_type in STREAM_MEDIA_TYPES.items():
+            if media_type in accept:
+                return name
+    return None
+
+
+def _json_default(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"{type(value).__name__} не сериализуется в JSON")
+
+
+def _csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+async def _ndjson_chunks(rows: AsyncIterator[dict], fields: List[str]):
+    lines = []
+    async for row in rows:
+        lines.append(json.dumps({field: row.get(field) for field in fields}, ensure_ascii=False, default=_json_default))
+        if len(lines) >= STREAM_CHUNK_ROWS:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+async def _csv_chunks(rows: AsyncIterator[dict], fields: List[str]):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    count = 0
+    async for row in rows:
+        writer.writerow([_csv_value(row.get(field)) for field in fields])
+        count += 1
+        if count >= STREAM_CHUNK_ROWS:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            count = 0
+    yield buffer.getvalue()
+
+
+def stream_response(
+        fmt: str,
+        rows: AsyncIterator[dict],
+        fields: List[str],
+        headers: Optional[dict] = None,
+) -> StreamingResponse:
+    """
+    Отдать строки по мере чтения из БД, не собирая весь ответ в памяти.
+    :param fmt: ключ STREAM_MEDIA_TYPES (из stream_format)
+    :param rows: async-итератор строк-словарей (обычно поверх database.iterate — серверный курсор)
+    :param fields: колонки ответа и их порядок (шапка CSV)
+    :param headers: дополнительные заголовки ответа (итоги, которые не ложатся в строки)
+    """
+    chunks = _csv_chunks(rows, fields) if fmt == "csv" else _ndjson_chunks(rows, fields)
+    return StreamingResponse(chunks, media_type=STREAM_MEDIA_TYPES[fmt], headers=headers)
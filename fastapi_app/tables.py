@@ -0,0 +1,153 @@
+from sqlalchemy import BigInteger, Column, Date, DateTime, Float, Integer, MetaData, String, Table
+from sqlalchemy.dialects.postgresql import JSONB
+
+
+# Таблицы Django (myapp/models.py), которые читает API.
+# Описаны явно, без metadata.reflect: импорт модуля не ходит в БД (его импортируют и воркеры django-q
+# через decorators.py). Колонки — только те, что нужны запросам API; новые добавлять вместе с полем модели.
+metadata = MetaData()
+
+
+wblk_table = Table(
+    "myapp_wblk", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("name", String(255)),
+    Column("inn", BigInteger),
+)
+
+nmids_table = Table(
+    "myapp_nmids", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("lk_id", Integer),
+    Column("nmid", Integer),
+    Column("subjectname", String(255)),
+    Column("vendorcode", String(255)),
+    Column("title", String(500)),
+    Column("photos", JSONB),
+    Column("dimensions", JSONB),
+    Column("img_url", String(500)),
+    Column("height", Integer),
+    Column("length", Integer),
+    Column("width", Integer),
+    Column("color", String(255)),
+    Column("attributes", JSONB),
+)
+
+products_table = Table(
+    "myapp_productsstat", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("nmid", Integer),
+    Column("date_wb", DateTime(timezone=True)),
+    Column("ordersCount", Integer),
+    Column("ordersSumRub", Integer),
+)
+
+orders_table = Table(
+    "myapp_orders", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("lk_id", Integer),
+    Column("date", DateTime(timezone=True)),
+    Column("nmid", Integer),
+    Column("techsize", String(255)),
+    Column("warehouse", String(255)),
+    Column("warehouse_id", Integer),
+    Column("ord_count", Integer),
+    Column("ord_sum", Float),
+)
+
+stocks_table = Table(
+    "myapp_stocks", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("lk_id", Integer),
+    Column("warehousename", String(255)),
+    Column("nmid", Integer),
+    Column("quantity", Integer),
+    Column("inwaytoclient", Integer),
+    Column("inwayfromclient", Integer),
+    Column("techsize", String(255)),
+    Column("warehouse_id", Integer),
+)
+
+advstat_table = Table(
+    "myapp_advstat", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("advert_id", Integer),
+    Column("date_wb", DateTime(timezone=True)),
+    Column("nmid", Integer),
+    Column("orders", Integer),
+    Column("atbs", Integer),
+    Column("clicks", Integer),
+    Column("sum_cost", Float),
+    Column("views", Integer),
+)
+
+advs_table = Table(
+    "myapp_adverts", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("lk_id", Integer),
+    Column("advert_id", Integer),
+    Column("type_adv", Integer),
+)
+
+findata_table = Table(
+    "myapp_findata", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("lk_id", Integer),
+    Column("rrd_id", String(255)),
+    Column("rr_dt", DateTime(timezone=True)),
+    Column("nmid", Integer),
+    Column("sale_dt", DateTime(timezone=True)),
+    Column("ts_name", String(255)),
+    Column("supplier_oper_name", String(255)),
+    Column("retail_price", Float),
+    Column("retail_amount", Float),
+    Column("ppvz_for_pay", Float),
+    Column("delivery_rub", Float),
+    Column("deduction", Float),
+    Column("acceptance", Float),
+    Column("penalty", Float),
+)
+
+# сводка myapp_findata по (кабинет, день), см. database/fin_daily.py
+findaily_table = Table(
+    "myapp_findaily", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("lk_id", Integer),
+    Column("day", Date),
+    Column("rows_count", Integer),
+    Column("retail_amount", Float),
+    Column("ppvz_for_pay", Float),
+    Column("delivery_rub", Float),
+    Column("storage_fee", Float),
+    Column("deduction", Float),
+    Column("acceptance", Float),
+    Column("penalty", Float),
+)
+
+savedata_table = Table(
+    "myapp_savedata", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("lk_id", Integer),
+    Column("date_wb", DateTime(timezone=True)),
+    Column("warehouse_id", Integer),
+    Column("size", String(255)),
+    Column("nmid", Integer),
+    Column("warehousePrice", Integer),
+)
+
+sales_reg_table = Table(
+    "myapp_regionsales", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("lk_id", Integer),
+    Column("date_wb", DateTime(timezone=True)),
+    Column("nmid", Integer),
+    Column("saleInvoiceCostPrice", Float),
+    Column("saleItemInvoiceQty", Integer),
+)
+
+warehouse_alias_table = Table(
+    "myapp_warehousealias", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("alias", String(255)),
+    Column("warehouse_id", Integer),
+)
@@ -22,3 +22,6 @@ ALLOWED_HOSTS=os.getenv("ALLOWED_HOSTS")
 
 LOGIN_MY_SKLAD = os.getenv("LOGIN_MY_SKLAD")
 PASS_MY_SKLAD = os.getenv("PASS_MY_SKLAD")
+
+# id характеристик карточки, которые get_nmids раскладывает в myapp_nmids.attributes (через запятую)
+NMID_ATTRIBUTE_IDS = [int(i) for i in os.getenv("NMID_ATTRIBUTE_IDS", "14177449").split(",") if i.strip()]
@@ -1,36 +1,139 @@
+import csv
+import io
 import logging
-from database.DataBase import connect_to_database
+import os
+import queue
+import sys
+import threading
+
+import psycopg2
+
+from database.DataBase import DATABASE_CONFIG
 from google.functions import get_time_msk
 from log_context import task_context
 
 
+LOG_BATCH_SIZE = 500  # сколько записей копить перед записью в БД
+LOG_FLUSH_INTERVAL = 2.0  # но не дольше, сек
+LOG_QUEUE_SIZE = 100000  # при переполнении (БД недоступна долго) записи уходят в stderr
+
+
 class DBLogHandler(logging.Handler):
-    def emit(self, record):
-        conn = connect_to_database()  # Синхронное подключение к базе данных
-        if conn is None:
-            print("Failed to connect to the database")
+    """
+    Пишет логи в myapp_celerylog пачками из фонового потока.
+
+    emit() только кладёт готовую строку в очередь. Поток раз в LOG_FLUSH_INTERVAL или при наборе
+    LOG_BATCH_SIZE записей отправляет их одним COPY по постоянному соединению.
+    Если БД недоступна — записи печатаются в stderr, соединение пересоздаётся при следующей пачке.
+    Остаток очереди дописывается при close() (logging.shutdown при выходе процесса).
+    """
+
+    def __init__(self, level=logging.NOTSET):
+        super().__init__(level)
+        self._pid = None
+        self._queue = None
+        self._stop = None
+        self._thread = None
+        self._conn = None
+        self._write_lock = None
+
+    def _ensure_worker(self):
+        # django-q форкает воркеры: поток родителя в дочернем процессе не существует
+        if self._pid == os.getpid():
             return
+        with self.lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+            self._write_lock = threading.Lock()
+            self._stop = threading.Event()
+            self._conn = None
+            self._thread = threading.Thread(target=self._run, name="db-log-writer", daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
 
+    def emit(self, record):
         try:
-            # Формируем сообщение для вставки
+            # контекст задачи и время берём в потоке, который логирует
             context = task_context.get({})
-            prefix = f"{context.get('task_name', 'unknown')}"
-            formatted_message = f"{self.format(record)}"
-            current_time = get_time_msk()
-
-            # Используем SQL для вставки данных в таблицу
-            with conn.cursor() as cursor:
-                cursor.execute(
-                    """
-                    INSERT INTO myapp_celerylog (timestamp, source, level, message)
-                    VALUES (%s, %s, %s, %s)
-                    """,
-                    (current_time, prefix, record.levelname, formatted_message)
+            row = (
+                get_time_msk(),
+                f"{context.get('task_name', 'unknown')}",
+                record.levelname,
+                f"{self.format(record)}",
+            )
+            self._ensure_worker()
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self._to_stderr([row])
+        except Exception:
+            self.handleError(record)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._stop.wait(LOG_FLUSH_INTERVAL)
+            self._flush_queue()
+        self._flush_queue()
+
+    def _flush_queue(self):
+        with self._write_lock:
+            self._drain()
+
+    def _drain(self):
+        while True:
+            batch = []
+            try:
+                while len(batch) < LOG_BATCH_SIZE:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            if not batch:
+                return
+            self._write(batch)
+            if len(batch) < LOG_BATCH_SIZE:
+                return
+
+    def _write(self, batch):
+        buffer = io.StringIO()
+        # в COPY csv пустое значение без кавычек — это NULL, а строка "\." — конец данных;
+        # в кавычках оба читаются как обычный текст
+        csv.writer(buffer, quoting=csv.QUOTE_ALL).writerows(batch)
+        buffer.seek(0)
+
+        try:
+            if self._conn is None or self._conn.closed:
+                self._conn = psycopg2.connect(**DATABASE_CONFIG)
+            with self._conn.cursor() as cursor:
+                cursor.copy_expert(
+                    "COPY myapp_celerylog (timestamp, source, level, message) FROM STDIN WITH (FORMAT csv)",
+                    buffer,
                 )
-            conn.commit()  # Сохраняем изменения
+            self._conn.commit()
         except Exception as e:
-            print(f"Error saving log to DB: {e}")
-        finally:
-            conn.close()
+            # не логируем через logging — попадём обратно в этот же обработчик
+            print(f"Error saving log to DB: {e}", file=sys.stderr)
+            self._to_stderr(batch)
+            try:
+                if self._conn is not None:
+                    self._conn.close()
+            except Exception:
+                pass
+            self._conn = None
+
+    @staticmethod
+    def _to_stderr(batch):
+        for timestamp, source, level, message in batch:
+            print(f"{timestamp} | {source} | {level} | {message}", file=sys.stderr)
 
+    def flush(self):
+        if self._pid == os.getpid():
+            self._flush_queue()
 
+    def close(self):
+        if self._pid == os.getpid():
+            self._stop.set()
+            self._thread.join(timeout=10)
+            if self._conn is not None and not self._conn.closed:
+                self._conn.close()
+            self._pid = None
+        super().close()
@@ -1,7 +1,7 @@
 from django.contrib import admin
 from .models import (WbLk, Price, CeleryLog, nmids, Stocks, Orders,
                      ProductsStat, Supplies, Betweenwarhouses, AreaWarehouses, AdvStat, Adverts,
-                     FinData, SaveData, RegionSales, MySklad, TgUser)
+                     FinData, SaveData, RegionSales, MySklad, TgUser, Warehouse, WarehouseAlias)
 
 class TgUserAdmin(admin.ModelAdmin):
     list_display = ('user', 'tg_id', 'tg_status')
@@ -22,6 +22,18 @@ class AdvStatAdmin(admin.ModelAdmin):
     list_filter = ('nmid', 'advert_id', 'date_wb',)
 
 
+class WarehouseAliasInline(admin.TabularInline):
+    model = WarehouseAlias
+    extra = 0
+
+
+class WarehouseAdmin(admin.ModelAdmin):
+    list_display = ('name', 'key', 'office_id')
+    search_fields = ('name', 'key', 'aliases__alias')
+    ordering = ('name',)
+    inlines = (WarehouseAliasInline,)
+
+
 class AreaWarehousesAdmin(admin.ModelAdmin):
     list_display = ('area', 'warehouses')
     search_fields = ('area',)
@@ -123,6 +135,7 @@ admin.site.register(ProductsStat, ProductsStatAdmin)
 admin.site.register(Supplies, SuppliesAdmin)
 admin.site.register(Betweenwarhouses, BetweenwarhousesAdmin)
 admin.site.register(AreaWarehouses, AreaWarehousesAdmin)
+admin.site.register(Warehouse, WarehouseAdmin)
 admin.site.register(AdvStat, AdvStatAdmin)
 admin.site.register(Adverts, AdvertsAdmin)
 admin.site.register(TgUser, TgUserAdmin)
\ No newline at end of file
@@ -4,3 +4,16 @@ from django.apps import AppConfig
 class MyappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'myapp'
+
+    def ready(self):
+        from django.db.models.signals import post_delete, post_save
+
+        from database.table_versions import bump_table_versions
+        from .models import WbLk
+
+        # кабинеты правят в админке: ИНН и название входят в ответы API, кэш надо сбросить
+        def bump_wblk(**kwargs):
+            bump_table_versions("myapp_wblk")
+
+        post_save.connect(bump_wblk, sender=WbLk, weak=False, dispatch_uid="bump_wblk_save")
+        post_delete.connect(bump_wblk, sender=WbLk, weak=False, dispatch_uid="bump_wblk_delete")
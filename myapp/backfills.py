@@ -0,0 +1,61 @@
+import asyncio
+import logging
+
+from context_logger import ContextLogger
+from database.DataBase import async_connect_to_database, close_async_pool
+from database.warehouses import WAREHOUSE_SOURCES, sync_warehouse_registry
+from parsers.wildberies import COLOR_CHARACTERISTIC_ID, backfill_card_attributes
+
+logger = ContextLogger(logging.getLogger("myapp"))
+
+
+# Есть строки с названием склада, но без warehouse_id
+WAREHOUSES_PENDING_QUERY = "SELECT " + " OR ".join(
+    f"""EXISTS (SELECT 1 FROM {table_name} WHERE warehouse_id IS NULL AND btrim("{column}") <> '')"""
+    for table_name, column in WAREHOUSE_SOURCES
+)
+
+# Есть карточки, у которых color не совпадает с characteristics или attributes не заполнены
+CARD_ATTRIBUTES_PENDING_QUERY = f"""
+    SELECT EXISTS (
+        SELECT 1 FROM myapp_nmids
+        WHERE color IS DISTINCT FROM nullif(
+                jsonb_path_query_first(characteristics, '$[*] ? (@.id == {COLOR_CHARACTERISTIC_ID}).value[0]') #>> '{{}}',
+                ''
+            )
+            OR (color IS NOT NULL AND attributes = '{{}}'::jsonb)
+    )
+"""
+
+# Дозаполнение колонок, добавленных к уже загруженным таблицам: шаг -> запрос "есть что дозаполнять".
+# Миграции в репозитории не хранятся (makemigrations при старте контейнера), поэтому вместо data-миграций
+# шаги запускаются командой manage.py run_backfills. Шаг выполняется, только если запрос вернул true
+BACKFILLS = [
+    (sync_warehouse_registry, WAREHOUSES_PENDING_QUERY),  # строки, загруженные до справочника складов
+    (backfill_card_attributes, CARD_ATTRIBUTES_PENDING_QUERY),  # карточки, загруженные до color и attributes
+]
+
+
+async def run_backfills() -> None:
+    conn = await async_connect_to_database()
+    if not conn:
+        raise Exception("Ошибка подключения к БД в run_backfills")
+
+    for backfill, pending_query in BACKFILLS:
+        try:
+            if not await conn.fetchval(pending_query):
+                logger.info(f"{backfill.__name__}: дозаполнять нечего")
+                continue
+            await backfill()
+        except Exception:
+            logger.exception(f"Ошибка дозаполнения {backfill.__name__}")
+
+
+def run_backfills_sync() -> None:
+    loop = asyncio.new_event_loop()
+    try:
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(run_backfills())
+    finally:
+        loop.run_until_complete(close_async_pool())
+        loop.close()
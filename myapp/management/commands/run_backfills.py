@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from myapp.backfills import run_backfills_sync
+
+
+class Command(BaseCommand):
+    help = "Дозаполнить колонки, добавленные к уже загруженным таблицам (warehouse_id, color/attributes карточек)"
+
+    def handle(self, *args, **options):
+        run_backfills_sync()
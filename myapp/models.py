@@ -1,4 +1,7 @@
 from django.db import models
+from django.db.models import F
+from django.db.models.functions import Lower, Trim
+from django.contrib.postgres.indexes import GinIndex
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
@@ -25,6 +28,28 @@ class AreaWarehouses(models.Model):
 
 
 
+# Справочник складов WB: одна запись на склад, ключ — нормализованное название
+class Warehouse(models.Model):
+    key = models.CharField(max_length=255, unique=True)  # нормализованное название в нижнем регистре
+    name = models.CharField(max_length=255)  # название, под которым склад встретился впервые
+    office_id = models.IntegerField(null=True, db_index=True)  # officeId из отчета о платном хранении
+
+    class Meta:
+        verbose_name_plural = "Склады"
+
+    def __str__(self):
+        return self.name
+
+
+# Все написания названия склада из разных отчетов WB -> склад
+class WarehouseAlias(models.Model):
+    alias = models.CharField(max_length=255, unique=True)  # название как в отчете, в нижнем регистре
+    warehouse = models.ForeignKey(Warehouse, on_delete=models.CASCADE, related_name="aliases")
+
+    class Meta:
+        verbose_name_plural = "Склады (названия)"
+
+
 # Модель для таблицы wb_lk
 class WbLk(models.Model):
     # myapp_wblk
@@ -37,6 +62,9 @@ class WbLk(models.Model):
     tg_id = models.BigIntegerField(default=0, null=True)
 
     class Meta:
+        indexes = [
+            models.Index(fields=['inn'], name='wblk_inn_idx'),  # кабинет по ИНН — в каждом запросе API
+        ]
         verbose_name = "Личный кабинет"
         verbose_name_plural = "Личные кабинеты"
     def __str__(self):
@@ -65,9 +93,14 @@ class Price(models.Model):
     usn = models.IntegerField(default=1, null=True)
     nds = models.IntegerField(default=7, null=True)
     main_status = models.BooleanField(default=False)
+    row_hash = models.CharField(max_length=32, null=True) # md5 загружаемых полей, см. bulk_upsert_to_db
 
     class Meta:
         unique_together = ['nmid', 'lk']  # Уникальное ограничение на комбинацию nmID и lk
+        indexes = [
+            # себестоимость из гугл таблицы сопоставляется по LOWER(TRIM(vendorcode)) (set_costprice_to_db)
+            models.Index(Lower(Trim('vendorcode')), name='price_vendorcode_norm_idx'),
+        ]
         verbose_name_plural = "Цены и товары"
 
     def __str__(self):
@@ -108,8 +141,15 @@ class nmids(models.Model):
     needkiz = models.BooleanField() # Требуется ли код маркировки для этого товара
     photos = models.JSONField(null=True, blank=True) # фотки без видео
     dimensions = models.JSONField() # Габариты и вес товара c упаковкой, см и кг
+    img_url = models.CharField(max_length=500, null=True) # Главное фото из photos (big, оканчивается на /1.webp)
+    height = models.IntegerField(null=True) # Высота из dimensions, см
+    length = models.IntegerField(null=True) # Длина из dimensions, см
+    width = models.IntegerField(null=True) # Ширина из dimensions, см
     characteristics = models.JSONField() # Характеристики
+    color = models.CharField(max_length=255, null=True) # Цвет из characteristics, в исходном регистре (индекс по lower)
+    attributes = models.JSONField(default=dict) # {id характеристики: значение в нижнем регистре} для NMID_ATTRIBUTE_IDS
     sizes = models.JSONField() # Размеры товара
+    row_hash = models.CharField(max_length=32, null=True) # md5 загружаемых полей, см. bulk_upsert_to_db
     tag_ids = models.JSONField(default=list)
     created_at = models.DateTimeField() # Дата создания карточки товара (по данным WB)
     updated_at = models.DateTimeField() # Дата изменения карточки товара (по данным WB)
@@ -118,6 +158,10 @@ class nmids(models.Model):
 
     class Meta:
         unique_together = ['nmid', 'lk']
+        indexes = [
+            models.Index(F('lk'), Lower('color'), name='nmids_lk_color_lower_idx'),  # фильтр по цвету в API
+            GinIndex(fields=['attributes'], opclasses=['jsonb_path_ops'], name='myapp_nmids_attributes_gin'),
+        ]
         verbose_name = "Товар WB"
         verbose_name_plural = "Товары WB"
 
@@ -138,7 +182,9 @@ class Supplies(models.Model):
     totalPrice = models.IntegerField() # Цена из УПД
     dateClose = models.DateTimeField() # Дата принятия (закрытия) в WB.
     warehouseName = models.CharField(max_length=255, null=True) #Название склада
+    warehouse_id = models.IntegerField(null=True, db_index=True)  # id в myapp_warehouse
     status = models.CharField() #Текущий статус поставки
+    row_hash = models.CharField(max_length=32, null=True) # md5 загружаемых полей, см. bulk_upsert_to_db
 
     class Meta:
         unique_together = ['incomeId', 'nmid']
@@ -180,9 +226,14 @@ class Stocks(models.Model):
     days_in_stock_last_7 = models.IntegerField(null=True, default=0)
     days_in_stock_last_14 = models.IntegerField(null=True, default=0)
     days_in_stock_last_30 = models.IntegerField(null=True, default=0)
+    warehouse_id = models.IntegerField(null=True)  # id в myapp_warehouse
+    row_hash = models.CharField(max_length=32, null=True) # md5 загружаемых полей, см. bulk_upsert_to_db
 
     class Meta:
         unique_together = ['nmid', 'lk', 'supplierarticle', 'warehousename']
+        indexes = [
+            models.Index(fields=['nmid', 'warehouse_id']),
+        ]
         verbose_name_plural = "Отстаки товаров на складах"
 
     def __str__(self):
@@ -203,6 +254,7 @@ class Orders(models.Model):
     techsize = models.CharField(max_length=255, null=True) # Размер товара
     contract = models.CharField(max_length=255, null=True, blank=True) # Контракт
     warehouse = models.CharField(max_length=255, null=True) # Склад
+    warehouse_id = models.IntegerField(null=True, db_index=True)  # id в myapp_warehouse
     ord_count = models.IntegerField(null=True, blank=True) # Кол-во заказов, шт
     ord_sum = models.FloatField(null=True, blank=True) # Сумма заказов
     redeem = models.IntegerField(null=True, blank=True) # Выкупили, шт
@@ -212,6 +264,10 @@ class Orders(models.Model):
 
     class Meta:
         unique_together = ['techsize', 'date', 'lk', 'warehouse', 'nmid']
+        indexes = [
+            models.Index(fields=['lk', 'date'], name='orders_lk_date_idx'),
+            models.Index(fields=['nmid', 'date'], name='orders_nmid_date_idx'),
+        ]
         verbose_name = "Заказ WB"
         verbose_name_plural = "Заказы WB"
 
@@ -267,7 +323,7 @@ class Adverts(models.Model):
 
 class FinData(models.Model):
     lk = models.ForeignKey(WbLk, on_delete=models.CASCADE, default=1)
-    rrd_id = models.CharField(max_length=255, unique=True) # Номер строки
+    rrd_id = models.CharField(max_length=255) # Номер строки
     rr_dt = models.DateTimeField() # Дата операции
     nmid = models.IntegerField() # Артикул ВБ
     order_dt = models.DateTimeField() # Дата заказа
@@ -285,15 +341,53 @@ class FinData(models.Model):
     penalty = models.FloatField(null=True, blank=True) # Штрафы
 
     class Meta:
+        indexes = [
+            models.Index(fields=['lk', 'rr_dt']),
+            models.Index(fields=['nmid', 'rr_dt']),
+        ]
+        # rr_dt в ключе: таблица секционируется по нему (database/partitions.py), а у строки он не меняется
+        unique_together = ['rrd_id', 'rr_dt']
         verbose_name_plural = "ФИН отчет"
 
 
+class SyncState(models.Model):
+    """Докуда загружен набор данных кабинета (database/sync_state.py)"""
+    lk = models.ForeignKey(WbLk, on_delete=models.CASCADE)
+    dataset = models.CharField(max_length=50) # stocks, fin_report, region_sales, ...
+    watermark = models.DateTimeField() # данные загружены до этого момента (lastChangeDate, rr_dt или день)
+    cursor = models.CharField(max_length=255, null=True, blank=True) # курсор источника, например последний rrd_id
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['lk', 'dataset']
+        verbose_name_plural = "Синхронизация наборов данных"
+
+
+class FinDaily(models.Model):
+    """Суммы FinData по кабинету за день. Пересчитывает get_fin_report для дней, которые загрузил"""
+    lk = models.ForeignKey(WbLk, on_delete=models.CASCADE)
+    day = models.DateField() # дата rr_dt по МСК, см. database/fin_daily.py
+    rows_count = models.IntegerField(default=0) # Строк фин отчета за день
+    retail_amount = models.FloatField(default=0) # Сумма реализации
+    ppvz_for_pay = models.FloatField(default=0) # К перечислению продавцу
+    delivery_rub = models.FloatField(default=0) # Стоимость доставки
+    storage_fee = models.FloatField(default=0) # Хранение
+    deduction = models.FloatField(default=0) # Удержание
+    acceptance = models.FloatField(default=0) # Платная приемка
+    penalty = models.FloatField(default=0) # Штрафы
+
+    class Meta:
+        unique_together = ['lk', 'day']
+        verbose_name_plural = "ФИН отчет по дням"
+
+
 class SaveData(models.Model):
     lk = models.ForeignKey(WbLk, on_delete=models.CASCADE, default=1)
     date_wb = models.DateTimeField(null=True)  # Дата, за которую был расчёт или перерасчёт
     logWarehouseCoef = models.IntegerField() # Коэффициент логистики и хранения
     officeId = models.IntegerField() # ID склада
     warehouse = models.CharField(max_length=255, null=True) # Название склада
+    warehouse_id = models.IntegerField(null=True, db_index=True)  # id в myapp_warehouse
     warehouseCoef = models.IntegerField() # Коэффициент склада
     giId = models.IntegerField() # ID поставки
     chrtId = models.IntegerField() # ID размера для этого артикула WB
@@ -316,6 +410,10 @@ class SaveData(models.Model):
 
     class Meta:
         unique_together = ['date_wb', 'nmid', 'calcType', 'size']
+        indexes = [
+            models.Index(fields=['nmid', 'date_wb']),
+            models.Index(fields=['lk', 'date_wb'], name='savedata_lk_date_idx'),
+        ]
         verbose_name_plural = 'ХРАНЕНИЕ платное'
 
 
@@ -334,6 +432,10 @@ class RegionSales(models.Model):
 
     class Meta:
         unique_together = ['date_wb', 'nmid', 'sa', 'cityName', 'regionName']
+        indexes = [
+            models.Index(fields=['lk', 'date_wb'], name='regionsales_lk_date_idx'),
+            models.Index(fields=['nmid', 'date_wb'], name='regionsales_nmid_date_idx'),
+        ]
         verbose_name_plural = 'ПРОДАЖИ по регионам'
 
 
@@ -11,6 +11,10 @@ from tasks.drop_to_goo_table import (upload_dimensions_to_google, upload_advconv
                                      upload_save_data_to_google)
 
 import logging
+from database.DataBase import close_async_pool
+from database.warehouses import sync_warehouse_registry
+from database.partitions import maintain_partitions, partition_tables
+from parsers.wb_session import close_wb_session
 from decorators import with_task_context
 from context_logger import ContextLogger
 
@@ -35,6 +39,8 @@ def delete_report_task():
     except Exception as e:
         logger.error(f"Ошибка: {e}")
     finally:
+        loop.run_until_complete(close_wb_session())
+        loop.run_until_complete(close_async_pool())
         loop.close()
     logger.info(f"Удаление отчетов из ЛК WB завершено")
 
@@ -49,6 +55,8 @@ def load_to_db_report_task():
     except Exception as e:
         logger.error(f"Ошибка: {e}")
     finally:
+        loop.run_until_complete(close_wb_session())
+        loop.run_until_complete(close_async_pool())
         loop.close()
     logger.info(f"Загрузка в БД завершена")
 
@@ -63,6 +71,8 @@ def download_orders_from_wb_lk_task():
     except Exception as e:
         logger.error(f"Ошибка: {e}")
     finally:
+        loop.run_until_complete(close_wb_session())
+        loop.run_until_complete(close_async_pool())
         loop.close()
     logger.info(f"Скачивание завершено")
 
@@ -77,6 +87,8 @@ def get_orders_from_wb_lk_task():
     except Exception as e:
         logger.error(f"Ошибка: {e}")
     finally:
+        loop.run_until_complete(close_wb_session())
+        loop.run_until_complete(close_async_pool())
         loop.close()
     logger.info(f"Генерация завершена")
 
@@ -91,6 +103,8 @@ def update_google_table_mysklad_task():
     except Exception as e:
         logger.error(f"Ошибка: {e}")
     finally:
+        loop.run_until_complete(close_wb_session())
+        loop.run_until_complete(close_async_pool())
         loop.close()
     logger.info("Мой склад google обновлена")
 
@@ -105,6 +119,8 @@ def get_and_save_mysklad_data_task():
     except Exception as e:
         logger.error(f"Ошибка: {e}")
     finally:
+        loop.run_until_complete(close_wb_session())
+        loop.run_until_complete(close_async_pool())
         loop.close()
     logger.info("Мой склад в БД обновлены")
 
@@ -119,6 +135,8 @@ def get_region_sales_task():
     except Exception as e:
         logger.error(f"Ошибка: {e}")
     finally:
+        loop.run_until_complete(close_wb_session())
+        loop.run_until_complete(close_async_pool())
         loop.close()
     logger.info("ПРОДАЖИ регион в БД обновлены")
 
@@ -133,6 +151,8 @@ def make_and_get_save_report_task():
     except Exception as e:
         logger.error(f"Ошибка: {e}")
     finally:
+        loop.run_until_complete(close_wb_session())
+        loop.run_until_complete(close_async_pool())
         loop.close()
     logger.info("ХРАНЕНИЕ отчет в БД обновлены")
 
@@ -147,6 +167,8 @@ def get_fin_report_task():
     except Exception as e:
         logger.error(f"Ошибка: {e}")
     finally:
+        loop.run_until_complete(close_wb_session())
+        loop.run_until_complete(close_async_pool())
         loop.close()
     logger.info("ФИН отчеты в БД обновлены")
 
@@ -161,6 +183,8 @@ def get_advs_stat_task():
     except Exception as e:
         logger.error(f"Ошибка: {e}")
     finally:
+        loop.run_until_complete(close_wb_session())
+        loop.run_until_complete(close_async_pool())
         loop.close()
     logger.info("Рекламная СТАТА в БД обновлены")
 
@@ -175,6 +199,8 @@ def get_advs_task():
     except Exception as e:
         logger.error(f"Ошибка: {e}")
     finally:
+        loop.run_until_complete(close_wb_session())
+        loop.run_until_complete(close_async_pool())
         loop.close()
     logger.info("Рекламы в БД обновлены")
 
@@ -189,6 +215,8 @@ def get_stat_products_task():
     except Exception as e:
         logger.error(f"Ошибка: {e}")
     finally:
+        loop.run_until_complete(close_wb_session())
+        loop.run_until_complete(close_async_pool())
         loop.close()
     logger.info("Стата по товарам в БД обновлены")
 
@@ -203,6 +231,8 @@ def get_stock_age_by_period_task():
     except Exception as e:
         logger.error(f"Ошибка: {e}")
     finally:
+        loop.run_until_complete(close_wb_session())
+        loop.run_until_complete(close_async_pool())
         loop.close()
     logger.info("Время нахождения товара на складах за пероиды получено")
 
@@ -217,6 +247,8 @@ def get_nmids_to_db():
     except Exception as e:
         logger.error(f"Ошибка: {e}")
     finally:
+        loop.run_until_complete(close_wb_session())
+        loop.run_until_complete(close_async_pool())
         loop.close()
 
     logger.info("Таблица со всеми артикулами обновлена")
@@ -232,10 +264,58 @@ def get_stocks_to_db():
     except Exception as e:
         logger.error(f"Ошибка: {e}")
     finally:
+        loop.run_until_complete(close_wb_session())
+        loop.run_until_complete(close_async_pool())
         loop.close()
     logger.info("Таблица с остатками товаров на складах обновлена")
 
 
+@with_task_context("sync_warehouse_registry")
+def sync_warehouse_registry_task():
+    logger.info("🟢 Обновляем справочник складов")
+    loop = asyncio.new_event_loop()
+    try:
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(sync_warehouse_registry())
+    except Exception as e:
+        logger.error(f"Ошибка: {e}")
+    finally:
+        loop.run_until_complete(close_async_pool())
+        loop.close()
+    logger.info("Справочник складов обновлен")
+
+
+@with_task_context("partition_tables")
+def partition_tables_task():
+    """Разовый перевод таблиц фактов в секционированные. Блокирует таблицы на время копирования"""
+    logger.info("🟢 Секционируем таблицы фактов")
+    loop = asyncio.new_event_loop()
+    try:
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(partition_tables())
+    except Exception as e:
+        logger.error(f"Ошибка: {e}")
+    finally:
+        loop.run_until_complete(close_async_pool())
+        loop.close()
+    logger.info("Секционирование завершено")
+
+
+@with_task_context("maintain_partitions")
+def maintain_partitions_task(archive: bool = True):
+    logger.info("🟢 Обслуживаем секции таблиц фактов")
+    loop = asyncio.new_event_loop()
+    try:
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(maintain_partitions(archive=archive))
+    except Exception as e:
+        logger.error(f"Ошибка: {e}")
+    finally:
+        loop.run_until_complete(close_async_pool())
+        loop.close()
+    logger.info("Секции обновлены")
+
+
 @with_task_context("upload_dimensions_to_google_task")
 def upload_dimensions_to_google_task(**kwargs):
     logger.info("🟢 Загрузка dimensions в гугл табл")
@@ -246,6 +326,8 @@ def upload_dimensions_to_google_task(**kwargs):
     except Exception as e:
         logger.error(f"Ошибка: {e}")
     finally:
+        loop.run_until_complete(close_wb_session())
+        loop.run_until_complete(close_async_pool())
         loop.close()
     logger.info("Dimensions в гугл табл ЗАГРУЖЕНО")
 
@@ -260,6 +342,8 @@ def upload_advcost_to_google_task(**kwargs):
     except Exception as e:
         logger.error(f"Ошибка: {e}")
     finally:
+        loop.run_until_complete(close_wb_session())
+        loop.run_until_complete(close_async_pool())
         loop.close()
     logger.info("Advcost в гугл табл ЗАГРУЖЕНО")
 
@@ -275,6 +359,8 @@ def upload_salesreport_to_google_task(**kwargs):
     except Exception as e:
         logger.error(f"Ошибка: {e}")
     finally:
+        loop.run_until_complete(close_wb_session())
+        loop.run_until_complete(close_async_pool())
         loop.close()
     logger.info(f"Salesreport в гугл табл ЗАГРУЖЕНО. Mode: {mode}")
 
@@ -288,6 +374,8 @@ def upload_products_orders_to_google_task(**kwargs):
     except Exception as e:
         logger.error(f"Ошибка: {e}")
     finally:
+        loop.run_until_complete(close_wb_session())
+        loop.run_until_complete(close_async_pool())
         loop.close()
     logger.info("Products_stat в гугл табл ЗАГРУЖЕНО")
 
@@ -303,6 +391,8 @@ def upload_fin_report_to_google_task(**kwargs):
     except Exception as e:
         logger.error(f"Ошибка: {e}")
     finally:
+        loop.run_until_complete(close_wb_session())
+        loop.run_until_complete(close_async_pool())
         loop.close()
     logger.info(f"Fin_report в гугл табл ЗАГРУЖЕНО. Mode: {mode}")
 
@@ -318,6 +408,8 @@ def upload_save_data_to_google_task(**kwargs):
     except Exception as e:
         logger.error(f"Ошибка: {e}")
     finally:
+        loop.run_until_complete(close_wb_session())
+        loop.run_until_complete(close_async_pool())
         loop.close()
     logger.info(f"Save_data в гугл табл ЗАГРУЖЕНО. Mode: {mode}")
 
@@ -332,6 +424,8 @@ def upload_ostatki_to_google_task(**kwargs):
     except Exception as e:
         logger.error(f"Ошибка: {e}")
     finally:
+        loop.run_until_complete(close_wb_session())
+        loop.run_until_complete(close_async_pool())
         loop.close()
     logger.info(f"Ostatki в гугл табл ЗАГРУЖЕНО. Mode: {mode}")
 
@@ -346,5 +440,7 @@ def upload_advconversion_to_google_task(**kwargs):
     except Exception as e:
         logger.error(f"Ошибка: {e}")
     finally:
+        loop.run_until_complete(close_wb_session())
+        loop.run_until_complete(close_async_pool())
         loop.close()
     logger.info(f"Advconconversion в гугл табл ЗАГРУЖЕНО. Mode: {mode}")
\ No newline at end of file
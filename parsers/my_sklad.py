@@ -8,7 +8,7 @@ import logging
 from typing import Dict, List
 import time
 from database.DataBase import async_connect_to_database
-from database.funcs_db import add_set_data_from_db
+from database.funcs_db import bulk_upsert_to_db
 from django.utils.dateparse import parse_datetime
 from google.functions import update_google_sheet_data, clear_list
 from datetime import timedelta
@@ -291,36 +291,38 @@ async def get_and_save_mysklad_data() -> None:
                 size_ru = value["positions"].get("Размер РФ", "Отсутствует")
                 articul = name.split("_")[1].split(" ")[0]
                 data.append(
-                    add_set_data_from_db(
-                        conn=conn,
-                        table_name="myapp_mysklad",
-                        data=dict(
-                            key_id=key_id,
-                            name=name,
-                            articul=articul,
-                            date_time=parse_datetime(value["date_time"])  + timedelta(hours=3),
-                            price=value["price"],
-                            quantity=value["quantity"],
-                            shipped=value["shipped"],
-                            accepted=value["accepted"],
-                            color=color,
-                            size=size,
-                            size_ru=size_ru
-                        ),
-                            conflict_fields=["key_id"]
+                    (
+                        key_id,
+                        name,
+                        articul,
+                        parse_datetime(value["date_time"]) + timedelta(hours=3),
+                        value["price"],
+                        value["quantity"],
+                        value["shipped"],
+                        value["accepted"],
+                        color,
+                        size,
+                        size_ru,
                     )
                 )
         except Exception as e:
             logger.error(f"Ошибка подготовки данных перед загрузкой в БД {e}")
 
         try:
-            results = await asyncio.gather(*data)
+            await bulk_upsert_to_db(
+                conn=conn,
+                table_name="myapp_mysklad",
+                columns=[
+                    "key_id", "name", "articul", "date_time", "price", "quantity", "shipped", "accepted",
+                    "color", "size", "size_ru",
+                ],
+                records=data,
+                conflict_fields=["key_id"]
+            )
         except Exception as e:
             logger.error(f"Ошибка при добавлении данных в БД Мой Склад {e}")
     except:
         return
-    finally:
-        await conn.close()
 
 
 async def update_google_table_mysklad() -> None:
@@ -348,9 +350,6 @@ async def update_google_table_mysklad() -> None:
     except Exception as e:
         logger.error(f"Ошибка получения данных из таблицы Мой склад {e}")
         return
-    finally:
-        if conn:
-            await conn.close()
 
     try:
         # Преобразуем в список списков
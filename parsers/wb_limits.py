@@ -0,0 +1,165 @@
+import asyncio
+import hashlib
+import logging
+
+import redis
+
+from context_logger import ContextLogger
+
+logger = ContextLogger(logging.getLogger("parsers"))
+
+r = redis.Redis(host='redis_cache', port=6379, db=0)
+
+
+# Лимиты WB API на один аккаунт продавца (токен): категория -> (запросов, за секунд)
+WB_LIMITS = {
+    "content": (100, 60),  # Максимум 100 запросов в минуту для всех методов категории Контент
+    # statistics-api: лимит у каждого метода свой, поэтому и ведра раздельные
+    "stat_fin_report": (1, 60),  # reportDetailByPeriod: 1 запрос в минуту
+    "stat_orders": (1, 60),  # supplier/orders: 1 запрос в минуту
+    "stat_sales": (1, 60),  # supplier/sales: 1 запрос в минуту
+    "stat_stocks": (1, 60),  # supplier/stocks: 1 запрос в минуту
+    "stat_incomes": (1, 60),  # supplier/incomes: 1 запрос в минуту
+    "seller_analytics": (3, 60),  # Максимум 3 запроса в минуту
+    "region_sale": (1, 10),  # Максимум 1 запрос в 10 секунд
+    "paid_storage": (1, 60),  # Максимум 1 запрос в минуту
+    "fullstats": (1, 90),  # по документации 1 в минуту, на практике без 429 только раз в 90 сек
+    "advert": (4, 1),  # Максимум 4-5 запросов в секунду
+    "advert_balance": (1, 1),  # баланс и пополнение бюджета: 1 запрос в секунду
+    "prices": (10, 6),  # Максимум 10 запросов за 6 секунд
+    "feedbacks": (1, 1),  # Максимум 1 запрос в секунду (при 3/сек блокировка на 60 секунд)
+    "finance": (1, 60),  # Максимум 1 запрос в минуту
+    "documents": (1, 10),  # Максимум 1 запрос в 10 секунд
+}
+
+# param["type"] из wb_api -> категория лимита
+WB_TYPE_CATEGORY = {
+    "get_nmids": "content",
+
+    "fin_report": "stat_fin_report",
+    "orders": "stat_orders",
+    "sales": "stat_sales",
+    "get_stocks_data": "stat_stocks",
+    "get_delivery_fbw": "stat_incomes",
+
+    "seller_analytics_generate": "seller_analytics",
+    "seller_analytics_report": "seller_analytics",
+    "warehouse_data": "seller_analytics",
+    "get_stat_cart_sort_nm": "seller_analytics",
+    "region_sale": "region_sale",
+    "make_save_rep": "paid_storage",
+    "get_save_report": "paid_storage",
+
+    "fullstatsadv": "fullstats",
+    "info_about_rks": "advert",
+    "list_adverts_id": "advert",
+    "start_advert": "advert",
+    "budget_advert": "advert",
+    "get_balance_lk": "advert_balance",
+    "add_bidget_to_adv": "advert_balance",
+
+    "get_products_and_prices": "prices",
+    "set_price_and_discount": "prices",
+
+    "get_feedback": "feedbacks",
+    "get_question": "feedbacks",
+
+    "get_balance_seller": "finance",
+
+    "docs_cat": "documents",
+    "list_docs": "documents",
+    "get_docs": "documents",
+}
+
+
+# Token bucket в Redis. Время берём из Redis, чтобы у всех воркеров были одни часы.
+# Возвращает 0, если токен выдан, иначе сколько миллисекунд подождать.
+_ACQUIRE_LUA = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+
+local data = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(data[1])
+local ts = tonumber(data[2])
+if tokens == nil then
+    tokens = capacity
+    ts = now
+end
+
+tokens = math.min(capacity, tokens + (now - ts) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = math.ceil((1 - tokens) / rate)
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate) + 60000)
+return wait
+"""
+
+# После 429 опустошаем ведро и сдвигаем пополнение на retry_after
+_PENALIZE_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+redis.call('HSET', KEYS[1], 'tokens', '0', 'ts', tostring(now + tonumber(ARGV[1])))
+redis.call('PEXPIRE', KEYS[1], tonumber(ARGV[1]) + 60000)
+return 1
+"""
+
+
+class WbRateLimiter:
+    """
+    Общий для всех воркеров лимитер запросов к WB API по (категория, токен).
+    Клиент redis синхронный, поэтому обращения к нему идут через asyncio.to_thread и не блокируют loop
+    (redis.asyncio не подходит: задачи django-q каждый раз создают новый event loop).
+    """
+
+    def __init__(self, client: redis.Redis, limits: dict):
+        self.client = client
+        self.limits = limits
+        self._acquire = client.register_script(_ACQUIRE_LUA)
+        self._penalize = client.register_script(_PENALIZE_LUA)
+
+    @staticmethod
+    def _key(category: str, token: str) -> str:
+        token_hash = hashlib.sha1(token.encode()).hexdigest()[:16]
+        return f"wb_rl:{category}:{token_hash}"
+
+    async def acquire(self, category: str | None, token: str) -> None:
+        """Ожидает, пока в ведре (категория, токен) не появится свободный запрос."""
+        if not category or category not in self.limits:
+            return
+
+        max_requests, period = self.limits[category]
+        rate = max_requests / (period * 1000)  # токенов в миллисекунду
+        key = self._key(category, token)
+
+        while True:
+            try:
+                wait_ms = await asyncio.to_thread(self._acquire, keys=[key], args=[max_requests, rate])
+            except redis.RedisError as e:
+                # Redis недоступен — не блокируем работу, 429 обработает wb_api
+                logger.warning(f"Rate limiter недоступен ({category}): {e}")
+                return
+
+            if not wait_ms:
+                return
+            await asyncio.sleep(int(wait_ms) / 1000)
+
+    async def penalize(self, category: str | None, token: str, retry_after: float) -> None:
+        """Отметить получение 429: следующие запросы подождут retry_after секунд."""
+        if not category or category not in self.limits:
+            return
+        try:
+            await asyncio.to_thread(
+                self._penalize, keys=[self._key(category, token)], args=[int(retry_after * 1000)]
+            )
+        except redis.RedisError as e:
+            logger.warning(f"Rate limiter недоступен ({category}): {e}")
+
+
+wb_rate_limiter = WbRateLimiter(r, WB_LIMITS)
@@ -0,0 +1,90 @@
+import asyncio
+import logging
+import random
+from typing import Any, Awaitable, Callable, List
+
+from context_logger import ContextLogger
+
+logger = ContextLogger(logging.getLogger("parsers"))
+
+
+# Опрос готовности отчета: первая проверка через REPORT_FIRST_DELAY, дальше интервал удваивается
+# до REPORT_MAX_DELAY (± REPORT_JITTER, чтобы кабинеты не опрашивали WB синхронно)
+REPORT_FIRST_DELAY = 10
+REPORT_MAX_DELAY = 120
+REPORT_JITTER = 0.2
+REPORT_TIMEOUT = 15 * 60  # через сколько секунд считать отчет потерянным
+
+# poll возвращает REPORT_EMPTY, если отчет готов, но строк в нем нет: on_complete получит пустой список
+REPORT_EMPTY = object()
+
+
+class ReportJob:
+    """
+    Задание на отчет WB, который формируется асинхронно (seller_analytics_generate, paid_storage).
+    submit() создаёт отчет и возвращает то, что нужно для проверки (id задания),
+    poll(ticket) возвращает готовые данные, REPORT_EMPTY для готового пустого отчета или None, пока отчет не готов,
+    on_complete(result) разбирает и сохраняет данные.
+    """
+
+    def __init__(
+            self,
+            name: str,
+            submit: Callable[[], Awaitable[Any]],
+            poll: Callable[[Any], Awaitable[Any]],
+            on_complete: Callable[[Any], Awaitable[None]],
+    ):
+        self.name = name
+        self.submit = submit
+        self.poll = poll
+        self.on_complete = on_complete
+
+
+async def _run_report_job(job: ReportJob, first_delay: float, max_delay: float, timeout: float) -> None:
+    loop = asyncio.get_running_loop()
+
+    ticket = await job.submit()
+    logger.info(f"Отчет {job.name} заказан")
+
+    deadline = loop.time() + timeout
+    delay = first_delay
+    while True:
+        await asyncio.sleep(delay * random.uniform(1 - REPORT_JITTER, 1 + REPORT_JITTER))
+
+        result = await job.poll(ticket)
+        if result is not None:
+            break
+        if loop.time() >= deadline:
+            raise TimeoutError(f"Отчет {job.name} не сформирован за {timeout} сек")
+        delay = min(delay * 2, max_delay)
+
+    if result is REPORT_EMPTY:
+        logger.info(f"Отчет {job.name} пуст")
+        result = []
+    await job.on_complete(result)
+    logger.info(f"Отчет {job.name} загружен")
+
+
+async def run_report_jobs(
+        jobs: List[ReportJob],
+        first_delay: float = REPORT_FIRST_DELAY,
+        max_delay: float = REPORT_MAX_DELAY,
+        timeout: float = REPORT_TIMEOUT,
+) -> int:
+    """
+    Заказать все отчеты сразу и обрабатывать каждый, как только он готов.
+    Частоту запросов по токену держит wb_rate_limiter внутри wb_api, поэтому задания запускаются параллельно.
+    :return: сколько отчетов обработано успешно
+    """
+    results = await asyncio.gather(
+        *(_run_report_job(job, first_delay, max_delay, timeout) for job in jobs),
+        return_exceptions=True,
+    )
+
+    done = 0
+    for job, result in zip(jobs, results):
+        if isinstance(result, BaseException):
+            logger.error(f"‼️Ошибка отчета {job.name}: {result!r}")
+        else:
+            done += 1
+    return done
@@ -0,0 +1,47 @@
+import asyncio
+import weakref
+from contextlib import asynccontextmanager
+
+import aiohttp
+
+
+# Один пул keep-alive соединений на хосты WB API (statistics-api, advert-api, seller-analytics-api, ...)
+CONNECTOR_CONFIG = {
+    'limit': 100,  # всего соединений на процесс
+    'limit_per_host': 10,  # на каждый хост WB отдельно
+    'ttl_dns_cache': 600,  # кэш DNS, сек
+    'keepalive_timeout': 60,  # сколько держать простаивающее соединение, сек
+    'ssl': False,
+}
+
+# event loop -> общая сессия. Слабые ссылки, чтобы закрытые loop'ы django-q не копились
+_sessions = weakref.WeakKeyDictionary()
+
+
+async def get_wb_session() -> aiohttp.ClientSession:
+    """
+    Общая aiohttp-сессия для запросов к WB в рамках текущего event loop.
+    Создаётся лениво, закрывается close_wb_session() при остановке loop.
+    """
+    loop = asyncio.get_running_loop()
+
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(**CONNECTOR_CONFIG))
+        _sessions[loop] = session
+
+    return session
+
+
+@asynccontextmanager
+async def wb_session():
+    """Замена `aiohttp.ClientSession()` в `async with`: отдаёт общую сессию и не закрывает её."""
+    yield await get_wb_session()
+
+
+async def close_wb_session():
+    """Закрыть общую сессию текущего event loop (в задачах django-q перед loop.close())."""
+    loop = asyncio.get_running_loop()
+    session = _sessions.pop(loop, None)
+    if session is not None and not session.closed:
+        await session.close()
@@ -0,0 +1,118 @@
+import codecs
+import csv
+import io
+import json
+import zipfile
+from typing import Any, Callable, Iterator, List, Tuple
+
+import aiohttp
+
+
+STREAM_CHUNK_SIZE = 64 * 1024  # сколько байт читать из ответа за раз
+
+_decoder = json.JSONDecoder()
+_SKIP = " \t\r\n,"
+
+
+async def iter_json_array(content: aiohttp.StreamReader, key: str | None = None):
+    """
+    Async-генератор элементов JSON-массива, разбираемых по мере чтения тела ответа.
+    В памяти одновременно держится только недочитанный хвост, а не весь ответ и весь список.
+    Если массив так и не открылся (в ответе объект ошибки, нет key) или не закрылся (поток оборвался),
+    бросает ValueError: иначе вызывающий записал бы пустую или неполную загрузку как успешную.
+    :param content: response.content
+    :param key: если массив не в корне, а под ключом объекта ({"report": [...]}) — имя ключа
+    """
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    marker = f'"{key}"' if key else None
+    buffer = ""
+    pos = 0
+    started = False
+
+    async for chunk in content.iter_chunked(STREAM_CHUNK_SIZE):
+        buffer = buffer[pos:] + utf8.decode(chunk)
+        pos = 0
+
+        if not started:
+            start = 0
+            if marker:
+                start = buffer.find(marker)
+                if start == -1:
+                    # ключ мог разрезаться на границе чанков — оставляем хвост
+                    pos = max(0, len(buffer) - len(marker))
+                    continue
+                start += len(marker)
+                # между ключом и массивом — только двоеточие и пробелы
+                while start < len(buffer) and buffer[start] in " \t\r\n:":
+                    start += 1
+            else:
+                while start < len(buffer) and buffer[start] in " \t\r\n\ufeff":
+                    start += 1
+            if start >= len(buffer):
+                pos = buffer.find(marker) if marker else 0
+                continue
+            if buffer[start] != "[":
+                raise ValueError(f"В ответе нет массива{f' {key}' if key else ''}: {buffer[:500]}")
+            started = True
+            pos = start + 1
+
+        while True:
+            while pos < len(buffer) and buffer[pos] in _SKIP:
+                pos += 1
+            if pos >= len(buffer):
+                break
+            if buffer[pos] == "]":
+                return
+            try:
+                item, pos = _decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # элемент ещё не дочитан
+                break
+            yield item
+
+    if not started:
+        raise ValueError(f"В ответе нет массива{f' {key}' if key else ''}: {buffer[:500]}")
+    raise ValueError("Ответ оборвался до конца массива")
+
+
+async def batched(items, size: int):
+    """Собрать async-итератор в списки по size элементов"""
+    batch = []
+    async for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def iter_zip_csv(
+        content: bytes,
+        schema: List[Tuple[str, Callable[[str], Any]]],
+        skip_blank: Tuple[str, ...] = (),
+) -> Iterator[tuple]:
+    """
+    Потоково читать CSV из ZIP-архива отчета WB: файлы архива распаковываются построчно,
+    колонки находятся по имени в шапке, значения приводятся функциями из schema.
+    :param content: ZIP-архив
+    :param schema: [(имя колонки в шапке CSV, функция приведения), ...]
+    :param skip_blank: колонки из schema; строки, где любая из них пустая, пропускаются до приведения значений
+    :return: кортежи значений в порядке schema
+    """
+    with zipfile.ZipFile(io.BytesIO(content)) as zip_file:
+        for file_name in zip_file.namelist():
+            with zip_file.open(file_name) as csv_file:
+                reader = csv.reader(io.TextIOWrapper(csv_file, encoding='utf-8'))
+
+                header = next(reader, None)
+                if header is None:
+                    continue
+                indexes = [header.index(name) for name, _ in schema]
+                converters = [convert for _, convert in schema]
+                blank_indexes = [header.index(name) for name in skip_blank]
+
+                for row in reader:
+                    if any(row[index] == "" for index in blank_indexes):
+                        continue
+                    yield tuple(convert(row[index]) for index, convert in zip(indexes, converters))
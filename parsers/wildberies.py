@@ -1,5 +1,7 @@
 import asyncio
 import base64
+from collections import Counter
+from typing import Optional
 import random
 import httpx
 import time
@@ -12,7 +14,12 @@ from openpyxl import load_workbook
 from io import BytesIO
 
 from database.DataBase import async_connect_to_database
-from database.funcs_db import get_data_from_db, add_set_data_from_db
+from database.funcs_db import get_data_from_db, bulk_upsert_to_db, bulk_merge_to_db
+from database.warehouses import resolve_warehouse_ids, warehouse_key
+from database.table_versions import invalidates
+from database.dimensions import card_img_url, refresh_dimensions_snapshot
+from database.fin_daily import backfill_fin_daily, refresh_fin_daily_for_rows
+from database.sync_state import sync_since, set_sync_state
 from datetime import datetime, timedelta
 from django.utils.dateparse import parse_datetime
 import json
@@ -21,14 +28,21 @@ import zipfile
 import math
 import logging
 import io
-import csv
 from context_logger import ContextLogger
 from myapp.models import Price, Adverts
+from loader import NMID_ATTRIBUTE_IDS
+from parsers.wb_limits import wb_rate_limiter, WB_TYPE_CATEGORY
+from parsers.wb_session import wb_session, get_wb_session
+from parsers.wb_stream import iter_json_array, batched, iter_zip_csv
+from parsers.wb_reports import REPORT_EMPTY, ReportJob, run_report_jobs
 
 logger = ContextLogger(logging.getLogger("parsers"))
 
 r = redis.Redis(host='redis_cache', port=6379, db=0)
 
+RATE_LIMIT_RETRIES = 3  # сколько раз повторять запрос после 429
+STREAM_BATCH_SIZE = 10000  # сколько строк потокового ответа писать в БД за раз
+
 
 
 async def get_cookies_headers(
@@ -135,13 +149,23 @@ async def get_data(method: str, url: str, response_type="json", **kwargs):
     logger.error(f"Can't get data, URl: {url}")
 
 
-async def wb_api(session, param):
+def get_retry_after(response) -> float:
+    """Сколько секунд ждать после 429 (заголовки X-Ratelimit-Retry / Retry-After)."""
+    for header in ("X-Ratelimit-Retry", "Retry-After"):
+        value = response.headers.get(header)
+        if value:
+            try:
+                return float(value)
+            except ValueError:
+                pass
+    return 60
+
+
+def build_wb_request(param: dict) -> tuple[str, str, dict, dict]:
     """
-    Асинхронная функция для получения данных по API Wildberries.
-    :param param:
-    :return:
+    Собрать запрос к WB API по param["type"].
+    :return: (API_URL, view ("get"/"post"), params, data)
     """
-
     API_URL = ''
     view = ''
     data = {}
@@ -163,6 +187,7 @@ async def wb_api(session, param):
             "dateFrom": param["date_from"],
             "dateTo": param["date_to"],
             "rrdid": param.get("rrdid", 0),
+            "limit": param.get("limit", 100000),  # максимум 100000 строк, дальше листать по rrdid
         }
 
         view = "get"
@@ -482,6 +507,21 @@ async def wb_api(session, param):
         }
         view = "get"
 
+    return API_URL, view, params, data
+
+
+async def wb_api(session, param):
+    """
+    Асинхронная функция для получения данных по API Wildberries.
+    :param session: aiohttp-сессия. Если None — общая сессия из get_wb_session()
+    :param param:
+    :return:
+    """
+    if session is None:
+        session = await get_wb_session()
+
+    API_URL, view, params, data = build_wb_request(param)
+
     try:
         headers = {
             "Authorization": f"Bearer {param['API_KEY']}"  # Или просто API_KEY, если нужно
@@ -493,37 +533,91 @@ async def wb_api(session, param):
         # param.pop("API_KEY", None)
         return None
 
-    if view == 'get':
-        async with session.get(API_URL, headers=headers, params=params, timeout=aiohttp.ClientTimeout(total=60), ssl=False) as response:
-            if param["type"] == "seller_analytics_report":
+    category = WB_TYPE_CATEGORY.get(param["type"])
+
+    for attempt in range(1, RATE_LIMIT_RETRIES + 1):
+        # общий для всех воркеров лимит по (категория, токен)
+        await wb_rate_limiter.acquire(category, param["API_KEY"])
+
+        if view == 'get':
+            async with session.get(API_URL, headers=headers, params=params, timeout=aiohttp.ClientTimeout(total=60), ssl=False) as response:
+                if response.status == 429 and attempt < RATE_LIMIT_RETRIES:
+                    await wb_rate_limiter.penalize(category, param["API_KEY"], get_retry_after(response))
+                    logger.info(f"429 от WB ({param['type']}). Попытка {attempt}/{RATE_LIMIT_RETRIES}")
+                    continue
+                if response.status == 204:
+                    # нет данных (например, fin_report пролистан до конца)
+                    return []
+                if param["type"] == "seller_analytics_report":
+                    try:
+                        content = await response.read()
+                        return content
+                    except Exception as e:
+                        return e
+                response_text = await response.text()
                 try:
-                    content = await response.read()
-                    return content
+                    response.raise_for_status()
+                    return json.loads(response_text)
                 except Exception as e:
-                    return e
-            response_text = await response.text()
-            try:
-                response.raise_for_status()
-                return json.loads(response_text)
-            except Exception as e:
-                logger.error(
-                    f"Ошибка в wb_api (get запрос): {e}. Ответ: {response_text}. Параметры: {param}"
-                )
-                # param.pop("API_KEY", None)
-                return None
+                    logger.error(
+                        f"Ошибка в wb_api (get запрос): {e}. Ответ: {response_text}. Параметры: {param}"
+                    )
+                    # param.pop("API_KEY", None)
+                    return None
+
+        if view == 'post':
+            async with session.post(API_URL, headers=headers, params=params, json=data, timeout=aiohttp.ClientTimeout(total=60),
+                                    ssl=False) as response:
+                if response.status == 429 and attempt < RATE_LIMIT_RETRIES:
+                    await wb_rate_limiter.penalize(category, param["API_KEY"], get_retry_after(response))
+                    logger.info(f"429 от WB ({param['type']}). Попытка {attempt}/{RATE_LIMIT_RETRIES}")
+                    continue
+                response_text = await response.text()
+                try:
+                    response.raise_for_status()
+                    return json.loads(response_text)
+                except Exception as e:
+                    logger.error(
+                        f"Ошибка в wb_api (post запрос): {e}.  Ответ: {response_text}. Параметры: {param}"
+                    )
+                    return None
 
-    if view == 'post':
-        async with session.post(API_URL, headers=headers, params=params, json=data, timeout=aiohttp.ClientTimeout(total=60),
-                                ssl=False) as response:
-            response_text = await response.text()
-            try:
-                response.raise_for_status()
-                return json.loads(response_text)
-            except Exception as e:
-                logger.error(
-                    f"Ошибка в wb_api (post запрос): {e}.  Ответ: {response_text}. Параметры: {param}"
-                )
-                return None
+
+async def wb_api_stream(session, param, key: str | None = None):
+    """
+    Потоковый вариант wb_api для больших ответов (fin_report, orders, sales, get_stocks_data, region_sale):
+    строки отдаются по одной по мере чтения тела, без response.text() и json.loads всего ответа.
+    :param session: aiohttp-сессия. Если None — общая сессия из get_wb_session()
+    :param key: ключ, под которым лежит массив строк (region_sale -> "report")
+    :return: async-генератор словарей-строк
+    """
+    if session is None:
+        session = await get_wb_session()
+
+    API_URL, view, params, data = build_wb_request(param)
+    headers = {"Authorization": f"Bearer {param['API_KEY']}"}
+    category = WB_TYPE_CATEGORY.get(param["type"])
+
+    for attempt in range(1, RATE_LIMIT_RETRIES + 1):
+        await wb_rate_limiter.acquire(category, param["API_KEY"])
+
+        async with session.request(
+                view.upper(), API_URL, headers=headers, params=params, json=data if view == "post" else None,
+                timeout=aiohttp.ClientTimeout(total=None, sock_read=60), ssl=False
+        ) as response:
+            if response.status == 429 and attempt < RATE_LIMIT_RETRIES:
+                await wb_rate_limiter.penalize(category, param["API_KEY"], get_retry_after(response))
+                logger.info(f"429 от WB ({param['type']}). Попытка {attempt}/{RATE_LIMIT_RETRIES}")
+                continue
+            if response.status == 204:
+                return
+            if response.status >= 400:
+                response_text = await response.text()
+                raise Exception(f"Ошибка в wb_api_stream ({param['type']}): {response.status}. Ответ: {response_text}")
+
+            async for row in iter_json_array(response.content, key):
+                yield row
+            return
 
 
 async def insert_in_chunks(pool, query, data, chunk_size=1000):
@@ -558,6 +652,7 @@ async def insert_in_chunks(pool, query, data, chunk_size=1000):
                     raise
 
 
+@invalidates("myapp_price")
 async def get_products_and_prices():
     """
     получаем товары и цены и пишем их в бд
@@ -568,7 +663,7 @@ async def get_products_and_prices():
 
     data = {}
 
-    async with aiohttp.ClientSession() as session:
+    async with wb_session() as session:
         for cab in cabinets:
             param = {
                 "type": "get_products_and_prices",
@@ -588,41 +683,107 @@ async def get_products_and_prices():
                 raise
             for key, value in id_to_result.items():
                 value = value["data"]["listGoods"]
-                data = []
                 try:
-                    for item in value:
-                        data.append(
-                            add_set_data_from_db(
-                                conn=conn,
-                                table_name="myapp_price",
-                                data=dict(
-                                    lk_id=key,
-                                    nmid=item["nmID"],
-                                    vendorcode=item["vendorCode"],
-                                    sizes=json.dumps(item["sizes"]),
-                                    discount=item["discount"],
-                                    clubdiscount=item["clubDiscount"],
-                                    editablesizeprice=item["editableSizePrice"],
-                                    main_status=status_rep,
-                                ),
-                                conflict_fields=["nmid", "lk_id"]
+                    stats = await bulk_upsert_to_db(
+                        conn=conn,
+                        table_name="myapp_price",
+                        columns=[
+                            "lk_id", "nmid", "vendorcode", "sizes", "discount", "clubdiscount",
+                            "editablesizeprice", "main_status",
+                        ],
+                        records=(
+                            (
+                                key,
+                                item["nmID"],
+                                item["vendorCode"],
+                                json.dumps(item["sizes"]),
+                                item["discount"],
+                                item["clubDiscount"],
+                                item["editableSizePrice"],
+                                status_rep,
                             )
-                        )
-                    results = await asyncio.gather(*data)
+                            for item in value
+                        ),
+                        conflict_fields=["nmid", "lk_id"],
+                        hash_column="row_hash",
+                    )
+                    logger.info(f"myapp_price, кабинет {key}: {stats}")
                 except Exception as e:
                     logger.error(f"Ошибка при добавлении продуктов и цен {e}")
         except:
             return
-        finally:
-            await conn.close()
 
 
+COLOR_CHARACTERISTIC_ID = 14177449  # id характеристики "Цвет" в карточке WB
+
+
+def characteristic_value(item: dict) -> Optional[str]:
+    """Первое значение характеристики карточки как есть или None"""
+    value = item.get("value")
+    if isinstance(value, list):
+        value = value[0] if value else None
+    if value is None or value == "":
+        return None
+    return str(value)
+
+
+def card_color(characteristics: list) -> Optional[str]:
+    """Цвет карточки в исходном регистре — его отдает API"""
+    for item in characteristics or []:
+        if item.get("id") == COLOR_CHARACTERISTIC_ID:
+            return characteristic_value(item)
+    return None
+
+
+def card_attributes(characteristics: list) -> dict:
+    """
+    Значения характеристик карточки из NMID_ATTRIBUTE_IDS: {"id": первое значение в нижнем регистре}.
+    Пишутся в myapp_nmids.attributes для фильтров, чтобы API не разбирал characteristics.
+    """
+    attributes = {}
+    for item in characteristics or []:
+        if item.get("id") not in NMID_ATTRIBUTE_IDS and item.get("id") != COLOR_CHARACTERISTIC_ID:
+            continue
+        value = characteristic_value(item)
+        if value is not None:
+            attributes[str(item["id"])] = value.strip().lower()
+    return attributes
+
+
+@invalidates("myapp_nmids")
+async def backfill_card_attributes() -> None:
+    """
+    Разложить color и attributes из characteristics у уже загруженных карточек (шаг DEPLOY_BACKFILLS):
+    get_nmids перезаписывает карточку только при её изменении. Обновляются только расходящиеся строки.
+    """
+    conn = await async_connect_to_database()
+    if not conn:
+        raise Exception("Ошибка подключения к БД в backfill_card_attributes")
+
+    rows = await conn.fetch("SELECT id, characteristics, color, attributes FROM myapp_nmids")
+    updates = []
+    for row in rows:
+        characteristics = json.loads(row["characteristics"]) if row["characteristics"] else []
+        color, attributes = card_color(characteristics), card_attributes(characteristics)
+        stored = json.loads(row["attributes"]) if row["attributes"] else {}
+        if color != row["color"] or attributes != stored:
+            updates.append((row["id"], color, json.dumps(attributes)))
+
+    if updates:
+        await conn.executemany(
+            "UPDATE myapp_nmids SET color = $2, attributes = $3::jsonb WHERE id = $1", updates
+        )
+    logger.info(f"myapp_nmids: color и attributes дозаполнены у {len(updates)} карточек")
+
+
+@invalidates("myapp_nmids")
 async def get_nmids():
     # получаем все карточки товаров
     cabinets = await get_data_from_db("myapp_wblk", ["id", "name", "token"])
 
     for cab in cabinets:
-        async with aiohttp.ClientSession() as session:
+        stats = Counter()
+        async with wb_session() as session:
             param = {
                 "type": "get_nmids",
                 "API_KEY": cab["token"],
@@ -642,38 +803,52 @@ async def get_nmids():
                     logger.error("Ошибка подключения к БД")
                     raise
                 try:
-                    for resp in response["cards"]:
-                        await add_set_data_from_db(
-                            conn=conn,
-                            table_name="myapp_nmids",
-                            data=dict(
-                                lk_id=cab["id"],
-                                nmid=resp["nmID"],
-                                imtid=resp["imtID"],
-                                nmuuid=resp["nmUUID"],
-                                subjectid=resp["subjectID"],
-                                subjectname=resp["subjectName"],
-                                vendorcode=resp["vendorCode"],
-                                brand=resp["brand"],
-                                title=resp["title"],
-                                description=resp.get("description", ""),
-                                needkiz=resp["needKiz"],
-                                photos=json.dumps(resp.get("photos", [])),
-                                dimensions=json.dumps(resp["dimensions"]),
-                                characteristics=json.dumps(resp["characteristics"]),
-                                sizes=json.dumps(resp["sizes"]),
-                                tag_ids = json.dumps([]),
-                                created_at=parse_datetime(resp["createdAt"]),
-                                updated_at=parse_datetime(resp["updatedAt"]),
-                                added_db=datetime.now()
-                            ),
-                            conflict_fields=["nmid", "lk_id"]
-                        )
+                    stats += await bulk_upsert_to_db(
+                        conn=conn,
+                        table_name="myapp_nmids",
+                        columns=[
+                            "lk_id", "nmid", "imtid", "nmuuid", "subjectid", "subjectname", "vendorcode", "brand",
+                            "title", "description", "needkiz", "photos", "dimensions", "characteristics", "sizes",
+                            "tag_ids", "created_at", "updated_at", "added_db", "color", "attributes",
+                            "img_url", "height", "length", "width",
+                        ],
+                        records=[
+                            (
+                                cab["id"],
+                                resp["nmID"],
+                                resp["imtID"],
+                                resp["nmUUID"],
+                                resp["subjectID"],
+                                resp["subjectName"],
+                                resp["vendorCode"],
+                                resp["brand"],
+                                resp["title"],
+                                resp.get("description", ""),
+                                resp["needKiz"],
+                                json.dumps(resp.get("photos", [])),
+                                json.dumps(resp["dimensions"]),
+                                json.dumps(resp["characteristics"]),
+                                json.dumps(resp["sizes"]),
+                                json.dumps([]),
+                                parse_datetime(resp["createdAt"]),
+                                parse_datetime(resp["updatedAt"]),
+                                datetime.now(),
+                                card_color(resp.get("characteristics")),
+                                json.dumps(attributes),
+                                card_img_url(resp.get("photos")),
+                                resp["dimensions"].get("height"),
+                                resp["dimensions"].get("length"),
+                                resp["dimensions"].get("width"),
+                            )
+                            for resp in response["cards"]
+                            for attributes in [card_attributes(resp.get("characteristics"))]
+                        ],
+                        conflict_fields=["nmid", "lk_id"],
+                        hash_column="row_hash",
+                    )
                 except Exception as e:
                     logger.error(f"Ошибка при добавлении артикулов в бд {e}")
                     raise
-                finally:
-                    await conn.close()
 
 
                 if response["cursor"]["total"] < 100:
@@ -683,347 +858,244 @@ async def get_nmids():
                     param["nmID"] = response["cursor"]["nmID"]
                     # await asyncio.sleep(60)
 
+        logger.info(f"myapp_nmids, {cab['name']}: {dict(stats)}")
+
+    # ответ /dimensions/ собирается заранее; в редис попадает, только если карточки изменились
+    await refresh_dimensions_snapshot()
 
+
+@invalidates("myapp_stocks", "myapp_warehousealias")
 async def get_stocks_data_2_weeks():
     cabinets = await get_data_from_db("myapp_wblk", ["id", "name", "token"])
 
     for cab in cabinets:
-        async with aiohttp.ClientSession() as session:
+        async with wb_session() as session:
             conn = await async_connect_to_database()
             if not conn:
                 logger.error("Ошибка подключения к БД")
                 raise
 
-            req_is_rows_in_db = """
-                SELECT * from myapp_stocks WHERE lk_id = $1 LIMIT 1 
-            """
-            all_fields = await conn.fetch(req_is_rows_in_db, cab["id"])
-
-            if all_fields:
-                days = 1
-            else:
-                logger.info("Пишим остатки в БД впервые")
-                days = 250
-
+            # только строки, изменённые после прошлой загрузки (dateFrom фильтрует по lastChangeDate)
             param = {
                 "type": "get_stocks_data",
                 "API_KEY": cab["token"],
-                "dateFrom": str(datetime.now() - timedelta(days=days)),
+                "dateFrom": str(await sync_since(conn, cab["id"], "stocks")),
             }
-            response = await wb_api(session, param)
 
+            last_change, stats = None, Counter()
             try:
-                for quant in response:
-                    await add_set_data_from_db(
+                async for stocks in batched(wb_api_stream(session, param), STREAM_BATCH_SIZE):
+                    batch_last_change = max(parse_datetime(quant["lastChangeDate"]) for quant in stocks)
+                    last_change = max(last_change, batch_last_change) if last_change else batch_last_change
+
+                    warehouse_ids = await resolve_warehouse_ids(conn, (quant["warehouseName"] for quant in stocks))
+                    stats += await bulk_upsert_to_db(
                         conn=conn,
                         table_name="myapp_stocks",
-                        data=dict(
-                            lk_id=cab["id"],
-                            lastchangedate=parse_datetime(quant["lastChangeDate"]),
-                            warehousename=quant["warehouseName"],
-                            supplierarticle=quant["supplierArticle"],
-                            nmid=quant["nmId"],
-                            barcode=int(quant["barcode"]) if quant.get("barcode") else None,
-                            quantity=quant["quantity"],
-                            inwaytoclient=quant["inWayToClient"],
-                            inwayfromclient=quant["inWayFromClient"],
-                            quantityfull=quant["quantityFull"],
-                            category=quant["category"],
-                            techsize=quant["techSize"],
-                            issupply=quant["isSupply"],
-                            isrealization=quant["isRealization"],
-                            sccode=quant["SCCode"],
-                            added_db=datetime.now()
-
+                        columns=[
+                            "lk_id", "lastchangedate", "warehousename", "supplierarticle", "nmid", "barcode", "quantity",
+                            "inwaytoclient", "inwayfromclient", "quantityfull", "category", "techsize", "issupply",
+                            "isrealization", "sccode", "added_db", "warehouse_id",
+                        ],
+                        records=(
+                            (
+                                cab["id"],
+                                parse_datetime(quant["lastChangeDate"]),
+                                quant["warehouseName"],
+                                quant["supplierArticle"],
+                                quant["nmId"],
+                                int(quant["barcode"]) if quant.get("barcode") else None,
+                                quant["quantity"],
+                                quant["inWayToClient"],
+                                quant["inWayFromClient"],
+                                quant["quantityFull"],
+                                quant["category"],
+                                quant["techSize"],
+                                quant["isSupply"],
+                                quant["isRealization"],
+                                quant["SCCode"],
+                                datetime.now(),
+                                warehouse_ids.get(quant["warehouseName"]),
+                            )
+                            for quant in stocks
                         ),
-                        conflict_fields=['nmid', 'lk_id', 'supplierarticle', 'warehousename']
+                        conflict_fields=['nmid', 'lk_id', 'supplierarticle', 'warehousename'],
+                        hash_column="row_hash",
                     )
+                logger.info(f"myapp_stocks, {cab['name']}: {dict(stats)}")
+                if last_change:
+                    await set_sync_state(conn, cab["id"], "stocks", last_change)
             except Exception as e:
                 logger.error(f"Ошибка при добавлении остатков в БД. Error: {e}")
-            finally:
-                await conn.close()
 
 
-async def get_stock_age_by_period():
-    cabinets = await get_data_from_db("myapp_wblk", ["id", "name", "token"])
-
-    async def get_analitics(cab: dict, period_get: int, id_report):
-        async with aiohttp.ClientSession() as session:
-            param = {
-                "type": "seller_analytics_generate",
-                "API_KEY": cab["token"],
-                "reportType": "STOCK_HISTORY_REPORT_CSV",
-                "start": (datetime.now() - timedelta(days=period_get)).strftime('%Y-%m-%d'),
-                "end": (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d'), #вчера с текущим временем
-                "id": id_report, #'685d17f6-ed17-44b4-8a86-b8382b05873c'
-                "userReportName": get_uuid(),
-            }
-            response = await wb_api(session, param)
-            logger.info(f"Генерируем отчет для {cab['name']}. ID: {id_report}. Period: {period_get}")
+async def submit_seller_analytics_report(cab: dict, report_type: str, start: str, end: str) -> str:
+    """
+    Заказать CSV-отчет аналитики продавца.
+    :return: id отчета для seller_analytics_report
+    """
+    id_report = get_uuid()
+    param = {
+        "type": "seller_analytics_generate",
+        "API_KEY": cab["token"],
+        "reportType": report_type,
+        "start": start,
+        "end": end,
+        "id": id_report,
+        "userReportName": get_uuid(),
+    }
+    response = await wb_api(None, param)
+    if not (response and response.get("data") and response["data"] == "Началось формирование файла/отчета"):
+        raise Exception(f"Ошибка формирования отчета {report_type}. Кабинет: {cab['name']}. Ответ: {response}")
+    return id_report
+
+
+async def poll_seller_analytics_report(cab: dict, id_report: str) -> bytes | None:
+    """Скачать ZIP-архив отчета. None, пока отчет не готов."""
+    param = {
+        "type": "seller_analytics_report",
+        "API_KEY": cab["token"],
+        "downloadId": id_report
+    }
+    response = await wb_api(None, param)
+    if not isinstance(response, bytes):
+        return None
+    if not zipfile.is_zipfile(io.BytesIO(response)):
+        # пока отчет не готов, вместо архива приходит json с ошибкой
+        # ("check correctness of download id or supplier id" или {"title": ...})
+        return None
+    return response
 
-            if not (response and response.get("data") and response["data"] == "Началось формирование файла/отчета"):
-                logger.error(f"Ошибка формирования отчета. Период {period_get}. Кабинет: {cab['name']}. Ответ: {response}")
-                raise
 
-            for attempt in range(4):
-                if attempt == 3:
-                    logger.error(f"‼️Ошибка получения данных в get_stock_age_by_period. Кабинет {cab['name']}. ID: {id_report}. Period: {period_get}")
-                    raise
+def seller_analytics_job(cab: dict, report_type: str, start: str, end: str, on_complete) -> ReportJob:
+    """Задание для run_report_jobs: заказать отчет аналитики, дождаться архива и передать его в on_complete"""
+    return ReportJob(
+        name=f"{report_type} {start}..{end} ({cab['name']})",
+        submit=lambda: submit_seller_analytics_report(cab, report_type, start, end),
+        poll=lambda id_report: poll_seller_analytics_report(cab, id_report),
+        on_complete=on_complete,
+    )
 
-                await asyncio.sleep(10)
-                param = {
-                    "type": "seller_analytics_report",
-                    "API_KEY": cab["token"],
-                    "downloadId": id_report
-                }
 
-                response = await wb_api(session, param)
-                if not isinstance(response, bytes):
-                    await asyncio.sleep(55)
-                else:
-                    try:
-                        text = response.decode('utf-8')
-                        if "check correctness of download id or supplier id" in text:
-                            await asyncio.sleep(55)
-                            logger.info(f"ВНИМАНИЕ!!!: check correctness of download id or supplier id. ПОПЫТКА: {attempt + 1}. Кабинет {cab['name']}. ID: {id_report}. Period: {period_get}")
-                            continue
-                        text = json.loads(text)
-                        if text.get("title"):
-                            await asyncio.sleep(55)
-                            continue
-                    except:
-                        break
+STOCK_AGE_COLUMNS = {
+    3: "days_in_stock_last_3",
+    7: "days_in_stock_last_7",
+    14: "days_in_stock_last_14",
+    30: "days_in_stock_last_30"
+}
 
-            with zipfile.ZipFile(io.BytesIO(response)) as zip_file:
-                for file_name in zip_file.namelist():
-                    with zip_file.open(file_name) as csv_file:
-                        # читаем CSV построчно
-                        reader = csv.reader(io.TextIOWrapper(csv_file, encoding='utf-8'))
-
-                        data = []
-                        header = next(reader)
-                        OfficeMissingTime_index = header.index("OfficeMissingTime")
-                        nmid_index = header.index("NmID")
-                        OfficeName_index = header.index("OfficeName") # может быть пустой строкой
-                        for index, row in enumerate(reader):
-                            if index == 0: continue # пропускаем шапку
-                            if row[OfficeName_index] == "": continue # если пустое название склада
-                            data.append(
-                                (
-                                    int(row[nmid_index]),
-                                    row[OfficeName_index].replace("Виртуальный ", "").replace("СЦ ", "").replace(" WB", "").replace(", Молодежненское", " (Молодежненское)").replace(" Сталелитейная", ""),
-                                    math.floor((period_get*24-int(row[OfficeMissingTime_index]))/24) if row[OfficeMissingTime_index] not in ["-1", "-2", "-3", "-4"] else 0,
-                                )
-                            )
+STOCK_AGE_CSV = [
+    ("NmID", int),
+    ("OfficeName", str),  # может быть пустой строкой
+    ("OfficeMissingTime", int),
+]
 
-                        conn = await async_connect_to_database()
-                        if not conn:
-                            logger.error("Ошибка подключения к БД в add_set_data_from_db")
-                            raise
 
-                        try:
-                            column_map = {
-                                3: "days_in_stock_last_3",
-                                7: "days_in_stock_last_7",
-                                14: "days_in_stock_last_14",
-                                30: "days_in_stock_last_30"
-                            }
-                            column_period = column_map.get(period_get)
-                            if not column_period:
-                                raise ValueError(f"Неподдерживаемый период: {period_get}")
-
-                            # Подготовка VALUES и параметров
-                            values_placeholders = []
-                            values_data = []
-                            for idx, (nmid, warehousename, OfficeMissingTime) in enumerate(data):
-                                base = idx * 3
-                                values_placeholders.append(f"(${base + 1}::integer, ${base + 2}::text, ${base + 3}::integer)")
-                                values_data.extend([nmid, warehousename, OfficeMissingTime])
-
-                            query = f"""
-                                UPDATE myapp_stocks AS p 
-                                SET
-                                    {column_period} = v.OfficeMissingTime
-                                FROM (
-                                    VALUES {', '.join(values_placeholders)}
-                                ) AS v(nmid, warehousename, OfficeMissingTime)
-                                WHERE v.nmid = p.nmid 
-                                    AND p.warehousename ILIKE '%' || v.warehousename || '%'
-                            """
-                            await conn.execute(query, *values_data)
+async def save_stock_age(period_get: int, content: bytes) -> None:
+    """Разобрать отчет STOCK_HISTORY_REPORT_CSV и записать дни в наличии за period_get в myapp_stocks"""
+    column_period = STOCK_AGE_COLUMNS.get(period_get)
+    if not column_period:
+        raise ValueError(f"Неподдерживаемый период: {period_get}")
 
-                        except Exception as e:
-                            logger.error(
-                                f"Ошибка обновления nmid, warehousename, column_period в myapp_stocks. Error: {e}"
-                            )
-                            raise
-                        finally:
-                            await conn.close()
+    records = (
+        (
+            nmid,
+            warehouse_key(office_name),
+            math.floor((period_get * 24 - office_missing_time) / 24) if office_missing_time not in [-1, -2, -3, -4] else 0,
+        )
+        # строки с пустым названием склада пропускаются до разбора OfficeMissingTime
+        for nmid, office_name, office_missing_time in iter_zip_csv(content, STOCK_AGE_CSV, skip_blank=("OfficeName",))
+    )
 
-    for period in [3, 7, 14, 30]:
-        tasks = []
-        for cab in cabinets:
-            id_report = get_uuid()  # 👉 делаем тут
-            tasks.append(get_analitics(cab, period, id_report))
-        await asyncio.gather(*tasks)
-        await asyncio.sleep(60)
+    try:
+        await bulk_merge_to_db(
+            conn=None,
+            table_name="myapp_stocks",
+            columns=["nmid", "warehousename", column_period],  # в warehousename — ключ склада (warehouse_key)
+            records=records,
+            merge_query=f"""
+                UPDATE myapp_stocks AS p
+                SET
+                    {column_period} = v.{column_period}
+                FROM {{staging}} AS v
+                JOIN myapp_warehouse w ON w.key = v.warehousename
+                WHERE v.nmid = p.nmid
+                    AND p.warehouse_id = w.id
+            """,
+        )
+    except Exception as e:
+        logger.error(
+            f"Ошибка обновления nmid, warehousename, column_period в myapp_stocks. Error: {e}"
+        )
+        raise
 
 
-async def get_stat_products():
+@invalidates("myapp_stocks")
+async def get_stock_age_by_period():
     cabinets = await get_data_from_db("myapp_wblk", ["id", "name", "token"])
 
-    async def get_analitics(cab: dict, period_get: dict):
-        async with aiohttp.ClientSession() as session:
-            id_report = get_uuid()
-            param = {
-                "type": "seller_analytics_generate",
-                "API_KEY": cab["token"],
-                "reportType": "DETAIL_HISTORY_REPORT",
-                "start": period["start"],
-                "end": period["end"],
-                "id": id_report,  # '685d17f6-ed17-44b4-8a86-b8382b05873c'
-                "userReportName": get_uuid(),
-            }
-            response = await wb_api(session, param)
-
-            if not (response and response.get("data") and response["data"] == "Началось формирование файла/отчета"):
-                logger.error(
-                    f"Ошибка формирования отчета. Период {period_get}. Кабинет: {cab['name']}. Ответ: {response}")
-                raise
-
-            for attempt in range(4):
-                if attempt == 3:
-                    logger.error(
-                        f"‼️Ошибка получения данных в get_stat_products. Кабинет {cab['name']}. ID: {id_report}. Period: {period_get}")
-                    raise
-                await asyncio.sleep(10)
-                param = {
-                    "type": "seller_analytics_report",
-                    "API_KEY": cab["token"],
-                    "downloadId": id_report
-                }
-
-                response = await wb_api(session, param)
-                if not isinstance(response, bytes):
-                    await asyncio.sleep(55)
-                else:
-                    try:
-                        text = response.decode('utf-8')
-                        if "check correctness of download id or supplier id" in text:
-                            await asyncio.sleep(55)
-                            logger.info(
-                                f"ВНИМАНИЕ!!!: check correctness of download id or supplier id. ПОПЫТКА: {attempt + 1}. Кабинет {cab['name']}. ID: {id_report}. Period: {period_get}")
-                            continue
-                        text = json.loads(text)
-                        if text.get("title"):
-                            await asyncio.sleep(55)
-                            continue
-                    except Exception as e:
-                        break
-            with zipfile.ZipFile(io.BytesIO(response)) as zip_file:
-                for file_name in zip_file.namelist():
-                    with zip_file.open(file_name) as csv_file:
-                        # читаем CSV построчно
-                        reader = csv.reader(io.TextIOWrapper(csv_file, encoding='utf-8'))
-
-                        data = []
-                        header = next(reader)
-
-                        nmid_index = header.index("nmID")
-                        date_wb = header.index("dt")
-                        openCardCount = header.index("openCardCount")
-                        addToCartCount = header.index("addToCartCount")
-                        ordersCount = header.index("ordersCount")
-                        ordersSumRub = header.index("ordersSumRub")
-                        buyoutsCount = header.index("buyoutsCount")
-                        buyoutsSumRub = header.index("buyoutsSumRub")
-                        cancelCount = header.index("cancelCount")
-                        cancelSumRub = header.index("cancelSumRub")
-                        addToCartConversion = header.index("addToCartConversion")
-                        cartToOrderConversion = header.index("cartToOrderConversion")
-                        buyoutPercent = header.index("buyoutPercent")
-
-
-                        for index, row in enumerate(reader):
-                            if index == 0: continue  # пропускаем шапку
-                            data.append(
-                                (
-                                    int(row[nmid_index]),
-                                    parse_datetime(row[date_wb]),
-                                    int(row[openCardCount]),
-                                    int(row[addToCartCount]),
-                                    int(row[ordersCount]),
-                                    int(row[ordersSumRub]),
-                                    int(row[buyoutsCount]),
-                                    int(row[buyoutsSumRub]),
-                                    int(row[cancelCount]),
-                                    int(row[cancelSumRub]),
-                                    int(row[addToCartConversion]),
-                                    int(row[cartToOrderConversion]),
-                                    int(row[buyoutPercent]),
-                                )
-                            )
+    def save_period(period_get: int):
+        async def on_complete(content: bytes):
+            await save_stock_age(period_get, content)
+        return on_complete
+
+    jobs = [
+        seller_analytics_job(
+            cab,
+            "STOCK_HISTORY_REPORT_CSV",
+            (datetime.now() - timedelta(days=period)).strftime('%Y-%m-%d'),
+            (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d'),  # вчера с текущим временем
+            save_period(period),
+        )
+        for period in [3, 7, 14, 30]
+        for cab in cabinets
+    ]
+    await run_report_jobs(jobs)
+
+
+PRODUCTS_STAT_CSV = [
+    ("nmID", int),
+    ("dt", parse_datetime),
+    ("openCardCount", int),
+    ("addToCartCount", int),
+    ("ordersCount", int),
+    ("ordersSumRub", int),
+    ("buyoutsCount", int),
+    ("buyoutsSumRub", int),
+    ("cancelCount", int),
+    ("cancelSumRub", int),
+    ("addToCartConversion", int),
+    ("cartToOrderConversion", int),
+    ("buyoutPercent", int),
+]
+
+
+async def save_products_stat(content: bytes) -> None:
+    """Разобрать отчет DETAIL_HISTORY_REPORT и записать статистику карточек в myapp_productsstat"""
+    try:
+        await bulk_upsert_to_db(
+            conn=None,
+            table_name="myapp_productsstat",
+            columns=[
+                "nmid", "date_wb", "openCardCount", "addToCartCount", "ordersCount", "ordersSumRub",
+                "buyoutsCount", "buyoutsSumRub", "cancelCount", "cancelSumRub",
+                "addToCartConversion", "cartToOrderConversion", "buyoutPercent",
+            ],
+            records=iter_zip_csv(content, PRODUCTS_STAT_CSV),
+            conflict_fields=["nmid", "date_wb"],
+            touch_updated_at=False,
+        )
+    except Exception as e:
+        logger.error(
+            f"Ошибка обновления данных в myapp_productsstat. Error: {e}"
+        )
+        raise
 
-                        conn = await async_connect_to_database()
-                        if not conn:
-                            logger.error("Ошибка подключения к БД в get_stat_products")
-                            raise
 
-                        try:
-                            BATCH_SIZE = 1000
-                            for batch_start in range(0, len(data), BATCH_SIZE):
-                                batch = data[batch_start:batch_start + BATCH_SIZE]
-                                # Подготовка VALUES и параметров
-                                values_placeholders = []
-                                values_data = []
-
-                                for idx, (
-                                        nmid, date_wb, openCardCount, addToCartCount, ordersCount, ordersSumRub, buyoutsCount,
-                                        buyoutsSumRub, cancelCount, cancelSumRub, addToCartConversion, cartToOrderConversion,
-                                        buyoutPercent) in enumerate(batch):
-                                    base = idx * 13
-                                    values_placeholders.append(
-                                        f"(${base + 1}::integer, ${base + 2}, ${base + 3}::integer, "
-                                        f"${base + 4}::integer, ${base + 5}::integer, ${base + 6}::integer, "
-                                        f"${base + 7}::integer, ${base + 8}::integer, ${base + 9}::integer, "
-                                        f"${base + 10}::integer, ${base + 11}::integer, ${base + 12}::integer, "
-                                        f"${base + 13}::integer)"
-                                    )
-                                    values_data.extend([
-                                        nmid, date_wb, openCardCount, addToCartCount, ordersCount, ordersSumRub,
-                                        buyoutsCount, buyoutsSumRub, cancelCount, cancelSumRub,
-                                        addToCartConversion, cartToOrderConversion, buyoutPercent
-                                    ])
-
-                                query = f"""
-                                    INSERT INTO myapp_productsstat (
-                                        nmid, date_wb, "openCardCount", "addToCartCount", "ordersCount", "ordersSumRub",
-                                        "buyoutsCount", "buyoutsSumRub", "cancelCount", "cancelSumRub",
-                                        "addToCartConversion", "cartToOrderConversion", "buyoutPercent"
-                                    )
-                                    VALUES {', '.join(values_placeholders)}
-                                    ON CONFLICT (nmid, date_wb) DO UPDATE SET
-                                        "openCardCount" = EXCLUDED."openCardCount",
-                                        "addToCartCount" = EXCLUDED."addToCartCount",
-                                        "ordersCount" = EXCLUDED."ordersCount",
-                                        "ordersSumRub" = EXCLUDED."ordersSumRub",
-                                        "buyoutsCount" = EXCLUDED."buyoutsCount",
-                                        "buyoutsSumRub" = EXCLUDED."buyoutsSumRub",
-                                        "cancelCount" = EXCLUDED."cancelCount",
-                                        "cancelSumRub" = EXCLUDED."cancelSumRub",
-                                        "addToCartConversion" = EXCLUDED."addToCartConversion",
-                                        "cartToOrderConversion" = EXCLUDED."cartToOrderConversion",
-                                        "buyoutPercent" = EXCLUDED."buyoutPercent";
-                                """
-                                await conn.execute(query, *values_data)
+@invalidates("myapp_productsstat")
+async def get_stat_products():
+    cabinets = await get_data_from_db("myapp_wblk", ["id", "name", "token"])
 
-                        except Exception as e:
-                            logger.error(
-                                f"Ошибка обновления данных в myapp_productsstat. Error: {e}"
-                            )
-                            raise
-                        finally:
-                            await conn.close()
     periods = [
         {
             "start": (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d'),
@@ -1054,94 +1126,86 @@ async def get_stat_products():
         #     "end": (datetime.now() - timedelta(days=48)).strftime('%Y-%m-%d')
         # }
     ]
-    for index, period in enumerate(periods):
-        tasks = [get_analitics(cab, period) for cab in cabinets]
-        await asyncio.gather(*tasks)
-        if index != len(periods) - 1:
-            await asyncio.sleep(60)
+    jobs = [
+        seller_analytics_job(cab, "DETAIL_HISTORY_REPORT", period["start"], period["end"], save_products_stat)
+        for period in periods
+        for cab in cabinets
+    ]
+    await run_report_jobs(jobs)
 
 
+@invalidates("myapp_supplies")
 async def get_supplies():
     cabinets = await get_data_from_db("myapp_wblk", ["id", "name", "token"])
-    async def get_analitics(cab, period_get: int):
-        async with aiohttp.ClientSession() as session:
+    async def get_analitics(cab):
+        conn = await async_connect_to_database()
+        if not conn:
+            logger.error("Ошибка подключения к БД")
+            raise
+        async with wb_session() as session:
+            # dateFrom фильтрует по lastChangeDate — берём поставки, изменённые после прошлой загрузки
             param = {
                 "type": "get_delivery_fbw",
                 "API_KEY": cab["token"],
-                "dateFrom": (datetime.now() - timedelta(days=period_get)).strftime('%Y-%m-%d')
+                "dateFrom": (await sync_since(conn, cab["id"], "supplies")).strftime('%Y-%m-%dT%H:%M:%S')
             }
             response = await wb_api(session, param)
+            warehouse_ids = await resolve_warehouse_ids(conn, (i["warehouseName"] for i in response))
             data = [
                 (
                     i["nmId"], i["incomeId"], i["number"], parse_datetime(i["date"]), parse_datetime(i["lastChangeDate"]),
                     i["supplierArticle"], i["techSize"], i["barcode"], i["quantity"], i["totalPrice"], parse_datetime(i["dateClose"]),
-                    i["warehouseName"], i["status"]
+                    i["warehouseName"], i["status"], warehouse_ids.get(i["warehouseName"])
             )
                 for i in response
                 if i["status"] == "Принято"
             ]
-            conn = await async_connect_to_database()
-            if not conn:
-                logger.error("Ошибка подключения к БД")
-                raise
             try:
-                query = f"""
-                    INSERT INTO myapp_supplies (
-                        nmid, "incomeId", "number", "date_post", "lastChangeDate", "supplierArticle",
+                stats = await bulk_upsert_to_db(
+                    conn=conn,
+                    table_name="myapp_supplies",
+                    columns=[
+                        "nmid", "incomeId", "number", "date_post", "lastChangeDate", "supplierArticle",
                         "techSize", "barcode", "quantity", "totalPrice",
-                        "dateClose", "warehouseName", "status"
-                    )
-                    VALUES (
-                        $1, $2, $3, $4, $5, $6,
-                        $7, $8, $9, $10, $11,
-                        $12, $13
-                    )
-                    ON CONFLICT (nmid, "incomeId") DO UPDATE SET
-                        "number" = EXCLUDED."number",
-                        "date_post" = EXCLUDED."date_post",
-                        "lastChangeDate" = EXCLUDED."lastChangeDate",
-                        "supplierArticle" = EXCLUDED."supplierArticle",
-                        "techSize" = EXCLUDED."techSize",
-                        "barcode" = EXCLUDED."barcode",
-                        "quantity" = EXCLUDED."quantity",
-                        "totalPrice" = EXCLUDED."totalPrice",
-                        "dateClose" = EXCLUDED."dateClose",
-                        "warehouseName" = EXCLUDED."warehouseName",
-                        "status" = EXCLUDED."status";
-                """
-                await conn.executemany(query, data)
+                        "dateClose", "warehouseName", "status", "warehouse_id",
+                    ],
+                    records=data,
+                    conflict_fields=["nmid", "incomeId"],
+                    touch_updated_at=False,
+                    hash_column="row_hash",
+                )
+                logger.info(f"myapp_supplies, {cab['name']}: {stats}")
             except Exception as e:
                 logger.error(
                     f"Ошибка обновления данных в myapp_supplies. Error: {e}"
                 )
                 raise
-            finally:
-                await conn.close()
 
+            if response:
+                last_change = max(parse_datetime(i["lastChangeDate"]) for i in response)
+                await set_sync_state(conn, cab["id"], "supplies", last_change)
 
 
-    tasks = [get_analitics(cab, 7) for cab in cabinets]
+    tasks = [get_analitics(cab) for cab in cabinets]
     await asyncio.gather(*tasks)
 
 
+@invalidates("myapp_advstat")
 async def get_advs_stat():
     cabinets = await get_data_from_db("myapp_wblk", ["id", "name", "token"])
 
-    # КРИТИЧЕСКИ ВАЖНО: создаём блокировки ДО запуска задач
-    token_locks = {}
-    token_last_call = {}
-
-    # Предварительно создаём блокировки для всех уникальных токенов
-    unique_tokens = set(cab["token"] for cab in cabinets)
-    for token in unique_tokens:
-        token_locks[token] = asyncio.Lock()
-        token_last_call[token] = 0
-
-    logger.info(f"Инициализировано {len(unique_tokens)} уникальных токенов для rate limiting")
+    # Лимит fullstats по токену соблюдает wb_rate_limiter внутри wb_api (общий для всех воркеров)
 
     async def get_data_advs(cab):
         try:
-            token = cab["token"]
+            conn = await async_connect_to_database()
+            if not conn:
+                raise Exception(f"Ошибка подключения к БД в {cab['name']}")
+
+            # с прошлой успешной загрузки (минус перекрытие), не больше 30 дней
+            startperiod = (await sync_since(conn, cab["id"], "advs_stat")).strftime('%Y-%m-%d')
+            endperiod = datetime.now().strftime('%Y-%m-%d')
+            failed = False
 
             yesterday = now() - td(days=1)
             advs_ids = await sync_to_async(list)(
@@ -1155,20 +1219,17 @@ async def get_advs_stat():
                 logger.info(f"Нет активных РК для кабинета {cab['name']}")
                 return
 
-            async with aiohttp.ClientSession() as session:
+            async with wb_session() as session:
                 param = {"type": "fullstatsadv"}
 
                 # Уменьшаем батч до 50 для надёжности
                 BATCH_SIZE = 50
-                MIN_INTERVAL = 90  # секунды между запросами
                 MAX_RETRIES = 3
 
                 for i in range(0, len(advs_ids), BATCH_SIZE):
                     param["API_KEY"] = cab["token"]
                     articles = [str(art) for art in advs_ids[i:i + BATCH_SIZE]]
 
-                    startperiod = (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d')
-                    endperiod = datetime.now().strftime('%Y-%m-%d')
                     param["settings"] = {
                         "ids": ",".join(articles),
                         "beginDate": startperiod,
@@ -1181,25 +1242,11 @@ async def get_advs_stat():
                     total_batches = (len(advs_ids) + BATCH_SIZE - 1) // BATCH_SIZE
 
                     for attempt in range(1, MAX_RETRIES + 1):
-                        # Rate limiting для конкретного токена
-                        async with token_locks[token]:
-                            current_time = time.time()
-                            time_since_last_call = current_time - token_last_call[token]
-
-                            if time_since_last_call < MIN_INTERVAL:
-                                wait_time = MIN_INTERVAL - time_since_last_call
-                                # logger.info(f"Rate limiting для {cab['name']}: ждём {wait_time:.1f} сек")
-                                await asyncio.sleep(wait_time)
-
-                            if attempt > 1:
-                                logger.info(
-                                    f"Повтор {attempt}/{MAX_RETRIES} для {cab['name']}, батч {batch_num}/{total_batches}")
-                            else:
-                                # logger.info(f"Запрос fullstats для {cab['name']}, батч {batch_num}/{total_batches}")
-                                pass
-
-                            response = await wb_api(session, param)
-                            token_last_call[token] = time.time()
+                        if attempt > 1:
+                            logger.info(
+                                f"Повтор {attempt}/{MAX_RETRIES} для {cab['name']}, батч {batch_num}/{total_batches}")
+
+                        response = await wb_api(session, param)
 
                         # Проверяем успешность запроса
                         if response is not None:
@@ -1222,6 +1269,7 @@ async def get_advs_stat():
                             f"Не удалось получить данные после {MAX_RETRIES} попыток "
                             f"для {cab['name']}, батч {batch_num}"
                         )
+                        failed = True
                         continue
 
                     for advert in response:
@@ -1276,11 +1324,7 @@ async def get_advs_stat():
                                     "views" = EXCLUDED."views";
                             """
 
-                            conn = await async_connect_to_database()
-                            try:
-                                await conn.executemany(query, data_for_upload)
-                            finally:
-                                await conn.close()
+                            await conn.executemany(query, data_for_upload)
                             # logger.info(f"Загружено {len(data_for_upload)} записей для {cab['name']}, батч {batch_num}")
                         except Exception as e:
                             logger.error(f"Ошибка обновления данных для {cab['name']}, батч {batch_num}: {e}")
@@ -1288,6 +1332,10 @@ async def get_advs_stat():
                     else:
                         logger.info(f"Нет данных для загрузки, батч {batch_num} для {cab['name']}")
 
+            # сегодняшний день ещё не закрыт — следующая загрузка перечитает его за счёт перекрытия
+            if not failed:
+                await set_sync_state(conn, cab["id"], "advs_stat", datetime.strptime(endperiod, '%Y-%m-%d'))
+
         except Exception as e:
             logger.error(f"Ошибка в get_data_advs для {cab['name']}: {e}")
             raise
@@ -1307,6 +1355,7 @@ async def get_advs_stat():
             logger.error(f"Ошибка обработки кабинета {cab['name']}: {result}")
 
 
+@invalidates("myapp_adverts")
 async def get_advs():
     """
     Получить списки всех рекламных кампаний продавца с их ID.
@@ -1326,7 +1375,7 @@ async def get_advs():
                 "type": "list_adverts_id",
                 "API_KEY": cab["token"],
             }
-            async with aiohttp.ClientSession() as session:
+            async with wb_session() as session:
                 response = await wb_api(session, param)
                 response = response["adverts"]
 
@@ -1360,8 +1409,6 @@ async def get_advs():
                 raise Exception(f"Ошибка обновления данных в myapp_adverts. Error: {e}")
         except Exception as e:
             logger.error(f"Ошибка в get_advs_for_inn: {e} для {cab['name']}")
-        finally:
-            await conn.close()
 
     async def get_advs_limited(cab):
         async with semaphore:
@@ -1371,9 +1418,88 @@ async def get_advs():
     await asyncio.gather(*tasks, return_exceptions=True)
 
 
+FIN_REPORT_PAGE_LIMIT = 100000  # максимум строк reportDetailByPeriod за один запрос
+FIN_REPORT_BATCH_SIZE = 10000  # сколько строк страницы писать в БД за раз
+
+FIN_REPORT_COLUMNS = [
+    "lk_id", "rrd_id", "rr_dt", "nmid", "order_dt", "sale_dt", "shk_id", "ts_name", "supplier_oper_name",
+    "retail_price", "retail_amount", "ppvz_for_pay", "delivery_rub", "storage_fee", "deduction",
+    "acceptance", "penalty",
+]
+
+
+def fin_report_row(lk_id: int, row: dict) -> tuple:
+    """Строка reportDetailByPeriod -> запись myapp_findata в порядке FIN_REPORT_COLUMNS"""
+    return (
+        lk_id,
+        str(row["rrd_id"]),
+        datetime.strptime(row["rr_dt"][:10], "%Y-%m-%d").date(),
+        row.get("nm_id"),
+        datetime.strptime(row["order_dt"][:10], "%Y-%m-%d").date(),
+        datetime.strptime(row["sale_dt"][:10], "%Y-%m-%d").date(),
+        str(row.get("shk_id")) if row.get("shk_id") is not None else None,
+        row["ts_name"].lower(),
+        row["supplier_oper_name"].lower(),
+        float(row["retail_price"]),
+        row.get("retail_amount"),
+        row.get("ppvz_for_pay"),
+        row.get("delivery_rub"),
+        row.get("storage_fee"),
+        row.get("deduction"),
+        float(row["acceptance"]),
+        float(row["penalty"]),
+    )
+
+
+async def iter_fin_report_pages(session, token: str, date_from: str, date_to: str, rrdid: int = 0):
+    """
+    Async-генератор фин отчета: листает reportDetailByPeriod по курсору rrdid, пока данные не кончатся.
+    Страница читается потоково и отдаётся пачками по FIN_REPORT_BATCH_SIZE строк.
+    :return: пары (rrd_id последней строки пачки, список строк)
+    """
+    while True:
+        param = {
+            "type": "fin_report",
+            "API_KEY": token,
+            "date_from": date_from,
+            "date_to": date_to,
+            "rrdid": rrdid,
+            "limit": FIN_REPORT_PAGE_LIMIT,
+        }
+        page_rows = 0
+        async for batch in batched(wb_api_stream(session, param), FIN_REPORT_BATCH_SIZE):
+            rrdid = batch[-1]["rrd_id"]
+            page_rows += len(batch)
+            yield rrdid, batch
+
+        if page_rows < FIN_REPORT_PAGE_LIMIT:
+            return
+
+
+def get_fin_report_checkpoint(lk_id: int) -> dict | None:
+    """Незавершённая выгрузка фин отчета кабинета: {"date_from", "date_to", "rrdid"}"""
+    value = r.get(f"fin_report_checkpoint_{lk_id}")
+    return json.loads(value) if value else None
+
+
+def set_fin_report_checkpoint(lk_id: int, date_from: str, date_to: str, rrdid: int) -> None:
+    r.set(
+        f"fin_report_checkpoint_{lk_id}",
+        json.dumps({"date_from": date_from, "date_to": date_to, "rrdid": rrdid}),
+    )
+
+
+def delete_fin_report_checkpoint(lk_id: int) -> None:
+    r.delete(f"fin_report_checkpoint_{lk_id}")
+
+
+@invalidates("myapp_findata", "myapp_findaily")
 async def get_fin_report():
     """
-    Получить фин отчет
+    Получить фин отчет.
+    Отчет листается по rrdid постранично, строки пишутся в БД пачками по мере чтения ответа,
+    а последний rrd_id сохраняется в редис — прерванная выгрузка продолжится с него.
+    После каждой пачки пересчитывается сводка myapp_findaily за затронутые дни.
     """
 
     cabinets = await get_data_from_db("myapp_wblk", ["id", "name", "token"])
@@ -1385,70 +1511,51 @@ async def get_fin_report():
             logger.error(f"Ошибка подключения к БД в {cab['name']}")
             raise
         try:
-            param = {
-                "type": "fin_report",
-                "API_KEY": cab["token"],
-                "date_from": (datetime.now() - timedelta(days=14)).strftime('%Y-%m-%d'),
-                "date_to": datetime.now().strftime('%Y-%m-%d')
-            }
+            await backfill_fin_daily(conn, cab["id"])
 
-            async with aiohttp.ClientSession() as session:
-                response = await wb_api(session, param)
+            checkpoint = get_fin_report_checkpoint(cab["id"])
+            if checkpoint:
+                date_from, date_to, rrdid = checkpoint["date_from"], checkpoint["date_to"], checkpoint["rrdid"]
+                logger.info(f"Продолжаем выгрузку фин отчета для {cab['name']} с rrdid {rrdid}")
+            else:
+                date_from = (await sync_since(conn, cab["id"], "fin_report")).strftime('%Y-%m-%d')
+                date_to = datetime.now().strftime('%Y-%m-%d')
+                rrdid = 0
 
-            try:
-                data_for_upload = [
-                    (
-                        cab["id"],
-                        str(row["rrd_id"]),
-                        datetime.strptime(row["rr_dt"][:10], "%Y-%m-%d").date(),
-                        row.get("nm_id"),
-                        datetime.strptime(row["order_dt"][:10], "%Y-%m-%d").date(),
-                        datetime.strptime(row["sale_dt"][:10], "%Y-%m-%d").date(),
-                        str(row.get("shk_id")) if row.get("shk_id") is not None else None,
-                        row["ts_name"].lower(),
-                        row["supplier_oper_name"].lower(),
-                        float(row["retail_price"]),
-                        row.get("retail_amount"),
-                        row.get("ppvz_for_pay"),
-                        row.get("delivery_rub"),
-                        row.get("storage_fee"),
-                        row.get("deduction"),
-                        float(row["acceptance"]),
-                        float(row["penalty"]),
-                    )
-                    for row in response
-                ]
-            except Exception as e:
-                raise Exception(f"ошибка подготовки данных {e}")
+            total = 0
+            async with wb_session() as session:
+                async for rrdid, page in iter_fin_report_pages(session, cab["token"], date_from, date_to, rrdid):
+                    try:
+                        data_for_upload = [fin_report_row(cab["id"], row) for row in page]
+                    except Exception as e:
+                        raise Exception(f"ошибка подготовки данных {e}")
 
-            try:
-                query = f"""
-                    INSERT INTO myapp_findata (
-                        "lk_id", "rrd_id", "rr_dt", "nmid", "order_dt", "sale_dt", "shk_id", "ts_name", "supplier_oper_name",
-                        "retail_price", "retail_amount", "ppvz_for_pay", "delivery_rub", "storage_fee", "deduction",
-                        "acceptance", "penalty"
-                    )
-                    VALUES (
-                        $1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14, $15, $16, $17
-                    )
-                    ON CONFLICT ("rrd_id") DO UPDATE SET
-                        "sale_dt" = EXCLUDED."sale_dt",
-                        "retail_price" = EXCLUDED."retail_price",
-                        "retail_amount" = EXCLUDED."retail_amount",
-                        "ppvz_for_pay" = EXCLUDED."ppvz_for_pay",
-                        "delivery_rub" = EXCLUDED."delivery_rub",
-                        "storage_fee" = EXCLUDED."storage_fee",
-                        "deduction" = EXCLUDED."deduction",
-                        "acceptance" = EXCLUDED."acceptance",
-                        "penalty" = EXCLUDED."penalty";
-                """
-                await insert_in_chunks(conn, query, data_for_upload, chunk_size=1000)
-            except Exception as e:
-                raise Exception(f"Ошибка обновления данных в myapp_findata. Error: {e}")
+                    try:
+                        await bulk_upsert_to_db(
+                            conn=conn,
+                            table_name="myapp_findata",
+                            columns=FIN_REPORT_COLUMNS,
+                            records=data_for_upload,
+                            conflict_fields=["rrd_id", "rr_dt"],
+                            touch_updated_at=False,
+                            update_fields=[
+                                "sale_dt", "retail_price", "retail_amount", "ppvz_for_pay", "delivery_rub",
+                                "storage_fee", "deduction", "acceptance", "penalty",
+                            ],
+                        )
+                    except Exception as e:
+                        raise Exception(f"Ошибка обновления данных в myapp_findata. Error: {e}")
+
+                    await refresh_fin_daily_for_rows(conn, cab["id"], (row[2] for row in data_for_upload))
+
+                    set_fin_report_checkpoint(cab["id"], date_from, date_to, rrdid)
+                    total += len(page)
+
+            delete_fin_report_checkpoint(cab["id"])
+            await set_sync_state(conn, cab["id"], "fin_report", datetime.strptime(date_to, '%Y-%m-%d'), str(rrdid))
+            logger.info(f"Фин отчет для {cab['name']} загружен. Строк: {total}")
         except Exception:
             logger.exception(f"Ошибка в fin_report_by_lk")
-        finally:
-            await conn.close()
 
     async def get_fin_rep_limited(cab):
         async with semaphore:
@@ -1458,119 +1565,121 @@ async def get_fin_report():
     await asyncio.gather(*tasks)
 
 
-async def make_and_get_save_report():
-    """
-    Отчет о платном хранении
-    """
+async def save_paid_storage(cab: dict, response: list) -> None:
+    """Записать строки отчета о платном хранении в myapp_savedata"""
+    conn = await async_connect_to_database()
+    if not conn:
+        raise Exception(f"Ошибка подключения к БД в {cab['name']}")
 
-    cabinets = await get_data_from_db("myapp_wblk", ["id", "name", "token"])
+    logger.info(f"Загружаем данные в БД. Длина массива: {len(response)}")
 
-    semaphore = asyncio.Semaphore(3)
-    async def save_dates(cab):
-        param = {
-            "type": "make_save_rep",
-            "API_KEY": cab["token"],
-            "date_from": (datetime.now() - timedelta(days=8)).strftime('%Y-%m-%d'),
-            "date_to": datetime.now().strftime('%Y-%m-%d')
-        }
+    warehouse_ids = await resolve_warehouse_ids(
+        conn,
+        (row["warehouse"] for row in response),
+        office_ids={row["warehouse"]: row["officeId"] for row in response if row.get("warehouse")},
+    )
 
-        async with aiohttp.ClientSession() as session:
-            response = await wb_api(session, param)
-            try:
-                task_id = response["data"]["taskId"]
-            except Exception as e:
-                logger.error(f"Ошибка при запросе отчета платного хранения для кабинета {cab['name']}")
-                raise
+    try:
+        data_for_upload = [
+            (
+                cab["id"],
+                datetime.strptime(row["date"][:10], "%Y-%m-%d").date(),
+                row["logWarehouseCoef"],
+                row["officeId"],
+                row["warehouse"],
+                row["warehouseCoef"],
+                row["giId"],
+                row["chrtId"],
+                row["size"],
+                row["barcode"],
+                row["subject"],
+                row["brand"],
+                row["vendorCode"],
+                row["nmId"],
+                row["volume"],
+                row["calcType"],
+                row["warehousePrice"],
+                row["barcodesCount"],
+                row["palletPlaceCode"],
+                row["palletCount"],
+                datetime.strptime(row["originalDate"][:10], "%Y-%m-%d").date(),
+                row["loyaltyDiscount"],
+                datetime.strptime(row["tariffFixDate"][:10], "%Y-%m-%d").date() if row.get("tariffFixDate") else None,
+                datetime.strptime(row["tariffLowerDate"][:10], "%Y-%m-%d").date() if row.get("tariffLowerDate") else None,
+                warehouse_ids.get(row["warehouse"]),
+            )
+            for row in response
+        ]
+    except Exception as e:
+        raise Exception(f"ошибка подготовки данных {e}")
 
-        param["type"] = "get_save_report"
-        param["task_id"] = task_id
+    try:
+        query = f"""
+            INSERT INTO myapp_savedata (
+                "lk_id", "date_wb", "logWarehouseCoef", "officeId", "warehouse", "warehouseCoef", "giId",
+                "chrtId", "size", "barcode", "subject", "brand", "vendorcode", "nmid", "volume",
+                "calcType", "warehousePrice", "barcodesCount", "palletPlaceCode", "palletCount", 
+                "originalDate", "loyaltyDiscount", "tariffFixDate", "tariffLowerDate", "warehouse_id"
+            )
+            VALUES (
+                $1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14, $15, $16, $17, $18, $19, 
+                $20, $21, $22, $23, $24, $25
+            )
+            ON CONFLICT ("date_wb", "nmid", "calcType", "size") DO UPDATE SET
+                "warehousePrice" = EXCLUDED."warehousePrice",
+                "warehouse_id" = EXCLUDED."warehouse_id";
+        """
+        await insert_in_chunks(conn, query, data_for_upload, chunk_size=1000)
+    except Exception as e:
+        raise Exception(f"Ошибка обновления данных. Error: {e}")
 
-        for i in range(1,5):
-            if i == 4:
-                logger.error(f"Ошибка получения данных о платном хранении для {cab['name']}")
-                return
-            async with aiohttp.ClientSession() as session:
-                try:
-                    response = await wb_api(session, param)
-                    if not response or not response[0]["nmId"]:
-                        raise
-                except Exception as e:
-                    logger.info(f"Повторяем через 60 сек")
-                    await asyncio.sleep(60)
-                    continue
-                try:
-                    conn = await async_connect_to_database()
-                    if not conn:
-                        raise Exception(f"Ошибка подключения к БД в {cab['name']}")
 
-                    logger.info(f"Загружаем данные в БД. Длина массива: {len(response)}")
+def paid_storage_job(cab: dict) -> ReportJob:
+    """Задание для run_report_jobs: отчет о платном хранении за 8 дней"""
+    param = {
+        "type": "make_save_rep",
+        "API_KEY": cab["token"],
+        "date_from": (datetime.now() - timedelta(days=8)).strftime('%Y-%m-%d'),
+        "date_to": datetime.now().strftime('%Y-%m-%d')
+    }
 
-                    try:
-                        data_for_upload = [
-                            (
-                                cab["id"],
-                                datetime.strptime(row["date"][:10], "%Y-%m-%d").date(),
-                                row["logWarehouseCoef"],
-                                row["officeId"],
-                                row["warehouse"],
-                                row["warehouseCoef"],
-                                row["giId"],
-                                row["chrtId"],
-                                row["size"],
-                                row["barcode"],
-                                row["subject"],
-                                row["brand"],
-                                row["vendorCode"],
-                                row["nmId"],
-                                row["volume"],
-                                row["calcType"],
-                                row["warehousePrice"],
-                                row["barcodesCount"],
-                                row["palletPlaceCode"],
-                                row["palletCount"],
-                                datetime.strptime(row["originalDate"][:10], "%Y-%m-%d").date(),
-                                row["loyaltyDiscount"],
-                                datetime.strptime(row["tariffFixDate"][:10], "%Y-%m-%d").date() if row.get("tariffFixDate") else None,
-                                datetime.strptime(row["tariffLowerDate"][:10], "%Y-%m-%d").date() if row.get("tariffLowerDate") else None
-                            )
-                            for row in response
-                        ]
-                    except Exception as e:
-                        raise Exception(f"ошибка подготовки данных {e}")
+    async def submit():
+        response = await wb_api(None, param)
+        try:
+            return response["data"]["taskId"]
+        except Exception:
+            raise Exception(f"Ошибка при запросе отчета платного хранения для кабинета {cab['name']}. Ответ: {response}")
+
+    async def poll(task_id):
+        response = await wb_api(None, {**param, "type": "get_save_report", "task_id": task_id})
+        if response == []:
+            # отчет сформирован, но хранения за период не было
+            return REPORT_EMPTY
+        if not response or not isinstance(response, list) or not response[0].get("nmId"):
+            return None
+        return response
+
+    async def on_complete(response):
+        if not response:
+            logger.info(f"Платного хранения для кабинета {cab['name']} за период нет")
+            return
+        await save_paid_storage(cab, response)
 
-                    try:
-                        query = f"""
-                            INSERT INTO myapp_savedata (
-                                "lk_id", "date_wb", "logWarehouseCoef", "officeId", "warehouse", "warehouseCoef", "giId",
-                                "chrtId", "size", "barcode", "subject", "brand", "vendorcode", "nmid", "volume",
-                                "calcType", "warehousePrice", "barcodesCount", "palletPlaceCode", "palletCount", 
-                                "originalDate", "loyaltyDiscount", "tariffFixDate", "tariffLowerDate"
-                            )
-                            VALUES (
-                                $1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14, $15, $16, $17, $18, $19, 
-                                $20, $21, $22, $23, $24
-                            )
-                            ON CONFLICT ("date_wb", "nmid", "calcType", "size") DO UPDATE SET
-                                "warehousePrice" = EXCLUDED."warehousePrice";
-                        """
-                        await insert_in_chunks(conn, query, data_for_upload, chunk_size=1000)
-                    except Exception as e:
-                        raise Exception(f"Ошибка обновления данных. Error: {e}")
+    return ReportJob(name=f"paid_storage ({cab['name']})", submit=submit, poll=poll, on_complete=on_complete)
 
-                except Exception as e:
-                    logger.error(f"Ошибка в save_dates: {e}")
-                finally:
-                    await conn.close()
-            break
 
-    async def get_save_rep_limited(cab):
-        async with semaphore:
-            return await save_dates(cab)
+@invalidates("myapp_savedata", "myapp_warehousealias")
+async def make_and_get_save_report():
+    """
+    Отчет о платном хранении
+    """
 
-    tasks = [get_save_rep_limited(cab) for cab in cabinets]
-    await asyncio.gather(*tasks)
+    cabinets = await get_data_from_db("myapp_wblk", ["id", "name", "token"])
+
+    await run_report_jobs([paid_storage_job(cab) for cab in cabinets])
 
 
+@invalidates("myapp_regionsales")
 async def get_region_sales():
     """
     Получить продажи по регионам
@@ -1586,16 +1695,10 @@ async def get_region_sales():
             if not conn:
                 raise Exception(f"Ошибка подключения к БД в {cab['name']}")
 
-            req_is_rows_in_db = """
-                SELECT * from myapp_regionsales WHERE lk_id = $1 LIMIT 1 
-            """
-            all_fields = await conn.fetch(req_is_rows_in_db, cab["id"])
-
-            if all_fields:
-                dates = [(datetime.now() - timedelta(days=i)).strftime('%Y-%m-%d') for i in range(1, 3)]
-            else:
-                logger.info(f"Данные о продажах в регионе для {cab['name']} отсутствуют в БД")
-                dates = [(datetime.now() - timedelta(days=i)).strftime('%Y-%m-%d') for i in range(1, 16)]
+            # дни с последнего загруженного (он перечитывается — перекрытие) по вчера включительно
+            since = (await sync_since(conn, cab["id"], "region_sales")).date()
+            today = datetime.now().date()
+            dates = [(since + timedelta(days=i)).strftime('%Y-%m-%d') for i in range((today - since).days)]
 
             for _date in dates:
                 param = {
@@ -1605,54 +1708,50 @@ async def get_region_sales():
                     "API_KEY": cab["token"],
                 }
 
-                async with aiohttp.ClientSession() as session:
-                    response = await wb_api(session, param)
-                    await asyncio.sleep(25)
-                    try:
-                        data_for_upload = [
-                            (
-                                cab["id"],
-                                datetime.strptime(_date, "%Y-%m-%d").date(),
-                                row["nmID"],
-                                row["cityName"],
-                                row["countryName"],
-                                row["foName"],
-                                row["regionName"],
-                                row["sa"],
-                                row["saleInvoiceCostPrice"],
-                                row["saleInvoiceCostPricePerc"],
-                                row["saleItemInvoiceQty"]
-                            )
-                            for row in response["report"]
-                        ]
-                    except Exception as e:
-                        raise Exception(f"ошибка подготовки данных {e}")
+                query = f"""
+                    INSERT INTO myapp_regionsales (
+                        "lk_id", "date_wb", "nmid", "cityName", "countryName", "foName", "regionName",
+                        "sa", "saleInvoiceCostPrice", "saleInvoiceCostPricePerc", "saleItemInvoiceQty"
+                    )
+                    VALUES (
+                        $1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11
+                    )
+                    ON CONFLICT ("date_wb", "nmid", "sa", "cityName", "regionName") DO UPDATE SET
+                        "saleInvoiceCostPrice" = EXCLUDED."saleInvoiceCostPrice",
+                        "saleInvoiceCostPricePerc" = EXCLUDED."saleInvoiceCostPricePerc",
+                        "saleItemInvoiceQty" = EXCLUDED."saleItemInvoiceQty";
+                """
+                async with wb_session() as session:
+                    async for rows in batched(wb_api_stream(session, param, key="report"), STREAM_BATCH_SIZE):
+                        try:
+                            data_for_upload = [
+                                (
+                                    cab["id"],
+                                    datetime.strptime(_date, "%Y-%m-%d").date(),
+                                    row["nmID"],
+                                    row["cityName"],
+                                    row["countryName"],
+                                    row["foName"],
+                                    row["regionName"],
+                                    row["sa"],
+                                    row["saleInvoiceCostPrice"],
+                                    row["saleInvoiceCostPricePerc"],
+                                    row["saleItemInvoiceQty"]
+                                )
+                                for row in rows
+                            ]
+                        except Exception as e:
+                            raise Exception(f"ошибка подготовки данных {e}")
 
-                    try:
-                        query = f"""
-                            INSERT INTO myapp_regionsales (
-                                "lk_id", "date_wb", "nmid", "cityName", "countryName", "foName", "regionName",
-                                "sa", "saleInvoiceCostPrice", "saleInvoiceCostPricePerc", "saleItemInvoiceQty"
-                            )
-                            VALUES (
-                                $1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11
-                            )
-                            ON CONFLICT ("date_wb", "nmid", "sa", "cityName", "regionName") DO UPDATE SET
-                                "saleInvoiceCostPrice" = EXCLUDED."saleInvoiceCostPrice",
-                                "saleInvoiceCostPricePerc" = EXCLUDED."saleInvoiceCostPricePerc",
-                                "saleItemInvoiceQty" = EXCLUDED."saleItemInvoiceQty";
-                        """
-                        await insert_in_chunks(conn, query, data_for_upload, chunk_size=1000)
-                    except Exception as e:
-                        raise Exception(f"Ошибка обновления данных. Error: {e}")
+                        try:
+                            await insert_in_chunks(conn, query, data_for_upload, chunk_size=1000)
+                        except Exception as e:
+                            raise Exception(f"Ошибка обновления данных. Error: {e}")
+
+            await set_sync_state(conn, cab["id"], "region_sales", datetime.combine(today, datetime.min.time()))
 
         except Exception as e:
                 logger.error(f"Ошибка в sale_dates: {e}")
-        finally:
-            try:
-                await conn.close()
-            except:
-                pass
 
     async def get_region_sales_limited(cab):
         async with semaphore:
@@ -1703,15 +1802,13 @@ async def get_orders_from_wb_lk():
             raise Exception(f"Ошибка получения кукков из БД: {e}")
 
 
-        async with aiohttp.ClientSession() as session:
+        async with wb_session() as session:
             data = {cab["id"]: process_orders_from_lk(cab, conn) for cab in result}
             results = await asyncio.gather(*data.values())
 
             id_to_result = {name: result for name, result in zip(data.keys(), results)}
     except Exception as e:
         logger.error(e)
-    finally:
-        await conn.close()
 
 
 async def process_orders_from_lk(lk: dict, conn):
@@ -1738,13 +1835,12 @@ async def process_orders_from_lk(lk: dict, conn):
         lk["authorizev3"]
     )
 
-    request = "SELECT id FROM myapp_orders WHERE lk_id = $1 LIMIT 1"
-    all_fields = await conn.fetch(request, lk["id"])
-    if all_fields:
-        reduce = 14
-    else:
-        reduce = 61
+    # отчеты за дни с прошлой загрузки (минус перекрытие) по вчера
+    since = await sync_since(conn, lk["id"], "orders_lk")
+    reduce = max((datetime.now().date() - since.date()).days, 1)
 
+    # докуда отчеты созданы без пропусков — дальше этого watermark не двигается
+    covered, gap = None, False
     for day in range(reduce, 0, -1):
         _date = await get_time_str(format="%d.%m.%y", reduce=day)
         params = {
@@ -1766,12 +1862,21 @@ async def process_orders_from_lk(lk: dict, conn):
         if not response or not response.get("data"):
             logger.error(f"Ошибка создания отчета. Дата: {_date}. ЛК: {lk['name']}")
             r.set(f"create_{lk['id']}_{_date}_{get_uuid()}", "")
+            gap = True
             continue
 
         try:
             r.set(f"download_{lk['id']}_{_date}_{get_uuid()}", response["data"]["id"])
         except Exception as e:
             logger.error(f"Ошибка кеширования: {e}")
+            gap = True
+
+        if not gap:
+            covered = day
+
+    if covered:
+        watermark = datetime.combine(datetime.now().date() - timedelta(days=covered - 1), datetime.min.time())
+        await set_sync_state(conn, lk["id"], "orders_lk", watermark)
 
 
 async def download_orders_from_wb_lk():
@@ -1813,8 +1918,6 @@ async def download_orders_from_wb_lk():
                 }
             except Exception as e:
                 raise Exception(f"Ошибка получения кукков из БД: {e}")
-            finally:
-                await conn.close()
 
         cookies, headers = await get_cookies_headers(
             cookies_by_id[lk_id]["cookie"]["wbx-validation-key"],
@@ -1841,6 +1944,7 @@ async def download_orders_from_wb_lk():
             r.delete(key)
 
 
+@invalidates("myapp_orders", "myapp_warehousealias")
 async def load_to_db_report():
     """тут декодирем отчет о заказх из ЛК ВБ и загружаем в БД"""
 
@@ -1869,13 +1973,17 @@ async def load_to_db_report():
             ws = wb.active
 
             try:
+                rows = list(ws.iter_rows(min_row=3, values_only=True))
+                warehouse_ids = await resolve_warehouse_ids(conn, (row[10] for row in rows))
+
                 load_data = []
-                for row in ws.iter_rows(min_row=3, values_only=True):
+                for row in rows:
                     # поготовили данные для загрузки в бд
                     load_data.append(
                         (int(lk_id), datetime.strptime(_date, "%d.%m.%y"), row[0], row[1], row[2], row[3],
                          row[4], row[5], int(row[6]), int(row[7]) if row[7] else 0, row[8], row[9], row[10], int(row[11]),
-                         float(row[12]), int(row[13]), float(row[14]), int(row[15]), datetime.now())
+                         float(row[12]), int(row[13]), float(row[14]), int(row[15]), datetime.now(),
+                         warehouse_ids.get(row[10]))
                     )
             except ValueError as e:
                 raise Exception(f"Ошибка подготовки данных для загрузки в БД  для {lk_id}: {e}. Строка: {row}")
@@ -1887,17 +1995,18 @@ async def load_to_db_report():
                         INSERT INTO myapp_orders (
                             "lk_id", "date", "brand", "thing", "season", "collection", "name", "supplierarticle", 
                             "nmid", "barcode", "techsize", "contract", "warehouse", "ord_count", "ord_sum",
-                            "redeem", "to_transfer", "quantity", "updated_at"
+                            "redeem", "to_transfer", "quantity", "updated_at", "warehouse_id"
                         )
                         VALUES (
-                            $1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14, $15, $16, $17, $18, $19
+                            $1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14, $15, $16, $17, $18, $19, $20
                         )
                         ON CONFLICT ("techsize", "date", "lk_id", "warehouse", "nmid") DO UPDATE SET
                             "ord_count" = EXCLUDED."ord_count",
                             "ord_sum" = EXCLUDED."ord_sum",
                             "redeem" = EXCLUDED."redeem",
                             "to_transfer" = EXCLUDED."to_transfer",
-                            "quantity" = EXCLUDED."quantity";
+                            "quantity" = EXCLUDED."quantity",
+                            "warehouse_id" = EXCLUDED."warehouse_id";
                     """
                 await insert_in_chunks(conn, query, load_data, chunk_size=1000)
             except Exception as e:
@@ -1911,8 +2020,6 @@ async def load_to_db_report():
             r.set(f"ToDelete_{lk_id}_{_date}", val)
     except Exception as e:
         logger.error(e)
-    finally:
-        await conn.close()
 
 
 async def delete_report():
@@ -1954,8 +2061,6 @@ async def delete_report():
                 }
             except Exception as e:
                 raise Exception(f"Ошибка получения кукков из БД: {e}")
-            finally:
-                await conn.close()
 
         cookies, headers = await get_cookies_headers(
             cookies_by_id[lk_id]["cookie"]["wbx-validation-key"],
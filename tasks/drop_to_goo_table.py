@@ -1,6 +1,4 @@
-import asyncio
-
-from fastapi_app.main import (wblk_table, get_dimensions, get_adv_conversion, ProductsStatRequest, get_adv_cost,
+from fastapi_app.main import (wblk_table, get_adv_conversion, ProductsStatRequest, get_adv_cost,
                               get_adv_reg_sales, ProductsQuantRequest, products_quantity_endpoint,
                               orders_endpoint, fin_report_endpoint, FinReportRequest)
 from sqlalchemy import select
@@ -12,6 +10,8 @@ from google.functions import (update_google_sheet_data, fetch_google_sheet_data,
                               CREDENTIALS_FILE, clear_list)
 from datetime import date, datetime, timedelta
 from fastapi_app.main import database
+from database.dimensions import get_dimensions_snapshot, refresh_dimensions_snapshot
+import json
 
 
 logger = ContextLogger(logging.getLogger("core"))
@@ -35,7 +35,7 @@ async def get_sloy() -> dict:
 async def upload_dimensions_to_google(**kwargs):
     url = kwargs.get("url")
     name = "Dimensions"
-    result = await get_dimensions(token=BEARER)
+    result = json.loads(get_dimensions_snapshot() or await refresh_dimensions_snapshot())
 
     headers = ["inn", "article_code", "img_url", "nmid", "subjectname", "height", "length", "width", "Слой"]
     data = [headers]
@@ -133,26 +133,15 @@ async def upload_advconversion_to_google(**kwargs):
 
     if mode == "Dima":
         date_from_str = await get_first_day_last_month()
-        payloads = [
-            ProductsStatRequest(inn=inn, date_from=date_from_str)
-            for inn, name in inns.items()
-        ]
+        payload = ProductsStatRequest(inn=list(inns), date_from=date_from_str)
     elif mode == "Anna":
         date_from_str = await get_last_week_monday()
         date_to_str = await get_last_week_sunday()
 
-        payloads = [
-            ProductsStatRequest(inn=inn, date_from=date_from_str, date_to=date_to_str)
-            for inn, name in inns.items()
-        ]
-
-    # Запускаем все запросы параллельно
-    results_list = await asyncio.gather(
-        *[get_adv_conversion(payload=payload, token=BEARER) for payload in payloads]
-    )
+        payload = ProductsStatRequest(inn=list(inns), date_from=date_from_str, date_to=date_to_str)
 
-    # Создаем словарь: ключ — inn, значение — результат
-    results_by_inn = {inn: result for inn, result in zip(inns, results_list)}
+    # Один пакетный запрос по всем ИНН: результат уже разложен по ИНН
+    results_by_inn = await get_adv_conversion(payload=payload, token=BEARER)
 
     reform_data = {}
 
@@ -241,7 +230,7 @@ async def upload_advcost_to_google(**kwargs):
     date_from_str = await get_first_day_last_month()
 
     if inns:
-        [int(row) for row in inns]
+        inns = [int(row) for row in inns]
     else:
         query_inns = select(
             wblk_table.c.inn
@@ -249,18 +238,10 @@ async def upload_advcost_to_google(**kwargs):
         rows = await database.fetch_all(query_inns)
         inns = [int(row["inn"]) for row in rows]
 
-    payloads = [
-        ProductsStatRequest(inn=inn, date_from=date_from_str)
-        for inn in inns
-    ]
-
-    # Запускаем все запросы параллельно
-    results_list = await asyncio.gather(
-        *[get_adv_cost(payload=payload, token=BEARER) for payload in payloads]
-    )
+    payload = ProductsStatRequest(inn=list(inns), date_from=date_from_str)
 
-    # Создаем словарь: ключ — inn, значение — результат
-    results_by_inn = {inn: result for inn, result in zip(inns, results_list)}
+    # Один пакетный запрос по всем ИНН: результат уже разложен по ИНН
+    results_by_inn = await get_adv_cost(payload=payload, token=BEARER)
 
 
     headers = ["inn", "артикул продавца", "nmid", "cost", "color", "date_wb", "слой"]
@@ -327,26 +308,15 @@ async def upload_salesreport_to_google(**kwargs):
 
     if mode == "Dima":
         date_from_str = await get_first_day_last_month()
-        payloads = [
-            ProductsStatRequest(inn=inn, date_from=date_from_str)
-            for inn, name in inns.items()
-        ]
+        payload = ProductsStatRequest(inn=list(inns), date_from=date_from_str)
     elif mode == "Anna":
         date_from_str = await get_last_week_monday()
         date_to_str = await get_last_week_sunday()
 
-        payloads = [
-            ProductsStatRequest(inn=inn, date_from=date_from_str, date_to=date_to_str)
-            for inn, name in inns.items()
-        ]
-
-    # Запускаем все запросы параллельно
-    results_list = await asyncio.gather(
-        *[get_adv_reg_sales(payload=payload, token=BEARER) for payload in payloads]
-    )
+        payload = ProductsStatRequest(inn=list(inns), date_from=date_from_str, date_to=date_to_str)
 
-    # Создаем словарь: ключ — inn, значение — результат
-    results_by_inn = {inn: result for inn, result in zip(inns, results_list)}
+    # Один пакетный запрос по всем ИНН: результат уже разложен по ИНН
+    results_by_inn = await get_adv_reg_sales(payload=payload, token=BEARER)
 
     reform_data = {}
 
@@ -443,18 +413,10 @@ async def upload_ostatki_to_google(**kwargs):
     rows = await database.fetch_all(query_inns)
     inns = {int(row["inn"]): row["name"] for row in rows}
 
-    payloads = [
-        ProductsQuantRequest(inn=inn)
-        for inn, name in inns.items()
-    ]
-
-    # Запускаем все запросы параллельно
-    results_list = await asyncio.gather(
-        *[products_quantity_endpoint(payload=payload, token=BEARER) for payload in payloads]
-    )
+    payload = ProductsQuantRequest(inn=list(inns))
 
-    # Создаем словарь: ключ — inn, значение — результат
-    results_by_inn = {inn: result for inn, result in zip(inns, results_list)}
+    # Один пакетный запрос по всем ИНН: результат уже разложен по ИНН
+    results_by_inn = await products_quantity_endpoint(payload=payload, token=BEARER)
     reform_data = {}
 
     if mode == "Dima":
@@ -552,18 +514,10 @@ async def upload_products_orders_to_google(**kwargs):
         rows = await database.fetch_all(query_inns)
         inns = [int(row["inn"]) for row in rows]
 
-    payloads = [
-        ProductsStatRequest(inn=inn, date_from=date_from_str)
-        for inn in inns
-    ]
-
-    # Запускаем все запросы параллельно
-    results_list = await asyncio.gather(
-        *[orders_endpoint(payload=payload, token=BEARER) for payload in payloads]
-    )
+    payload = ProductsStatRequest(inn=list(inns), date_from=date_from_str)
 
-    # Создаем словарь: ключ — inn, значение — результат
-    results_by_inn = {inn: result for inn, result in zip(inns, results_list)}
+    # Один пакетный запрос по всем ИНН: результат уже разложен по ИНН
+    results_by_inn = await orders_endpoint(payload=payload, token=BEARER)
 
     headers = [
         "inn", "vendorcode", "nmid", "date_wb", "color", "ordersSumRub", "ordersCount", "Слой"
@@ -633,21 +587,20 @@ async def upload_fin_report_to_google(**kwargs):
     if mode == "Dima":
         date_from_str = await get_first_day_last_month()
 
-        payloads = [FinReportRequest(
-            inn=inn,
+        payload = FinReportRequest(
+            inn=list(inns),
             date_from=date_from_str,
             supplier_oper_name=['возврат', 'добровольная компенсация при возврате',
                                 'компенсация скидки по программе лояльности', 'компенсация ущерба',
                                 'коррекция логистики',
                                 'логистика', 'платная приемка', 'продажа', 'стоимость участия в программе лояльности',
                                 'сумма удержанная за начисленные баллы программы лояльности', 'удержание', 'штраф'])
-            for inn, name in inns.items()]
     elif mode == "Anna":
         date_from_str = await get_last_week_monday()
         date_to_str = await get_last_week_sunday()
 
-        payloads = [FinReportRequest(
-            inn=inn,
+        payload = FinReportRequest(
+            inn=list(inns),
             date_from=date_from_str,
             date_to=date_to_str,
             supplier_oper_name=['возврат', 'добровольная компенсация при возврате',
@@ -655,14 +608,11 @@ async def upload_fin_report_to_google(**kwargs):
                                 'коррекция логистики',
                                 'логистика', 'платная приемка', 'продажа', 'стоимость участия в программе лояльности',
                                 'сумма удержанная за начисленные баллы программы лояльности', 'удержание', 'штраф'])
-            for inn, name in inns.items()]
 
 
-    # Запускаем все запросы параллельно
-    results_list = await asyncio.gather(*[fin_report_endpoint(payload=payload, token=BEARER) for payload in payloads])
-
-    # Создаем словарь: ключ — inn, значение — результат
-    results_by_inn = {inn: result["data"] for inn, result in zip(inns, results_list)}
+    # Один пакетный запрос по всем ИНН: результат уже разложен по ИНН
+    results = await fin_report_endpoint(payload=payload, token=BEARER)
+    results_by_inn = {inn: result["data"] for inn, result in results.items()}
     reform_data = {}
 
     if mode == "Dima":
@@ -815,27 +765,23 @@ async def upload_save_data_to_google(**kwargs):
     if mode == "Dima":
         date_from_str = await get_first_day_last_month()
 
-        payloads = [FinReportRequest(
-            inn=inn,
+        payload = FinReportRequest(
+            inn=list(inns),
             date_from=date_from_str,
             supplier_oper_name=['хранение', 'хранение товара с низким индексом остатка'])
-            for inn, name in inns.items()]
     elif mode == "Anna":
         date_from_str = await get_last_week_monday()
         date_to_str = await get_last_week_sunday()
 
-        payloads = [FinReportRequest(
-            inn=inn,
+        payload = FinReportRequest(
+            inn=list(inns),
             date_from=date_from_str,
             date_to=date_to_str,
             supplier_oper_name=['хранение', 'хранение товара с низким индексом остатка'])
-            for inn, name in inns.items()]
-
-    # Запускаем все запросы параллельно
-    results_list = await asyncio.gather(*[fin_report_endpoint(payload=payload, token=BEARER) for payload in payloads])
 
-    # Создаем словарь: ключ — inn, значение — результат
-    results_by_inn = {inn: result["data"] for inn, result in zip(inns, results_list)}
+    # Один пакетный запрос по всем ИНН: результат уже разложен по ИНН
+    results = await fin_report_endpoint(payload=payload, token=BEARER)
+    results_by_inn = {inn: result["data"] for inn, result in results.items()}
     reform_data = {}
 
     if mode == "Dima":
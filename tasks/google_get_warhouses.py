@@ -1,6 +1,6 @@
 import json
 from database.DataBase import async_connect_to_database
-from database.funcs_db import add_set_data_from_db
+from database.funcs_db import bulk_upsert_to_db
 from google.functions import fetch_google_sheet_data
 import asyncio
 import logging
@@ -24,19 +24,17 @@ async def get_area_warehouses():
         logger.error("Ошибка подключения к БД")
         raise
     try:
-        for area, warehouses in result.items():
-            warehouses_json = json.dumps(warehouses)
-            await conn.execute("""
-                    INSERT INTO myapp_areawarehouses (area, warehouses)
-                    VALUES ($1, $2)
-                    ON CONFLICT (area)
-                    DO UPDATE SET warehouses = EXCLUDED.warehouses;
-                """, area, warehouses_json)
+        await bulk_upsert_to_db(
+            conn=conn,
+            table_name="myapp_areawarehouses",
+            columns=["area", "warehouses"],
+            records=((area, json.dumps(warehouses)) for area, warehouses in result.items()),
+            conflict_fields=["area"],
+            touch_updated_at=False,
+        )
     except Exception as e:
         logger.error(f"Ошибка при добавлении/обновлении областей-складов. Ошибка: {e}")
         raise
-    finally:
-        await conn.close()
 
 # loop = asyncio.get_event_loop()
 # res = loop.run_until_complete(get_area_warehouses())
@@ -27,8 +27,6 @@ async def get_quantity_in_db(supplierarticles: list) -> dict:
         return result
     except Exception as e:
         logger.error(f"Ошибка получения данных из myapp_stocks. Запрос {request}. Error: {e}")
-    finally:
-        await conn.close()
 
 
 # loop = asyncio.get_event_loop()
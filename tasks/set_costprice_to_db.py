@@ -1,4 +1,5 @@
 from database.DataBase import async_connect_to_database
+from database.table_versions import invalidates
 from google.functions import fetch_google_sheet_data
 import logging
 from context_logger import ContextLogger
@@ -6,6 +7,7 @@ from context_logger import ContextLogger
 logger = ContextLogger(logging.getLogger("core"))
 
 
+@invalidates("myapp_price")
 async def get_cost_price_from_google():
     url = "https://docs.google.com/spreadsheets/d/19hbmos6dX5WGa7ftRagZtbCVaY-bypjGNE2u0d9iltk/edit?gid=1431573654#gid=1431573654"
     data = fetch_google_sheet_data(
@@ -38,8 +40,6 @@ async def get_cost_price_from_google():
         await conn.execute(request)
     except Exception as e:
         logger.error(f"Ошибка обновления cost_price в myapp_price. Запрос {request}. Error: {e}")
-    finally:
-        await conn.close()
 
 # loop = asyncio.get_event_loop()
 # res = loop.run_until_complete(get_cost_price_from_google())
\ No newline at end of file
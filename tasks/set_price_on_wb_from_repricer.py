@@ -2,13 +2,14 @@ import asyncio
 import math
 import sympy as sp
 from database.DataBase import async_connect_to_database
+from database.table_versions import invalidates
 import logging
 from context_logger import ContextLogger
 from typing import List
 
 from myapp.models import Price
 from parsers.wildberies import wb_api
-import aiohttp
+from parsers.wb_session import wb_session
 from asgiref.sync import sync_to_async
 
 
@@ -57,8 +58,6 @@ async def get_price_from_db_dor_wb()->List[dict]:
         return columns
     except Exception as e:
         logger.error(f"Ошибка получения цен из БД для репрайсера. Error: {e}")
-    finally:
-        await conn.close()
 
 
 def get_price(
@@ -209,6 +208,7 @@ def get_main_status():
     return Price.objects.order_by('id').values_list('main_status', flat=True).first()
 
 
+@invalidates("myapp_price")
 async def set_price_on_wb_from_repricer():
     result = await get_price_from_db_dor_wb()
 
@@ -250,7 +250,7 @@ async def set_price_on_wb_from_repricer():
 
     if status_rep:
         try:
-            async with aiohttp.ClientSession() as session:
+            async with wb_session() as session:
                 for seller in param:
                     request[seller["API_KEY"]] = wb_api(session, seller)
                 await asyncio.gather(*request.values())
@@ -293,6 +293,4 @@ async def set_price_on_wb_from_repricer():
 
     except Exception as e:
         logger.error(f"Ошибка обновления цен в БД myapp_price после репрайсинга. Error: {e}")
-    finally:
-        await conn.close()
 